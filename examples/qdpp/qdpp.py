@@ -42,12 +42,22 @@
 #   OF THE POSSIBILITY OF SUCH DAMAGE.
 # -----------------------------------------------------------------------------
 
-"""Dining philosophers example"""
+"""Dining philosophers example
+
+With --bench the example runs as a load generator for the framework.
+Nothing is printed during the run, think and eat times default to zero
+ticks and a JSON object with the results is written on exit: events
+dispatched per second, latency from post or publish to dispatch of the
+table events on the monotonic clock, the queue high-water mark of each
+active object keyed by name, and peak RSS. Use --workers to run the
+philosophers in a WorkerPool, for counts beyond a thread each.
+"""
 
 # Standard
-from __future__ import with_statement
+from __future__ import print_function, with_statement
 import sys
 import os.path
+import threading
 sys.path.insert(0, os.path.join('..', '..'))
                                  # Expect us to be two levels below the library
 
@@ -69,6 +79,9 @@ TIMEOUT_SIG = MAX_PUB_SIG
 g_table = None
 g_philosophers = None
 g_state = None
+g_display_lock = threading.Lock()
+g_quiet = False  # No printing
+g_latencies = None  # List of seconds from creation to dispatch of events
 
 
 class TableEvt(qp.Event):
@@ -77,6 +90,13 @@ class TableEvt(qp.Event):
     def __init__(self, sig):
         qp.Event.__init__(self, sig)
         self.phil_num = -1
+        self.created = qp.monotonic()
+
+
+def note_latency(e):
+    """Note time from creation to dispatch of e when benchmarking"""
+    if g_latencies is not None:
+        g_latencies.append(qp.monotonic() - e.created)
 
 
 class Table(qp.Active):
@@ -100,10 +120,13 @@ class Table(qp.Active):
         self.stoppedNums_ = 0
 
     def initial(self, e):
-        print "Table.initial"
+        if not g_quiet:
+            print("Table.initial")
         self.INIT(Table.serving)
 
     def serving(self, e):
+        if isinstance(e, TableEvt):
+            note_latency(e)
         if e.sig == HUNGRY_SIG:
             n = e.phil_num
             assert n < self.count and not self.isHungry_[n]
@@ -155,7 +178,8 @@ class Table(qp.Active):
                 qp.QF.publish(pe)
             return 0
         elif e.sig == TERMINATE_SIG:
-            print "received TERMINATE-SIG"
+            if not g_quiet:
+                print("received TERMINATE-SIG")
             self.stop()
             return 0
         return qp.Hsm.top
@@ -174,6 +198,8 @@ class Philosopher(qp.Active):
     signals = [
         EAT_SIG,
     ]
+    think_time = THINK_TIME
+    eat_time = EAT_TIME
 
     def __init__(self, max_feed):
         qp.Active.__init__(self, Philosopher.initial)
@@ -181,14 +207,22 @@ class Philosopher(qp.Active):
         self.max_feed = max_feed
 
     def initial(self, e):
-        print "Philosopher.initial"
+        if not g_quiet:
+            print("Philosopher.initial")
         self.num_ = e.phil_num
         self.feedCtr_ = 0
         self.INIT(Philosopher.thinking)
 
+    def wait(self, ticks):
+        """Time out after ticks, at once if zero"""
+        if ticks:
+            self.timeEvt_.post_in(self, ticks)
+        else:
+            self.post_fifo(self.timeEvt_)
+
     def thinking(self, e):
         if e.sig == qp.ENTRY_SIG:
-            self.timeEvt_.post_in(self, THINK_TIME)
+            self.wait(self.think_time)
             return 0
         elif e.sig == TIMEOUT_SIG:
             self.TRAN(Philosopher.hungry)
@@ -203,6 +237,7 @@ class Philosopher(qp.Active):
             return 0
         elif e.sig == EAT_SIG:
             if e.phil_num == self.num_:
+                note_latency(e)
                 self.TRAN(Philosopher.eating)
                 return 0
         return qp.Hsm.top
@@ -210,7 +245,7 @@ class Philosopher(qp.Active):
     def eating(self, e):
         if e.sig == qp.ENTRY_SIG:
             self.feedCtr_ += 1    # one more feeding
-            self.timeEvt_.post_in(self, EAT_TIME)
+            self.wait(self.eat_time)
             return 0
         elif e.sig == qp.EXIT_SIG:
             pe = TableEvt(DONE_SIG)
@@ -237,7 +272,7 @@ class Philosopher(qp.Active):
 
 def displyPhilStat(n, stat):
     """Display  change of a philosopher"""
-    with qp.QF._lock:
+    with g_display_lock:
         global g_state
         if stat == "thinking":
             g_state[n] = " - "
@@ -245,6 +280,8 @@ def displyPhilStat(n, stat):
             g_state[n] = stat[:3]
         elif stat == "stopped":
             g_state[n] = " x "
+        if g_quiet:
+            return
         line = ""
         for index in range(g_table.count - 1, -1, -1):
             fork_state = g_table.fork_[index]
@@ -260,7 +297,7 @@ def displyPhilStat(n, stat):
         for s in g_state:
             assert not (s == "eat" and prev == "eat"), "Error"
             prev = s
-        print "%4d %s" % (qp.QF.get_time(), line)
+        print("%4d %s" % (qp.QF.get_time(), line))
 
 
 def terminate():
@@ -268,27 +305,98 @@ def terminate():
     qp.QF.publish(e)
 
 
+def run(count, max_feed, workers=0):
+    """Run count philosophers eating max_feed times each, in a WorkerPool
+    with workers threads if not zero. Returns seconds taken"""
+    global g_table, g_state, g_philosophers
+    size = max(128, 4 * count)
+    pool = None
+    if workers:
+        pool = qp.WorkerPool(workers)
+    g_table = Table(count=count)
+    g_state = [" - "] * count
+    g_philosophers = [Philosopher(max_feed=max_feed)
+                      for _n in range(count)]
+    start = qp.monotonic()
+    g_table.start(count + 1, size, None)  # Ready for the first hungry one
+    for n, philosopher in enumerate(g_philosophers):
+        ie = TableEvt(0)
+        ie.phil_num = n
+        philosopher.start(n + 1, size, ie, pool=pool)
+    qp.QF.run()
+    elapsed = qp.monotonic() - start
+    if pool is not None:
+        pool.stop()
+    return elapsed
+
+
+def percentile(values, fraction):
+    """Return value at fraction of sorted values"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def benchmark(count, max_feed, workers=0):
+    """Run quietly and return dict with results"""
+    import resource
+    global g_quiet, g_latencies
+    g_quiet = True
+    g_latencies = []
+    elapsed = run(count, max_feed, workers)
+    actives = [g_table] + g_philosophers
+    events = sum([a._dispatches for a in actives])
+    latencies = sorted(g_latencies)
+    high_water = dict([('philosopher_%d' % a.num_, a._queue._max)
+                       for a in g_philosophers])
+    high_water['table'] = g_table._queue._max
+    return {
+        'python': '%d.%d.%d' % sys.version_info[:3],
+        'philosophers': count,
+        'max_feed': max_feed,
+        'workers': workers,
+        'think_ticks': Philosopher.think_time,
+        'eat_ticks': Philosopher.eat_time,
+        'elapsed_s': elapsed,
+        'events': events,
+        'events_per_s': events / elapsed,
+        'latency_us': dict([(name, 1e6 * percentile(latencies, fraction))
+                            for name, fraction in [('p50', 0.5),
+                                                   ('p90', 0.9),
+                                                   ('p99', 0.99),
+                                                   ('max', 1.0)]]),
+        'high_water': high_water,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
 if __name__ == '__main__':
+    import json
     import optparse
-    import time
     parser = optparse.OptionParser()
     parser.add_option('--count', '-n', dest='count', default=10, type='int')
     parser.add_option('--maxfeed', dest='max_feed', default=200, type='int')
     parser.add_option('--time', dest='time', action='store_true',
                       default=False)
+    parser.add_option('--bench', dest='bench', action='store_true',
+                      default=False, help='run quietly, print JSON results')
+    parser.add_option('--think', dest='think', type='int',
+                      help='think time in ticks')
+    parser.add_option('--eat', dest='eat', type='int',
+                      help='eat time in ticks')
+    parser.add_option('--workers', dest='workers', default=0, type='int',
+                      help='run philosophers in a pool of workers threads')
     opts, args = parser.parse_args()
-
-    g_table = Table(count=opts.count)
-    g_state = [" - "] * opts.count
-    g_philosophers = [Philosopher(max_feed=opts.max_feed) \
-                      for _n in range(opts.count)]
-    start = time.time()
-    for n, philosopher in enumerate(g_philosophers):
-        ie = TableEvt(0)
-        ie.phil_num = n
-        philosopher.start(n + 1, 128, ie)
-    g_table.start(opts.count + 1, 128, None)
-    qp.QF.run()
-    print "exiting..."
-    if opts.time:
-        print time.time() - start
+    if opts.bench:
+        Philosopher.think_time = Philosopher.eat_time = 0
+    if opts.think is not None:
+        Philosopher.think_time = opts.think
+    if opts.eat is not None:
+        Philosopher.eat_time = opts.eat
+
+    if opts.bench:
+        result = benchmark(opts.count, opts.max_feed, opts.workers)
+        print(json.dumps(result, sort_keys=True))
+    else:
+        elapsed = run(opts.count, opts.max_feed, opts.workers)
+        print("exiting...")
+        if opts.time:
+            print(elapsed)
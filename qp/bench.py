@@ -0,0 +1,1017 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Micro benchmarks for the Quantum Framework
+
+Run from the library root with:
+python -m qp.bench [--publishers N] [--subscribers N] [--events N]
+                   [--timers N] [--duration S] [--only NAME,...]
+                   [--json] [--baseline FILE] [--threshold FRACTION]
+                   [--repeat N]
+
+With --json the results are written as one JSON document, which can be
+saved and given as --baseline to a later run. Timings are then compared
+with the baseline, and the exit status is 1 if any got slower by more than
+the threshold, default 10 percent. With --repeat each benchmark is run N
+times and the best of each timing is kept, which makes the comparison
+less sensitive to noise.
+"""
+
+# Standard
+from __future__ import with_statement
+import gc
+import json
+import multiprocessing
+import os
+try:
+    import cPickle as pickle
+except ImportError:  # Python 3
+    import pickle
+import shutil
+import sys
+import tempfile
+import time
+import threading
+
+# Local
+import qp
+import qp.codec
+import qp.journal
+import qp.ring
+
+try:
+    xrange
+except NameError:  # Python 3
+    xrange = range
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # Python 2
+    clock = qp.monotonic
+
+
+BENCH_SIG = qp.USER_SIG
+MIXED_SIG = qp.USER_SIG + 1
+IDLE_SIG = qp.USER_SIG + 2  # Subscribed by no one
+
+
+class Sink(qp.Active):
+    """Active object counting the events it receives"""
+
+    signals = [BENCH_SIG]
+
+    def __init__(self, expected):
+        qp.Active.__init__(self, Sink.initial)
+        self.expected = expected
+        self.received = 0
+        self.done = threading.Event()
+
+    def initial(self, e):
+        self.INIT(Sink.counting)
+
+    def counting(self, e):
+        if e.sig == BENCH_SIG:
+            self.received += 1
+            if self.received == self.expected:
+                self.done.set()
+            return 0
+        return qp.Hsm.top
+
+
+def start_sinks(count, expected, size, pool=None):
+    """Start count sinks at priority 1..count"""
+    sinks = []
+    for n in range(count):
+        sink = Sink(expected)
+        sink.start(n + 1, size, None, pool=pool)
+        sinks.append(sink)
+    return sinks
+
+
+def stop_sinks(sinks, pool=None):
+    """Stop sinks and wait for their threads, or the pool, to finish"""
+    for sink in sinks:
+        sink.stop()
+    if pool is not None:
+        pool.stop()
+        return
+    for sink in sinks:
+        sink._thread.join()
+
+
+def publish_contention(publishers=8, subscribers=8, events=10000):
+    """Let several threads publish concurrently to the same subscribers.
+    Returns a dict with timing results."""
+    expected = publishers * events
+    sinks = start_sinks(subscribers, expected, expected + 1)
+    e = qp.Event(BENCH_SIG)
+    go = threading.Event()
+
+    def publish():
+        go.wait()
+        for _n in xrange(events):
+            qp.QF.publish(e)
+
+    threads = [threading.Thread(target=publish) for _n in range(publishers)]
+    for thread in threads:
+        thread.start()
+    start = time.time()
+    go.set()
+    for thread in threads:
+        thread.join()
+    published = time.time() - start
+    for sink in sinks:
+        sink.done.wait()
+    delivered = time.time() - start
+    stop_sinks(sinks)
+    return {
+        'name': 'publish_contention',
+        'publishers': publishers,
+        'subscribers': subscribers,
+        'events': expected,
+        'publish_s': published,
+        'deliver_s': delivered,
+        'events_per_s': expected / delivered,
+    }
+
+
+def publish_burst(subscribers=8, events=10000, batch=1000):
+    """Publish events in bursts, one by one with QF.publish and in batches
+    with QF.publish_many. Returns a dict with timing results."""
+    batch = min(batch, events)
+    events -= events % batch  # Whole bursts only
+    result = {
+        'name': 'publish_burst',
+        'subscribers': subscribers,
+        'events': events,
+        'batch': batch,
+    }
+    burst = [qp.Event(BENCH_SIG) for _n in xrange(batch)]
+    for method in ['publish', 'publish_many']:
+        sinks = start_sinks(subscribers, events, events + 1)
+        start = time.time()
+        for _n in xrange(events // batch):
+            if method == 'publish':
+                for e in burst:
+                    qp.QF.publish(e)
+            else:
+                qp.QF.publish_many(burst)
+        for sink in sinks:
+            sink.done.wait()
+        elapsed = time.time() - start
+        stop_sinks(sinks)
+        result[method + '_events_per_s'] = events / elapsed
+    return result
+
+
+def pool_fanout(actives=1000, events=100, workers=4):
+    """Publish events to many active objects, running in a thread each and
+    in a WorkerPool. Returns a dict with timing results."""
+    result = {
+        'name': 'pool_fanout',
+        'actives': actives,
+        'events': events,
+        'workers': workers,
+    }
+    e = qp.Event(BENCH_SIG)
+    for mode in ['threads', 'pool']:
+        pool = None
+        if mode == 'pool':
+            pool = qp.WorkerPool(workers)
+        sinks = start_sinks(actives, events, events + 1, pool)
+        start = time.time()
+        for _n in xrange(events):
+            qp.QF.publish(e)
+        for sink in sinks:
+            sink.done.wait()
+        elapsed = time.time() - start
+        stop_sinks(sinks, pool)
+        result[mode + '_events_per_s'] = actives * events / elapsed
+    return result
+
+
+class SeqEvt(qp.Event):
+    """Event with a sequence number"""
+
+    fields = [('n', 'q')]
+
+    def __init__(self, n):
+        qp.Event.__init__(self, BENCH_SIG)
+        self.n = n
+
+
+SEQ_CODEC = qp.codec.Codec()
+SEQ_CODEC.register(BENCH_SIG, SeqEvt)
+
+
+def _ring_producer(path, events):
+    ring = qp.ring.EventRing(path, SEQ_CODEC)
+    for n in xrange(events):
+        ring.post(SeqEvt(n))
+    ring.close()
+
+
+def _queue_producer(queue, events):
+    for n in xrange(events):
+        queue.put(SeqEvt(n))
+
+
+def ring_transport(events=100000):
+    """Move events from another process through an EventRing and through a
+    multiprocessing.Queue. Returns a dict with timing results."""
+    result = {'name': 'ring_transport', 'events': events}
+    directory = tempfile.mkdtemp(dir=os.path.isdir('/dev/shm') and
+                                 '/dev/shm' or None)
+    path = os.path.join(directory, 'ring')
+    ring = qp.ring.EventRing(path, SEQ_CODEC, create=True)
+    producer = multiprocessing.Process(target=_ring_producer,
+                                       args=(path, events))
+    start = time.time()
+    producer.start()
+    received = 0
+    while received < events:
+        received += len(ring.read(1024))
+    result['ring_events_per_s'] = events / (time.time() - start)
+    producer.join()
+    ring.close()
+    ring.unlink()
+    os.rmdir(directory)
+
+    queue = multiprocessing.Queue(4096)
+    producer = multiprocessing.Process(target=_queue_producer,
+                                       args=(queue, events))
+    start = time.time()
+    producer.start()
+    for _n in xrange(events):
+        queue.get()
+    result['queue_events_per_s'] = events / (time.time() - start)
+    producer.join()
+    return result
+
+
+class SampleEvt(qp.Event):
+    """Event with a few fields of different types"""
+
+    fields = [('sensor', 'i'), ('value', 'd'), ('seq', 'q'), ('unit', '8s')]
+
+    def __init__(self, sensor, value, seq, unit):
+        qp.Event.__init__(self, BENCH_SIG)
+        self.sensor = sensor
+        self.value = value
+        self.seq = seq
+        self.unit = unit
+
+
+def codec_throughput(events=100000):
+    """Encode and decode events with qp.codec, pickle and JSON. Returns a
+    dict with timing results."""
+    result = {'name': 'codec_throughput', 'events': events}
+    codec = qp.codec.Codec()
+    codec.register(BENCH_SIG, SampleEvt)
+    samples = [SampleEvt(n % 16, n * 0.5, n, b'degC') for n in xrange(events)]
+
+    def from_json(data):
+        values = json.loads(data)
+        e = SampleEvt.__new__(SampleEvt)
+        e.__dict__.update(values)
+        return e
+
+    for name, encode, decode in [
+            ('codec', codec.encode, codec.decode),
+            ('pickle', lambda e: pickle.dumps(e, pickle.HIGHEST_PROTOCOL),
+             pickle.loads),
+            ('json', lambda e: json.dumps(e.__dict__, default=bytes.decode),
+             from_json)]:
+        start = time.time()
+        records = [encode(e) for e in samples]
+        result['%s_encode_per_s' % name] = events / (time.time() - start)
+        start = time.time()
+        for r in records:
+            decode(r)
+        result['%s_decode_per_s' % name] = events / (time.time() - start)
+        result['%s_bytes' % name] = len(records[0])
+
+    buf = memoryview(b''.join([codec.encode(e) for e in samples]))
+    start = time.time()
+    codec.decode_many(buf)
+    result['codec_decode_many_per_s'] = events / (time.time() - start)
+    return result
+
+
+def journal_replay(events=200000):
+    """Append events to a journal and replay them into a sink. Returns a
+    dict with timing results."""
+    result = {'name': 'journal_replay', 'events': events}
+    directory = tempfile.mkdtemp()
+    journal = qp.journal.Journal(directory, SEQ_CODEC)
+    samples = [SeqEvt(n) for n in xrange(events)]
+    start = time.time()
+    for e in samples:
+        journal.append(1, e)
+    journal.close()
+    result['append_per_s'] = events / (time.time() - start)
+
+    sinks = start_sinks(1, events, 10)
+    journal = qp.journal.Journal(directory, SEQ_CODEC)
+    journal.attach(sinks[0])
+    start = time.time()
+    journal.replay()
+    result['replay_per_s'] = events / (time.time() - start)
+    journal.detach(sinks[0])
+    journal.close()
+    start = time.time()
+    for e in samples:
+        qp.Hsm.dispatch(sinks[0], e)
+    result['dispatch_only_per_s'] = events / (time.time() - start)
+    stop_sinks(sinks)
+    shutil.rmtree(directory)
+    return result
+
+
+class Waiter(qp.Active):
+    """Active object noting when it gets each event"""
+
+    def __init__(self):
+        qp.Active.__init__(self, Waiter.initial)
+        self.received = threading.Event()
+        self.at = None
+
+    def initial(self, e):
+        self.INIT(Waiter.waiting)
+
+    def waiting(self, e):
+        if e.sig == BENCH_SIG:
+            self.at = qp.monotonic()
+            self.received.set()
+            return 0
+        return qp.Hsm.top
+
+
+def timer_jitter(count=200, seconds=0.0015):
+    """Arm a time event count times, seconds ahead, and measure how late it
+    is dispatched. Also measures how far the tick counter is off after the
+    run. Returns a dict with timing results."""
+    result = {'name': 'timer_jitter', 'count': count, 'seconds': seconds}
+    qf = qp.Framework('jitter')
+    waiter = Waiter()
+    waiter.start(1, 10, None, qf)
+    start = qp.monotonic()
+    thread = qf.run_in_thread()
+    t = qp.TimeEvt(BENCH_SIG, qf)
+    late = []
+    for _n in xrange(count):
+        waiter.received.clear()
+        deadline = qp.monotonic() + seconds
+        t.post_in_seconds(waiter, seconds)
+        waiter.received.wait(1.0)
+        late.append(waiter.at - deadline)
+    expected_ticks = int((qp.monotonic() - start) / qp.TICK_S)
+    result['tick_drift'] = expected_ticks - qf.get_time()
+    qf.shutdown(timeout=1.0)
+    thread.join()
+    late.sort()
+    result['late_mean_us'] = 1e6 * sum(late) / count
+    result['late_p99_us'] = 1e6 * late[int(0.99 * (count - 1))]
+    result['late_max_us'] = 1e6 * late[-1]
+    return result
+
+
+def timed_loop(func, stop):
+    """Call func until stop is set. The calls are timed in batches of
+    TIMED_BATCH, returns list of the mean call duration of each batch"""
+    waits = []
+    while not stop.is_set():
+        start = clock()
+        for _n in xrange(TIMED_BATCH):
+            func()
+        waits.append((clock() - start) / TIMED_BATCH)
+    return waits
+
+
+def mixed_load(timers=5000, duration=1.0):
+    """Measure subscribe and queue statistics latency while another thread
+    keeps ticking a large number of armed timers. Returns a dict with
+    timing results."""
+    sink, = start_sinks(1, 0, 10)
+    time_evts = [qp.TimeEvt(MIXED_SIG) for _n in xrange(timers)]
+    for t in time_evts:
+        t.post_every(sink, 1000000000)  # Armed but never expiring
+    stop = threading.Event()
+    ticks = []
+    scrapes = []
+    ticker = threading.Thread(
+        target=lambda: ticks.extend(timed_loop(qp.QF.tick, stop)))
+    scraper = threading.Thread(
+        target=lambda: scrapes.extend(timed_loop(qp.QF.get_queue_margins,
+                                                 stop)))
+
+    def subscription():
+        sink.subscribe(MIXED_SIG)
+        sink.unsubscribe(MIXED_SIG)
+
+    ticker.start()
+    scraper.start()
+    timer = threading.Timer(duration, stop.set)
+    timer.start()
+    subscriptions = timed_loop(subscription, stop)
+    ticker.join()
+    scraper.join()
+    for t in time_evts:
+        t.disarm()
+    stop_sinks([sink])
+    return {
+        'name': 'mixed_load',
+        'timers': timers,
+        'ticks': len(ticks),
+        'tick_mean_us': 1e6 * sum(ticks) / len(ticks),
+        'subscribe_mean_us': 1e6 * sum(subscriptions) / len(subscriptions),
+        'subscribe_max_us': 1e6 * max(subscriptions),
+        'scrape_mean_us': 1e6 * sum(scrapes) / len(scrapes),
+        'scrape_max_us': 1e6 * max(scrapes),
+    }
+
+
+def lock_split(timers=5000, duration=1.0):
+    """Measure subscribe latency while another thread ticks timers that
+    all expire on every tick, so each tick holds the timer lock while it
+    reschedules them. Runs once with the framework locks as they are and
+    once with the registry, subscription and timer locks aliased to one
+    lock, as before they were split. Returns a dict with timing results."""
+    result = {'name': 'lock_split', 'timers': timers}
+    for mode in ['split', 'shared']:
+        qf = qp.Framework('locks')
+        if mode == 'shared':
+            qf._subscriber_lock = qf._timer_lock = qf._active_lock
+        sink = Sink(0)
+        sink.start(1, 10, None, qf)
+        time_evts = [qp.TimeEvt(IDLE_SIG, qf) for _n in xrange(timers)]
+        for t in time_evts:
+            t.publish_every(1)
+        stop = threading.Event()
+        ticks = []
+        ticker = threading.Thread(
+            target=lambda: ticks.extend(timed_loop(qf.tick, stop)))
+
+        def subscription():
+            sink.subscribe(MIXED_SIG)
+            sink.unsubscribe(MIXED_SIG)
+
+        ticker.start()
+        timer = threading.Timer(duration, stop.set)
+        timer.start()
+        subscriptions = timed_loop(subscription, stop)
+        ticker.join()
+        qf.shutdown(timeout=1.0)
+        result.update({
+            mode + '_tick_mean_us': 1e6 * sum(ticks) / len(ticks),
+            mode + '_subscribe_mean_us':
+                1e6 * sum(subscriptions) / len(subscriptions),
+            mode + '_subscribe_max_us': 1e6 * max(subscriptions),
+        })
+    return result
+
+
+def timer_rearm(timers=10000, rearms=100000):
+    """Rearm and disarm timers among many armed ones, as an inactivity
+    timeout restarted on every message does. Returns a dict with timing
+    results."""
+    qf = qp.Framework('rearm')
+    sink = Sink(0)
+    sink.start(1, 10, None, qf)
+    time_evts = [qp.TimeEvt(MIXED_SIG, qf) for _n in xrange(timers)]
+    for t in time_evts:
+        t.post_in(sink, 1000000000)
+    step = timers // 100 or 1  # Spread over the timers
+    start = time.time()
+    for n in xrange(rearms):
+        time_evts[(n * step) % timers].rearm(1000000000)
+    rearm_s = time.time() - start
+    start = time.time()
+    for t in time_evts:
+        t.disarm()
+    disarm_s = time.time() - start
+    qf.shutdown(timeout=1.0)
+    return {
+        'name': 'timer_rearm',
+        'timers': timers,
+        'rearm_us': 1e6 * rearm_s / rearms,
+        'disarm_us': 1e6 * disarm_s / timers,
+    }
+
+
+def lane_post(events=200000):
+    """Post events to and take them from the normal lane of a plain QEQueue
+    and of a LaneQueue with two urgent lanes. Returns a dict with timing
+    results."""
+    result = {'name': 'lane_post', 'events': events}
+    e = qp.Event(BENCH_SIG)
+    for name, queue in [
+            ('qequeue', qp.QEQueue(events)),
+            ('lanequeue', qp.LaneQueue(events, [16, 16],
+                                       {MIXED_SIG: 1}))]:
+        start = time.time()
+        for _n in xrange(events):
+            queue.post_fifo(e)
+        result['%s_post_us' % name] = 1e6 * (time.time() - start) / events
+        start = time.time()
+        for _n in xrange(events):
+            queue.get_nowait()
+        result['%s_get_us' % name] = 1e6 * (time.time() - start) / events
+    return result
+
+
+def io_fanout(connections=1000, rounds=20):
+    """Make one byte readable on each of connections pipes, rounds times,
+    and count the events posted to one sink by the framework watching all
+    of them, and by one reader thread per pipe. Returns a dict with timing
+    results."""
+    result = {'name': 'io_fanout', 'connections': connections,
+              'rounds': rounds}
+    e = qp.Event(BENCH_SIG)
+
+    def read(fd, events):
+        os.read(fd, 4096)
+        return e
+    for mode in ['reactor', 'threads']:
+        qf = qp.Framework('io')
+        sink = Sink(connections * rounds)
+        sink.start(1, connections + 1, None, qf)
+        pipes = [os.pipe() for _n in xrange(connections)]
+        readers = []
+        if mode == 'reactor':
+            for r, w in pipes:
+                sink.watch(r, read)
+            thread = qf.run_in_thread()
+        else:
+            def forward(fd):
+                while os.read(fd, 4096):
+                    sink.post_fifo(e)
+            for r, w in pipes:
+                reader = threading.Thread(target=forward, args=(r,))
+                reader.daemon = True
+                reader.start()
+                readers.append(reader)
+        start = time.time()
+        for n in xrange(rounds):
+            for r, w in pipes:
+                os.write(w, b'x')
+            while sink.received < (n + 1) * connections:
+                time.sleep(0.0001)
+        result['%s_us' % mode] = 1e6 * (time.time() - start) / (
+            connections * rounds)
+        sink.unwatch_all()
+        for r, w in pipes:
+            os.close(w)  # Reader threads see end of file
+        for reader in readers:
+            reader.join()
+        for r, w in pipes:
+            os.close(r)
+        qf.shutdown(timeout=1.0)
+        if mode == 'reactor':
+            thread.join()
+    return result
+
+
+class Toggle(qp.Hsm):
+    """State machine switching between two substates of one parent on each
+    event, running their exit and entry actions"""
+
+    def __init__(self):
+        qp.Hsm.__init__(self, Toggle.initial)
+        self.entries = 0
+
+    def initial(self, e):
+        self.INIT(Toggle.on)
+
+    def parent(self, e):
+        return qp.Hsm.top
+
+    def on(self, e):
+        if e.sig == qp.ENTRY_SIG:
+            self.entries += 1
+            return 0
+        if e.sig == BENCH_SIG:
+            self.TRAN(Toggle.off)
+            return 0
+        return Toggle.parent
+
+    def off(self, e):
+        if e.sig == qp.ENTRY_SIG:
+            self.entries += 1
+            return 0
+        if e.sig == BENCH_SIG:
+            self.TRAN(Toggle.on)
+            return 0
+        return Toggle.parent
+
+
+def dispatch_publish(events=200000):
+    """Dispatch events straight to a state machine, and publish events to
+    an active object in its own thread. Run with different interpreters to
+    compare them on the same workload. Returns a dict with timing
+    results."""
+    result = {'name': 'dispatch_publish', 'events': events,
+              'python': '%d.%d.%d' % sys.version_info[:3]}
+    e = qp.Event(BENCH_SIG)
+    hsm = Toggle()
+    hsm.init()
+    start = time.time()
+    for _n in xrange(events):
+        hsm.dispatch(e)
+    result['dispatch_us'] = 1e6 * (time.time() - start) / events
+    qf = qp.Framework('dispatch')
+    sink = Sink(events)
+    sink.start(1, events + 1, None, qf)
+    start = time.time()
+    for _n in xrange(events):
+        qf.publish(e)
+    sink.done.wait()
+    result['publish_us'] = 1e6 * (time.time() - start) / events
+    sink.stop()
+    sink._thread.join()
+    return result
+
+
+class Cruncher(qp.Active):
+    """Active object doing work iterations of arithmetic per event"""
+
+    def __init__(self, expected, work):
+        qp.Active.__init__(self, Cruncher.initial)
+        self.expected = expected
+        self.work = work
+        self.received = 0
+        self.total = 0
+        self.done = threading.Event()
+
+    def initial(self, e):
+        self.INIT(Cruncher.crunching)
+
+    def crunching(self, e):
+        if e.sig == BENCH_SIG:
+            total = 0
+            for n in xrange(self.work):
+                total += n * n
+            self.total += total
+            self.received += 1
+            if self.received == self.expected:
+                self.done.set()
+            return 0
+        return qp.Hsm.top
+
+
+def parallel_actives(counts=(1, 2, 4, 8), events=500, work=1000):
+    """Let count independent active objects, each in its own thread, do CPU
+    bound work on events posted to them. With a GIL the throughput stays
+    flat, a free-threaded interpreter scales it with the number of cores.
+    Returns a dict with timing results."""
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    result = {'name': 'parallel_actives', 'events': events, 'work': work,
+              'gil': gil}
+    e = qp.Event(BENCH_SIG)
+    for count in counts:
+        qf = qp.Framework('parallel')
+        crunchers = []
+        for n in range(count):
+            cruncher = Cruncher(events, work)
+            cruncher.start(n + 1, events + 1, None, qf)
+            crunchers.append(cruncher)
+        start = time.time()
+        for cruncher in crunchers:
+            cruncher.post_fifo_many([e] * events)
+        for cruncher in crunchers:
+            cruncher.done.wait()
+        rate = count * events / (time.time() - start)
+        result['actives_%d_events_per_s' % count] = rate
+        result['actives_%d_speedup' % count] = \
+            rate / result['actives_%d_events_per_s' % counts[0]]
+        stop_sinks(crunchers)
+    return result
+
+
+PERCENTILES = [('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0)]
+TIMED_BATCH = 10    # Calls timed together, short calls are below clock step
+NOISE_US = 1.0      # Smaller differences in us are never regressions
+
+# Timings where a larger value is better, the rest are durations
+FASTER_SUFFIXES = ('_per_s', '_speedup')
+SLOWER_SUFFIXES = ('_us', '_s')
+
+
+def percentiles(prefix, durations):
+    """Return dict with the p50, p90, p99 and max of a list of durations in
+    seconds, as prefix_p50_us and so on"""
+    durations = sorted(durations)
+    last = len(durations) - 1
+    return dict([('%s_%s_us' % (prefix, p), 1e6 * durations[int(f * last)])
+                 for p, f in PERCENTILES])
+
+
+class BlockingSink(Sink):
+    """Sink throttling posters when its queue is full"""
+
+    overflow = qp.OVERFLOW_BLOCK
+
+
+def timed_posts(post, e, events, go, durations):
+    """Wait for go, then call post(e) events times. The calls are timed in
+    batches of TIMED_BATCH, the mean duration of each batch is added to
+    durations"""
+    go.wait()
+    own = []
+    for _n in xrange(events // TIMED_BATCH):
+        start = clock()
+        for _m in xrange(TIMED_BATCH):
+            post(e)
+        own.append((clock() - start) / TIMED_BATCH)
+    for _n in xrange(events % TIMED_BATCH):
+        post(e)
+    durations.extend(own)
+
+
+def run_posters(post, threads, events):
+    """Let threads threads call post events times each, at the same time.
+    Returns (list of call durations, seconds from start to all posted)"""
+    e = qp.Event(BENCH_SIG)
+    go = threading.Event()
+    durations = []
+    posters = [threading.Thread(target=timed_posts,
+                                args=(post, e, events, go, durations))
+               for _n in range(threads)]
+    for poster in posters:
+        poster.start()
+    gc.disable()  # As timeit does
+    try:
+        start = time.time()
+        go.set()
+        for poster in posters:
+            poster.join()
+    finally:
+        gc.enable()
+    return durations, start
+
+
+def publish_fanout(subscribers=(1, 8, 63), publishers=(1, 4),
+                   depths=(16, 1024), events=1000):
+    """Publish from each number of threads to each number of subscribers,
+    with queues of each depth that block publishers when full. Measures
+    the latency of QF.publish, see timed_posts, and the throughput until
+    all subscribers got all events. Returns a dict with timing results."""
+    result = {'name': 'publish_fanout', 'events': events}
+    for subs in subscribers:
+        for pubs in publishers:
+            for depth in depths:
+                qf = qp.Framework('fanout')
+                expected = pubs * events
+                sinks = []
+                for n in range(subs):
+                    sink = BlockingSink(expected)
+                    sink.start(n + 1, depth, None, qf)
+                    sinks.append(sink)
+                durations, start = run_posters(qf.publish, pubs, events)
+                for sink in sinks:
+                    sink.done.wait()
+                elapsed = time.time() - start
+                stop_sinks(sinks)
+                case = 'subs_%d_pubs_%d_depth_%d' % (subs, pubs, depth)
+                result[case + '_events_per_s'] = subs * expected / elapsed
+                result.update(percentiles(case + '_publish', durations))
+    return result
+
+
+def post_contention(threads=(1, 2, 4, 8), events=5000, depth=1024):
+    """Post from each number of threads to one active object, with a queue
+    that blocks posters when full. Returns a dict with timing results."""
+    result = {'name': 'post_contention', 'events': events, 'depth': depth}
+    for count in threads:
+        qf = qp.Framework('contention')
+        sink = BlockingSink(count * events)
+        sink.start(1, depth, None, qf)
+        durations, start = run_posters(sink.post_fifo, count, events)
+        sink.done.wait()
+        elapsed = time.time() - start
+        stop_sinks([sink])
+        case = 'threads_%d' % count
+        result[case + '_events_per_s'] = count * events / elapsed
+        result.update(percentiles(case + '_post', durations))
+    return result
+
+
+def tick_cost(timers=(0, 100, 1000, 10000), ticks=500):
+    """Measure QF.tick with each number of armed timers, none expiring, and
+    with the timers expiring spread over the ticks. The time events are
+    published without subscribers, so no other thread runs meanwhile.
+    Ticks are timed in batches of TIMED_BATCH. Returns a dict with timing
+    results."""
+    result = {'name': 'tick_cost', 'ticks': ticks}
+    for count in timers:
+        for expiring in [False, True]:
+            qf = qp.Framework('tick')
+            time_evts = [qp.TimeEvt(MIXED_SIG, qf) for _n in xrange(count)]
+            for n, t in enumerate(time_evts):
+                if expiring:
+                    t.publish_in(1 + n % ticks)
+                else:
+                    t.publish_in(1000000000)
+            durations = []
+            tick = qf.tick
+            gc.disable()  # As timeit does
+            try:
+                for _n in xrange(ticks // TIMED_BATCH):
+                    start = clock()
+                    for _m in xrange(TIMED_BATCH):
+                        tick()
+                    durations.append((clock() - start) / TIMED_BATCH)
+            finally:
+                gc.enable()
+            for t in time_evts:
+                t.disarm()
+            case = 'timers_%d_%s_tick' % (
+                count, expiring and 'expiring' or 'armed')
+            result.update(percentiles(case, durations))
+    return result
+
+
+def compare(result, baseline, threshold=0.1):
+    """Compare the timings in result with the same timings in a baseline
+    result. Returns a dict with the relative change of each timing, positive
+    when it got faster, and the timings that got slower by more than
+    threshold. The p99 and maximum durations are outliers and not compared,
+    durations in us that differ by less than NOISE_US are not
+    regressions."""
+    changes = {}
+    regressions = []
+    for key, value in sorted(result.items()):
+        old = baseline.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or not isinstance(old, (int, float)) or not old or not value \
+                or key.endswith(('_p99_us', '_max_us')):
+            continue
+        if key.endswith(FASTER_SUFFIXES):
+            change = float(value) / old - 1.0
+        elif key.endswith(SLOWER_SUFFIXES):
+            change = float(old) / value - 1.0
+        else:
+            continue
+        changes[key] = change
+        noise = key.endswith('_us') and abs(value - old) < NOISE_US
+        if change < -threshold and not noise:
+            regressions.append(key)
+    return {'name': result['name'], 'changes': changes,
+            'regressions': regressions}
+
+
+def best(results):
+    """Return result with the best value of each timing in results, runs
+    of the same benchmark. Other values are taken from the first run"""
+    result = dict(results[0])
+    for key, value in result.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        values = [r[key] for r in results]
+        if key.endswith(FASTER_SUFFIXES):
+            result[key] = max(values)
+        elif key.endswith(SLOWER_SUFFIXES):
+            result[key] = min(values)
+    return result
+
+
+def report(result):
+    """Write a result dict as one line of text"""
+    items = ['%s=%s' % (k, v) for k, v in sorted(result.items())
+             if k != 'name']
+    sys.stdout.write('%s: %s\n' % (result['name'], ' '.join(items)))
+
+
+def report_change(change):
+    """Write the changes from a baseline as one line of text"""
+    items = ['%s=%+.1f%%' % (k, 100 * v)
+             for k, v in sorted(change['changes'].items())]
+    sys.stdout.write('%s vs baseline: %s\n' % (change['name'],
+                                               ' '.join(items)))
+    if change['regressions']:
+        sys.stdout.write('%s regressions: %s\n' % (
+            change['name'], ' '.join(change['regressions'])))
+
+
+def main(argv=None):
+    """Run the benchmarks, returns 1 if any timing got slower than in the
+    baseline, else 0"""
+    import optparse
+    parser = optparse.OptionParser()
+    parser.add_option('--publishers', dest='publishers', default=8,
+                      type='int')
+    parser.add_option('--subscribers', dest='subscribers', default=8,
+                      type='int')
+    parser.add_option('--events', dest='events', default=10000, type='int')
+    parser.add_option('--timers', dest='timers', default=5000, type='int')
+    parser.add_option('--duration', dest='duration', default=1.0,
+                      type='float')
+    parser.add_option('--only', dest='only', default=None,
+                      help='comma separated benchmark names')
+    parser.add_option('--json', dest='json', action='store_true',
+                      default=False, help='write results as JSON')
+    parser.add_option('--baseline', dest='baseline', default=None,
+                      help='JSON results to compare with')
+    parser.add_option('--threshold', dest='threshold', default=0.1,
+                      type='float', help='relative slowdown to report')
+    parser.add_option('--repeat', dest='repeat', default=1, type='int',
+                      help='runs of each benchmark, the best is kept')
+    opts, args = parser.parse_args(argv)
+    benchmarks = [
+        ('publish_contention', lambda: publish_contention(
+            opts.publishers, opts.subscribers, opts.events)),
+        ('publish_burst', lambda: publish_burst(opts.subscribers,
+                                                opts.events)),
+        ('publish_fanout', publish_fanout),
+        ('post_contention', post_contention),
+        ('pool_fanout', pool_fanout),
+        ('codec_throughput', codec_throughput),
+        ('ring_transport', ring_transport),
+        ('journal_replay', journal_replay),
+        ('timer_jitter', timer_jitter),
+        ('timer_rearm', timer_rearm),
+        ('tick_cost', tick_cost),
+        ('lane_post', lane_post),
+        ('io_fanout', io_fanout),
+        ('dispatch_publish', dispatch_publish),
+        ('parallel_actives', parallel_actives),
+        ('mixed_load', lambda: mixed_load(opts.timers, opts.duration)),
+        ('lock_split', lambda: lock_split(opts.timers, opts.duration)),
+    ]
+    if opts.only:
+        names = opts.only.split(',')
+        unknown = set(names) - set([name for name, run in benchmarks])
+        if unknown:
+            parser.error('unknown benchmark %s' % ', '.join(sorted(unknown)))
+        benchmarks = [(name, run) for name, run in benchmarks
+                      if name in names]
+    baseline = {}
+    if opts.baseline:
+        f = open(opts.baseline)
+        try:
+            baseline = dict([(result['name'], result)
+                             for result in json.load(f)['results']])
+        finally:
+            f.close()
+    results = []
+    changes = []
+    for name, run in benchmarks:
+        result = best([run() for _n in range(opts.repeat)])
+        results.append(result)
+        if name in baseline:
+            changes.append(compare(result, baseline[name], opts.threshold))
+        if not opts.json:
+            report(result)
+            if changes and changes[-1]['name'] == name:
+                report_change(changes[-1])
+    if opts.json:
+        json.dump({'python': '%d.%d.%d' % sys.version_info[:3],
+                   'results': results, 'changes': changes},
+                  sys.stdout, sort_keys=True, indent=1)
+        sys.stdout.write('\n')
+    return int(bool([c for c in changes if c['regressions']]))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
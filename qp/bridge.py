@@ -0,0 +1,381 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Bridge forwarding published events to a framework in another process
+
+A BridgeSender is an Active object subscribing to a set of signals. It
+streams the events over one persistent TCP or Unix socket connection to a
+BridgeServer, which publishes them in its own framework.
+
+Addresses are (host, port) tuples for TCP and path strings for Unix sockets.
+
+The stream consists of frames with a one byte type and a four byte length.
+DATA frames carry a batch of length prefixed encoded events. CREDIT frames
+carry a count of events the receiver is ready to take. The receiver grants
+window credits when a connection is made and returns credits as events are
+published, the sender never has more events in flight than it has credits.
+
+A BridgeSender pickles events by default. A BridgeServer must be given a
+decode function, as unpickling data from a peer lets the peer run any
+code. Pass the methods of a qp.codec.Codec as encode and decode, or
+pickle_decode if every peer that can connect is trusted.
+"""
+
+# Standard
+from __future__ import with_statement
+import collections
+import itertools
+import logging
+import os
+try:
+    import cPickle as pickle
+except ImportError:  # Python 3
+    import pickle
+import socket
+import struct
+import threading
+import time
+
+# Local
+import qp
+
+
+DATA = 1
+CREDIT = 2
+CREDIT_SIG = 0x7fffffff  # Private signals of BridgeSender, never published
+RETRY_SIG = 0x7ffffffe
+
+HEADER = struct.Struct('!BI')
+LENGTH = struct.Struct('!I')
+
+logger = logging.getLogger('qp.bridge')
+
+
+def pickle_encode(e):
+    return pickle.dumps(e, pickle.HIGHEST_PROTOCOL)
+
+
+def pickle_decode(data):
+    return pickle.loads(data)
+
+
+def make_socket(address):
+    """Return socket of the family of address"""
+    if isinstance(address, tuple):
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def write_frame(sock, kind, payload):
+    sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+
+def read_frame(sock):
+    """Return (kind, payload) of next frame or None if connection closed"""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    kind, length = HEADER.unpack(header)
+    payload = _recv_exactly(sock, length)
+    if payload is None:
+        return None
+    return kind, payload
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def pack_records(records):
+    """Return records, sequence of strings, as DATA frame payload"""
+    return b''.join([LENGTH.pack(len(r)) + r for r in records])
+
+
+def unpack_records(payload):
+    """Return list of records in DATA frame payload"""
+    records = []
+    offset = 0
+    while offset < len(payload):
+        length, = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        records.append(payload[offset:offset + length])
+        offset += length
+    return records
+
+
+class CreditEvt(qp.Event):
+    """Credits received on a connection of a BridgeSender, which have
+    already been added to its credits"""
+
+    def __init__(self, sock, credits):
+        qp.Event.__init__(self, CREDIT_SIG)
+        self.sock = sock
+        self.credits = credits
+
+
+class BridgeSender(qp.Active):
+    """Active object forwarding events with the given signals to the
+    BridgeServer at address. Events are collected while more are queued and
+    written in batches of at most batch events. At most max_pending events
+    are kept while waiting for credits or for the peer to come back, the
+    oldest are dropped beyond that. While events are pending, a time event
+    retries connecting and flushing every retry_s seconds, so the framework
+    of the sender must be running.
+
+    Credits are added by the reader thread of the connection, under a lock,
+    and a CreditEvt is posted to make the sender flush. If that post
+    overflows, it is counted in credit_overflows and the retry flushes the
+    events instead."""
+
+    retry_s = 1.0   # Time between connection attempts
+
+    def __init__(self, address, signals, encode=None, batch=256,
+                 max_pending=10000):
+        qp.Active.__init__(self, BridgeSender.initial)
+        self.signals = list(signals)
+        self.address = address
+        self.dropped = 0
+        self.credit_overflows = 0
+        self._encode = encode or pickle_encode
+        self._batch = batch
+        self._max_pending = max_pending
+        self._pending = collections.deque()
+        self._lock = threading.Lock()  # Guards _credits and _sock
+        self._credits = 0
+        self._sock = None
+        self._retry_at = 0.0
+
+    def initial(self, e):
+        self._retry = qp.TimeEvt(RETRY_SIG)
+        self._connect()
+        self.INIT(BridgeSender.forwarding)
+
+    def forwarding(self, e):
+        if e.sig == CREDIT_SIG:
+            if e.sock is self._sock:  # Not from an old connection
+                self._flush()
+            return 0
+        elif e.sig == RETRY_SIG:
+            self._flush()
+            return 0
+        elif e.sig in self.signals:
+            self._pending.append(e)
+            if len(self._pending) > self._max_pending:
+                self._pending.popleft()
+                self.dropped += 1
+            if len(self._pending) >= self._batch or not self._queue.qsize():
+                self._flush()
+            return 0
+        return qp.Hsm.top
+
+    def _connect(self):
+        """Connect to peer, credits are granted by the peer"""
+        self._retry_at = time.time() + self.retry_s
+        sock = make_socket(self.address)
+        try:
+            sock.connect(self.address)
+        except socket.error as exc:
+            logger.warning('Connecting to %s failed: %s' % (self.address, exc))
+            sock.close()
+            return
+        with self._lock:
+            self._sock = sock
+            self._credits = 0
+        reader = threading.Thread(target=self._read_credits, args=(sock,),
+                                  name='%s-reader' % self._name())
+        reader.daemon = True
+        reader.start()
+
+    def _read_credits(self, sock):
+        """Reader thread, adds received credits and wakes up the bridge"""
+        try:
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind == CREDIT:
+                    credits, = LENGTH.unpack(payload)
+                    with self._lock:
+                        if sock is not self._sock:  # Old connection
+                            break
+                        self._credits += credits
+                    try:
+                        self.post_fifo(CreditEvt(sock, credits))
+                    except qp.QueueOverflowError:
+                        self.credit_overflows += 1  # Flushed on retry
+        except socket.error:
+            pass
+
+    def _flush(self):
+        """Write as many pending events as there are credits for, and retry
+        later if any are left"""
+        self._send()
+        if self._pending and not self._retry.is_armed():
+            self._retry.post_in_seconds(self, self.retry_s)
+
+    def _send(self):
+        if self._sock is None:
+            if time.time() < self._retry_at:
+                return
+            self._connect()
+            if self._sock is None:
+                return
+        pending = self._pending
+        while True:
+            n = min(self._credits, self._batch, len(pending))
+            if not n:
+                return
+            records = [self._encode(e)
+                       for e in itertools.islice(pending, n)]
+            try:
+                write_frame(self._sock, DATA, pack_records(records))
+            except socket.error as exc:
+                logger.warning('Lost connection to %s: %s' %
+                               (self.address, exc))
+                self._close()
+                return
+            for _n in range(n):
+                pending.popleft()
+            with self._lock:
+                self._credits -= n
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            with self._lock:
+                self._sock = None
+                self._credits = 0
+
+    def _finish(self):
+        qp.Active._finish(self)
+        self._retry.disarm()
+        self._close()
+
+
+class BridgeServer(object):
+    """Accepts BridgeSender connections on address and publishes received
+    events in framework qf, default qp.QF. Received events are decoded with
+    decode, which is required, see the module docstring. Each connection is
+    granted window credits, which are returned once the events have been
+    published."""
+
+    def __init__(self, address, qf=None, decode=None, window=1024):
+        if decode is None:
+            raise ValueError('BridgeServer needs a decode function')
+        self._qf = qf or qp.QF
+        self._decode = decode
+        self._window = window
+        self._sock = make_socket(address)
+        self._path = None
+        if isinstance(address, tuple):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self._path = address
+        self._sock.bind(address)
+        self._sock.listen(5)
+        self.address = self._sock.getsockname()
+        self._connections = []
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._accept, name='BridgeServer')
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop accepting and close all connections"""
+        with self._lock:
+            for sock in [self._sock] + self._connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                sock.close()
+            del self._connections[:]
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _peer = self._sock.accept()
+            except socket.error:
+                break  # Closed
+            with self._lock:
+                self._connections.append(sock)
+            thread = threading.Thread(target=self._receive, args=(sock,),
+                                      name='BridgeServer-connection')
+            thread.daemon = True
+            thread.start()
+
+    def _receive(self, sock):
+        """Connection thread, publishes received events"""
+        try:
+            write_frame(sock, CREDIT, LENGTH.pack(self._window))
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    break
+                kind, payload = frame
+                if kind != DATA:
+                    continue
+                events = [self._decode(r) for r in unpack_records(payload)]
+                try:
+                    self._qf.publish_many(events)
+                except qp.QueueOverflowError as exc:
+                    logger.warning('Bridged events lost: %s' % exc)
+                write_frame(sock, CREDIT, LENGTH.pack(len(events)))
+        except socket.error:
+            pass
+        with self._lock:
+            if sock in self._connections:
+                self._connections.remove(sock)
+        sock.close()
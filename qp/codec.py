@@ -0,0 +1,178 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Compact binary event codec
+
+Event classes declare their attributes as typed fields, a list of
+(attribute name, struct format) pairs, for example
+
+    class TableEvt(qp.Event):
+        fields = [('phil_num', 'i')]
+
+A Codec maps signals to event classes and generates a struct encoder and
+decoder per signal. A record is the signal followed by the fields in
+little endian byte order, without padding, so its size is given by the
+signal. Strings are fixed size fields of bytes such as '16s', shorter
+strings are padded with null bytes on encoding and keep the padding when
+decoded.
+
+Decoded events are created without calling __init__ of the class. Records
+are decoded in place from any buffer, such as a memoryview, an mmap or a
+bytearray, nothing is copied before unpacking.
+"""
+
+# Standard
+import re
+import struct
+
+
+SIG = struct.Struct('<i')
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Source of the functions generated per signal, attributes are accessed
+# directly instead of with getattr and setattr
+TEMPLATE = """
+def encode(e):
+    return pack(e.sig%(args)s)
+
+def encode_into(buf, offset, e):
+    pack_into(buf, offset, e.sig%(args)s)
+    return size
+
+def decode(buf, offset=0):
+    v = unpack_from(buf, offset)
+    e = new(cls)
+    e.sig = v[0]
+%(assignments)s    return e
+"""
+
+
+class UnknownSignalError(KeyError):
+    pass
+
+
+class Codec(object):
+    """Registry of event schemas by signal"""
+
+    def __init__(self):
+        self._schemas = {}  # sig: (encode, encode_into, decode, size)
+
+    def register(self, sig, cls, fields=None):
+        """Register event class cls for sig. Fields default to the fields
+        attribute of the class"""
+        if fields is None:
+            fields = cls.fields
+        names = [name for name, code in fields]
+        for name in names:
+            if not IDENTIFIER.match(name) or name == 'sig':
+                raise ValueError('Invalid field name %r' % name)
+        layout = struct.Struct('<i' + ''.join([code for name, code in fields]))
+        source = TEMPLATE % {
+            'args': ''.join([', e.%s' % name for name in names]),
+            'assignments': ''.join(['    e.%s = v[%d]\n' % (name, i + 1)
+                                    for i, name in enumerate(names)])}
+        namespace = {'pack': layout.pack, 'pack_into': layout.pack_into,
+                     'unpack_from': layout.unpack_from, 'size': layout.size,
+                     'new': cls.__new__, 'cls': cls}
+        exec(source, namespace)
+        self._schemas[sig] = (namespace['encode'], namespace['encode_into'],
+                              namespace['decode'], layout.size)
+
+    def size(self, sig):
+        """Return size of encoded event with signal sig"""
+        return self._schema(sig)[3]
+
+    def max_size(self):
+        """Return size of largest encoded event"""
+        return max([0] + [schema[3] for schema in self._schemas.values()])
+
+    def decoder(self, sig):
+        """Return (decode function, record size) for sig. The function
+        takes a buffer and an offset and returns the event"""
+        schema = self._schema(sig)
+        return schema[2], schema[3]
+
+    def encode(self, e):
+        """Return e encoded as a string"""
+        return self._schema(e.sig)[0](e)
+
+    def encode_into(self, buf, offset, e):
+        """Write e encoded into writable buffer buf at offset, returns size
+        of the record"""
+        return self._schema(e.sig)[1](buf, offset, e)
+
+    def decode(self, buf, offset=0):
+        """Return event encoded in buf at offset"""
+        sig, = SIG.unpack_from(buf, offset)
+        return self._schema(sig)[2](buf, offset)
+
+    def decode_from(self, buf, offset=0):
+        """Return (event, size of record) for record in buf at offset"""
+        sig, = SIG.unpack_from(buf, offset)
+        encode, encode_into, decode, size = self._schema(sig)
+        return decode(buf, offset), size
+
+    def decode_many(self, buf, offset=0, end=None):
+        """Return list of events in records following each other in buf,
+        from offset up to end or the end of buf"""
+        if end is None:
+            end = len(buf)
+        schemas = self._schemas
+        unpack_sig = SIG.unpack_from
+        events = []
+        while offset < end:
+            sig, = unpack_sig(buf, offset)
+            try:
+                encode, encode_into, decode, size = schemas[sig]
+            except KeyError:
+                raise UnknownSignalError(sig)
+            events.append(decode(buf, offset))
+            offset += size
+        return events
+
+    def _schema(self, sig):
+        try:
+            return self._schemas[sig]
+        except KeyError:
+            raise UnknownSignalError(sig)
@@ -0,0 +1,242 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Write-ahead journal of dispatched events for crash recovery
+
+A Journal appends every event dispatched to the attached Active objects to
+segment files in a directory, before the event is dispatched. Events are
+encoded with a qp.codec.Codec, so every signal dispatched to an attached
+object must be registered in it, an event that cannot be encoded is
+logged and dropped. Each record is the prio of the object followed by the
+encoded event.
+
+Writes are buffered and a background thread flushes and fsyncs the
+current segment every sync_s seconds, so at most the events of the last
+sync_s seconds are lost in a crash. A new segment is started when the
+current one has grown beyond segment_size bytes, and whenever a journal
+is opened, so existing segments are never appended to.
+
+On startup the objects are started and attached, then replay feeds the
+journaled events to Hsm.dispatch of the attached objects with the same
+prio. Objects that are not attached are left alone, only attached objects
+hold their dispatch lock while dispatching, which replay takes. The
+framework ignores publishing, posting and timer arming from the replaying
+thread, so the events that caused them are not produced a second time.
+Events posted by other threads during replay are queued as usual, and
+dispatched by the objects once replay is done. A record cut short by a
+crash ends the replay.
+"""
+
+# Standard
+from __future__ import with_statement
+import mmap
+import os
+import struct
+import threading
+try:
+    from thread import get_ident
+except ImportError:  # Python 3
+    from threading import get_ident
+
+# Local
+import qp
+
+
+PRIO = struct.Struct('<i')
+RECORD = struct.Struct('<ii')  # Prio and signal at start of record
+SUFFIX = '.qpj'
+
+
+class Journal(object):
+    """Journal in directory, created if missing"""
+
+    def __init__(self, directory, codec, segment_size=64 << 20, sync_s=0.05):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self._codec = codec
+        self._segment_size = segment_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._dirty = False
+        segments = self.segments()
+        self._replayable = segments
+        if segments:
+            name = os.path.basename(segments[-1])
+            self._number = int(name[:-len(SUFFIX)]) + 1
+        else:
+            self._number = 0
+        self._closed = threading.Event()
+        self._syncer = None
+        if sync_s is not None:
+            self._syncer = threading.Thread(target=self._sync_every,
+                                            args=(sync_s,),
+                                            name='Journal-sync')
+            self._syncer.daemon = True
+            self._syncer.start()
+
+    def segments(self):
+        """Return paths of segment files, oldest first"""
+        names = [name for name in os.listdir(self.directory)
+                 if name.endswith(SUFFIX)]
+        names.sort()
+        return [os.path.join(self.directory, name) for name in names]
+
+    def attach(self, active):
+        """Journal the events dispatched to active from now on"""
+        active._journal = self
+
+    def detach(self, active):
+        active._journal = None
+
+    def append(self, prio, e):
+        """Append event e dispatched to the object at prio"""
+        record = PRIO.pack(prio) + self._codec.encode(e)
+        with self._lock:
+            if self._file is None or self._size >= self._segment_size:
+                self._roll()
+            self._file.write(record)
+            self._size += len(record)
+            self._dirty = True
+
+    def _roll(self):
+        """Close current segment and open the next, lock must be held"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        name = '%010d%s' % (self._number, SUFFIX)
+        self._file = open(os.path.join(self.directory, name), 'wb')
+        self._number += 1
+        self._size = 0
+
+    def sync(self):
+        """Write buffered records to disk"""
+        with self._lock:
+            if not self._dirty or self._file is None:
+                return
+            self._file.flush()
+            fd = self._file.fileno()
+            self._dirty = False
+            os.fsync(fd)
+
+    def _sync_every(self, sync_s):
+        while not self._closed.is_set():
+            self._closed.wait(sync_s)
+            self.sync()
+
+    def close(self):
+        """Sync and close the journal"""
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
+
+    def clear(self):
+        """Remove all segments, for example after the state of the objects
+        has been saved some other way. New records go to a new segment"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._dirty = False
+            for path in self.segments():
+                os.remove(path)
+            self._replayable = []
+
+    def replay(self, qf=None):
+        """Dispatch the events journaled before the journal was opened to
+        the active objects of framework qf, default qp.QF, with the same
+        prios that are attached to a journal. Events of prios without such
+        an object are skipped. The objects dispatch no other events until
+        replay is done. Returns number of events dispatched"""
+        qf = qf or qp.QF
+        held = [(p, a) for p, a in qf._actives() if a._journal is not None]
+        actives = dict(held)
+        decoders = {}  # sig: (decode, size)
+        dispatch = qp.Hsm.dispatch
+        dispatched = 0
+        for prio, a in held:
+            a._dispatch_lock.acquire()
+        qf._replay_thread = get_ident()
+        try:
+            for path in self._replayable:
+                size = os.path.getsize(path)
+                if not size:
+                    continue
+                f = open(path, 'rb')
+                try:
+                    mem = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                finally:
+                    f.close()
+                try:
+                    offset = 0
+                    while offset + RECORD.size <= size:
+                        prio, sig = RECORD.unpack_from(mem, offset)
+                        try:
+                            decode, length = decoders[sig]
+                        except KeyError:
+                            decode, length = decoders[sig] = \
+                                self._codec.decoder(sig)
+                        if offset + PRIO.size + length > size:
+                            break  # Cut short by a crash
+                        e = decode(mem, offset + PRIO.size)
+                        offset += PRIO.size + length
+                        active = actives.get(prio)
+                        if active is not None:
+                            dispatch(active, e)
+                            dispatched += 1
+                finally:
+                    mem.close()
+        finally:
+            qf._replay_thread = None
+            for prio, a in held:
+                a._dispatch_lock.release()
+        return dispatched
@@ -0,0 +1,191 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Export framework metrics in Prometheus text format"""
+
+# Standard
+import os
+import threading
+try:
+    import BaseHTTPServer
+except ImportError:  # Python 3
+    import http.server as BaseHTTPServer
+
+# Local
+from qp import qf
+
+
+# (metric name, type, help, key in Framework.get_metrics)
+FRAMEWORK_METRICS = [
+    ('qp_ticks_total', 'counter', 'Framework ticks', 'ticks'),
+    ('qp_tick_overruns_total', 'counter',
+     'Ticks that took longer than the tick period', 'tick_overruns'),
+    ('qp_missed_ticks_total', 'counter',
+     'Ticks run late to catch up', 'missed_ticks'),
+    ('qp_timers_armed', 'gauge', 'Armed time events', 'armed_timers'),
+    ('qp_timers_expired_total', 'counter', 'Expired time events',
+     'timers_expired'),
+    ('qp_timer_lateness_seconds_total', 'counter',
+     'Time from deadline to expiry of all time events', 'timer_lateness_s'),
+    ('qp_timer_lateness_max_seconds', 'gauge',
+     'Longest time from deadline to expiry', 'timer_lateness_max_s'),
+]
+
+# (metric name, type, help, key in active object stats)
+ACTIVE_METRICS = [
+    ('qp_queue_depth', 'gauge', 'Queued events', 'depth'),
+    ('qp_queue_high_water', 'gauge', 'Queue high-water mark', 'high_water'),
+    ('qp_queue_capacity', 'gauge', 'Queue size', 'capacity'),
+    ('qp_posts_total', 'counter', 'Events queued', 'posts'),
+    ('qp_dispatches_total', 'counter', 'Events dispatched', 'dispatches'),
+    ('qp_slow_dispatches_total', 'counter',
+     'Dispatches over the watchdog budget', 'slow_dispatches'),
+    ('qp_queue_wait_seconds_total', 'counter',
+     'Time spent in queue by all events', 'wait_s'),
+]
+
+# (metric name, type, help, key in lane stats), lane 0 is the normal lane
+LANE_METRICS = [
+    ('qp_lane_depth', 'gauge', 'Queued events per lane', 'depth'),
+    ('qp_lane_capacity', 'gauge', 'Lane size', 'capacity'),
+    ('qp_lane_high_water', 'gauge', 'Lane high-water mark', 'high_water'),
+    ('qp_lane_posts_total', 'counter', 'Events queued per lane', 'posts'),
+    ('qp_lane_dropped_total', 'counter',
+     'Events dropped or rejected per lane', 'dropped'),
+]
+
+OVERFLOW_KINDS = ['raised', 'blocked', 'dropped', 'coalesced']
+
+
+def _escape(v):
+    return (str(v).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(**labels):
+    items = ['%s="%s"' % (k, _escape(v)) for k, v in sorted(labels.items())]
+    return '{%s}' % ','.join(items)
+
+
+def _value(v):
+    if isinstance(v, float):
+        return repr(v)
+    return str(v)
+
+
+def prometheus_text(framework=None):
+    """Return metrics of framework, default qp.QF, in Prometheus text
+    exposition format"""
+    metrics = (framework or qf.QF).get_metrics()
+    fw = metrics['name']
+    lines = []
+    for name, kind, text, key in FRAMEWORK_METRICS:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.append('%s%s %s' % (name, _labels(framework=fw),
+                                     _value(metrics[key])))
+    for name, kind, text, key in ACTIVE_METRICS:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for stats in metrics['actives']:
+            labels = _labels(framework=fw, active=stats['name'],
+                             prio=stats['prio'])
+            lines.append('%s%s %s' % (name, labels, _value(stats[key])))
+    for name, kind, text, key in LANE_METRICS:
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for stats in metrics['actives']:
+            for lane, counts in enumerate(stats['lanes']):
+                labels = _labels(framework=fw, active=stats['name'],
+                                 prio=stats['prio'], lane=lane)
+                lines.append('%s%s %s' % (name, labels, _value(counts[key])))
+    name = 'qp_overflows_total'
+    lines.append('# HELP %s Posts to a full queue' % name)
+    lines.append('# TYPE %s counter' % name)
+    for stats in metrics['actives']:
+        for kind in OVERFLOW_KINDS:
+            labels = _labels(framework=fw, active=stats['name'],
+                             prio=stats['prio'], kind=kind)
+            lines.append('%s%s %s' % (name, labels, _value(stats[kind])))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path, framework=None):
+    """Write metrics to file, replacing it atomically. Suitable for the
+    node exporter textfile collector"""
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp, 'w')
+    try:
+        f.write(prometheus_text(framework))
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves metrics of server.framework on any GET request"""
+
+    def do_GET(self):
+        body = prometheus_text(self.server.framework).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of stderr
+
+
+def serve_prometheus(port, host='127.0.0.1', framework=None):
+    """Serve metrics over HTTP from a daemon thread. Port 0 picks a free
+    port, see server.server_address. Returns the server, stop it with
+    server.shutdown()"""
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    server.framework = framework
+    thread = threading.Thread(target=server.serve_forever,
+                              name='qp-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
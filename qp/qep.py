@@ -59,6 +59,8 @@ USER_SIG = 4
 class Event(object):
     """Event base class"""
 
+    fields = ()  # (name, struct format) pairs of attributes, see qp.codec
+
     def __init__(self, sig=0):
         self.sig = sig
 
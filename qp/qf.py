@@ -46,48 +46,542 @@
 
 # Standard
 from __future__ import with_statement
+import bisect
+import collections
+import errno
+import heapq
 import logging
+import os
+import select
+import sys
 import time
 import threading
-import Queue
+try:
+    import Queue
+except ImportError:  # Python 3
+    import queue as Queue
+try:
+    from thread import get_ident
+except ImportError:  # Python 3
+    from threading import get_ident
 
 # Local
 import qp
 
 
-QF_MAX_ACTIVE = 63          # maximum number of active objects
+QF_MAX_ACTIVE = 63          # active object limit of QP, not enforced here
 TICK = 10                   # milliseconds
 TICK_S = TICK / 1000.0      # seconds
+SIGNAL_SLOTS = 64           # subscriber entries preallocated per framework
+SIGNAL_LIMIT = 1 << 16      # signals subscribed to are below this
 
 logger = logging.getLogger('qp')
 
 
+def _clock_gettime_monotonic():
+    """Return function reading CLOCK_MONOTONIC with clock_gettime through
+    ctypes, None if not on Linux or not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        try:
+            clock_gettime = ctypes.CDLL(None).clock_gettime
+        except AttributeError:  # Before glibc 2.17
+            clock_gettime = ctypes.CDLL('librt.so.1').clock_gettime
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+    byref = ctypes.byref
+
+    def monotonic():
+        """Return seconds of the monotonic clock"""
+        t = timespec()
+        if clock_gettime(CLOCK_MONOTONIC, byref(t)):
+            raise OSError('clock_gettime failed')
+        return t.tv_sec + t.tv_nsec * 1e-9
+    return monotonic
+
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = _clock_gettime_monotonic() or time.time
+
+
+# Queue overflow policies
+OVERFLOW_RAISE = 0          # raise QueueOverflowError (default)
+OVERFLOW_BLOCK = 1          # wait for room, drop the new event on timeout
+OVERFLOW_DROP_OLDEST = 2    # drop the oldest queued event
+OVERFLOW_DROP_NEWEST = 3    # drop the posted event
+OVERFLOW_COALESCE = 4       # replace queued event with same key, else drop
+
+# File descriptor readiness, see Active.watch. Hang up and errors are
+# reported as the events watched, so the next read or write fails
+IO_READ = 1                 # readable
+IO_WRITE = 2                # writable
+
+
+def _set_nonblocking(fd):
+    """Make file descriptor non-blocking"""
+    import fcntl
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) |
+                os.O_NONBLOCK)
+
+
+class _Poller(object):
+    """Readiness of file descriptors, IO_READ and IO_WRITE. Uses epoll where
+    available, waiting costs time in proportion to the ready descriptors
+    only, else select"""
+
+    def __init__(self, use_epoll=True):
+        self._epoll = None
+        if use_epoll and hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+            # epoll rounds timeouts to milliseconds, up on Python 3 and down
+            # on Python 2. Whole milliseconds are waited for in a poll on
+            # the epoll descriptor, which takes an exact number, and the
+            # rest is slept off with select
+            self._waiter = select.poll()
+            self._waiter.register(self._epoll.fileno(), select.POLLIN)
+        self._fds = {}  # fd: events
+
+    def register(self, fd, events):
+        """Register fd for events, or change the events of fd"""
+        if self._epoll is not None:
+            mask = 0
+            if events & IO_READ:
+                mask |= select.EPOLLIN
+            if events & IO_WRITE:
+                mask |= select.EPOLLOUT
+            if fd in self._fds:
+                self._epoll.modify(fd, mask)
+            else:
+                self._epoll.register(fd, mask)
+        self._fds[fd] = events
+
+    def unregister(self, fd):
+        if self._fds.pop(fd, None) is not None and self._epoll is not None:
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, OSError, ValueError):  # Already closed
+                pass
+
+    def poll(self, timeout):
+        """Wait at most timeout seconds. Returns list of (fd, events)"""
+        if self._epoll is not None:
+            ms = int(timeout * 1000)
+            if ms:
+                self._waiter.poll(ms)
+            elif timeout > 0.0:
+                select.select([], [], [], timeout)
+            ready = []
+            for fd, mask in self._epoll.poll(0):
+                events = 0
+                if mask & (select.EPOLLHUP | select.EPOLLERR):
+                    events = IO_READ | IO_WRITE  # Let reads or writes fail
+                if mask & select.EPOLLIN:
+                    events |= IO_READ
+                if mask & select.EPOLLOUT:
+                    events |= IO_WRITE
+                ready.append((fd, events & self._fds.get(fd, 0)))
+            return ready
+        fds = list(self._fds.items())
+        readers = [fd for fd, events in fds if events & IO_READ]
+        writers = [fd for fd, events in fds if events & IO_WRITE]
+        r, w, _x = select.select(readers, writers, [], timeout)
+        ready = dict([(fd, IO_READ) for fd in r])
+        for fd in w:
+            ready[fd] = ready.get(fd, 0) | IO_WRITE
+        return list(ready.items())
+
+    def close(self):
+        if self._epoll is not None:
+            self._epoll.close()
+
+
+class SignalRegistry(object):
+    """Names of signals. Signals registered without a number get dense
+    numbers from USER_SIG up, skipping the ones already named, so that
+    they index the preallocated subscriber lists of the frameworks.
+    Signals chosen by hand should be registered with their number too."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sigs = {}  # name: sig
+        self._names = {}  # sig: name
+        self._next = qp.USER_SIG
+        for name, sig in [('EMPTY', qp.qep._QEP_EMPTY_SIG),
+                          ('ENTRY', qp.ENTRY_SIG), ('EXIT', qp.EXIT_SIG),
+                          ('INIT', qp.INIT_SIG)]:
+            self.register(name, sig)
+
+    def register(self, name, sig=None):
+        """Return signal of name, registering it with sig, or the next free
+        number if None, when new"""
+        with self._lock:
+            if name in self._sigs:
+                assert sig in (None, self._sigs[name]), \
+                    'Signal %s is %d' % (name, self._sigs[name])
+                return self._sigs[name]
+            if sig is None:
+                while self._next in self._names:
+                    self._next += 1
+                sig = self._next
+            assert sig not in self._names, \
+                'Signal %d is already %s' % (sig, self._names[sig])
+            self._sigs[name] = sig
+            self._names[sig] = name
+            return sig
+
+    def name(self, sig):
+        """Return name of sig, or the number as a string if unnamed"""
+        return self._names.get(sig, str(sig))
+
+    def signal(self, name):
+        """Return signal of name, raises KeyError if not registered"""
+        return self._sigs[name]
+
+
+SIGNALS = SignalRegistry()  # Default registry
+register_signal = SIGNALS.register
+signal_name = SIGNALS.name
+
+
 class QueueOverflowError(Exception):
     pass
 
 
+class _Slot(object):
+    """Queue entry for coalescable events, replaced in place"""
+
+    __slots__ = ('key', 'e')
+
+    def __init__(self, key, e):
+        self.key = key
+        self.e = e
+
+
 class QEQueue(Queue.Queue):
-    """QEQueue base class"""
+    """QEQueue base class.
+    The overflow policy decides what happens when an event is posted to a
+    full queue. OVERFLOW_BLOCK waits at most timeout seconds (forever if
+    None) and must not be used for queues the posting thread itself drains.
+    OVERFLOW_COALESCE requires a key function, key(e), identifying events
+    that may replace each other.
 
-    def __init__(self, maxsize):
+    Coalescable signals are given as a dict with sig: key function. A posted
+    event with such a signal replaces the queued event with the same signal
+    and key in place, keeping its position in the queue. Queued coalescable
+    events are found through an index, so the lookup is O(1).
+
+    The total time spent in the queue by all events, _wait_s, is kept as the
+    time integral of the queue length. Divided by the number of dequeued
+    events it gives the mean queue wait time (Little's law).
+
+    The capacity and overflow policy apply to the deque in self.queue, the
+    normal lane. See LaneQueue for urgent lanes."""
+
+    def __init__(self, maxsize, overflow=OVERFLOW_RAISE, timeout=None,
+                 key=None, coalesce=None):
         Queue.Queue.__init__(self)
+        assert overflow != OVERFLOW_COALESCE or key is not None
         self._max = 0            # watermark
         self._maxsize = maxsize
+        self._overflow = overflow
+        self._timeout = timeout
+        self._key = key
+        self._coalesce = coalesce or {}
+        self._index = {}         # (sig, key): queued _Slot
+        self._raised = 0         # overflow counters
+        self._blocked = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._posts = 0          # events queued
+        self._wait_s = 0.0       # time integral of queue length
+        self._changed = time.time()
 
     def post_fifo(self, e):
-        """Post event to queue in FIFO manner"""
-        self._max = max(self._max, self.qsize())
-        self.put(e, block=False)
+        """Post event to queue in FIFO manner. Returns False if the event
+        was dropped due to overflow."""
+        with self.mutex:
+            queued = self._post(e)
+            self.not_empty.notify()
+        return queued
+
+    def post_fifo_many(self, events):
+        """Post sequence of events to queue in FIFO manner, taking the queue
+        lock once and waking the consumer once. Returns number of events
+        queued. With OVERFLOW_RAISE nothing is posted unless all events
+        fit."""
+        with self.mutex:
+            size = len(self.queue)
+            fits = size + len(events) <= self._maxsize
+            if fits and not self._coalesce:
+                if events:
+                    self._max = max(self._max, size + len(events) - 1)
+                self._account()
+                self.queue.extend(events)
+                self.unfinished_tasks += len(events)
+                self._posts += len(events)
+                posted = len(events)
+            elif not fits and self._overflow == OVERFLOW_RAISE:
+                self._raised += 1
+                raise QueueOverflowError()
+            else:
+                posted = 0
+                for e in events:
+                    if self._post(e):
+                        posted += 1
+            self.not_empty.notify()
+        return posted
 
     def post_lifo(self, e):
         """Post event to queue in LIFO manner"""
         raise NotImplementedError()
 
+    def _post(self, e):
+        """Put e with the mutex held. Returns False if e was dropped"""
+        key = None
+        if self._coalesce:
+            key_func = self._coalesce.get(e.sig)
+            if key_func is not None:
+                key = (e.sig, key_func(e))
+                slot = self._index.get(key)
+                if slot is not None:
+                    slot.e = e
+                    self._coalesced += 1
+                    self._posts += 1
+                    return True
+        if len(self.queue) >= self._maxsize:
+            if self._overflow == OVERFLOW_COALESCE:
+                return self._replace(e)
+            if not self._make_room():
+                return False
+        self._max = max(self._max, len(self.queue))
+        if key is not None:
+            e = self._index[key] = _Slot(key, e)
+        self._put(e)
+        self.unfinished_tasks += 1
+        self._posts += 1
+        return True
+
+    def _account(self):
+        """Add time since last change of queue length to wait integral"""
+        now = time.time()
+        self._wait_s += len(self.queue) * (now - self._changed)
+        self._changed = now
+
+    def _put(self, item):
+        self._account()
+        self.queue.append(item)
+
+    def _get(self):
+        self._account()
+        item = self.queue.popleft()
+        if item.__class__ is _Slot:
+            if self._index.get(item.key) is item:
+                del self._index[item.key]
+            return item.e
+        return item
+
+    def _make_room(self):
+        """Apply overflow policy with the mutex held. Returns True if there
+        is now room to put another event."""
+        if self._overflow == OVERFLOW_RAISE:
+            self._raised += 1
+            raise QueueOverflowError()
+        elif self._overflow == OVERFLOW_BLOCK:
+            self._blocked += 1
+            self.not_empty.notify()  # Consumer may not know of queued events
+            if self._timeout is not None:
+                endtime = time.time() + self._timeout
+            while len(self.queue) >= self._maxsize:
+                if self._timeout is None:
+                    self.not_full.wait()
+                else:
+                    remaining = endtime - time.time()
+                    if remaining <= 0.0:
+                        self._dropped += 1
+                        return False
+                    self.not_full.wait(remaining)
+            return True
+        elif self._overflow == OVERFLOW_DROP_OLDEST:
+            if self.queue[0] is None:  # Keep the stop sentinel, drop e
+                self._dropped += 1
+                return False
+            QEQueue._get(self)  # From the normal lane, never an urgent one
+            self.unfinished_tasks -= 1
+            self._dropped += 1
+            return True
+        self._dropped += 1  # OVERFLOW_DROP_NEWEST
+        return False
+
+    def _replace(self, e):
+        """Replace queued event with the same overflow key as e. Returns
+        False, dropping e, if there is no such event"""
+        key = self._key(e)
+        for i, queued in enumerate(self.queue):
+            if queued is not None and queued.__class__ is not _Slot and \
+                    self._key(queued) == key:
+                self.queue[i] = e
+                self._coalesced += 1
+                self._posts += 1
+                return True
+        self._dropped += 1
+        return False
+
+    def get_overflow_counts(self):
+        """Return dict with overflow counters"""
+        return {
+            'raised': self._raised,
+            'blocked': self._blocked,
+            'dropped': self._dropped,
+            'coalesced': self._coalesced,
+        }
+
+    def get_lane_counts(self):
+        """Return list with dict of depth, capacity, high-water mark, posts
+        and dropped events per lane, normal lane first"""
+        return [{
+            'depth': len(self.queue),
+            'capacity': self._maxsize,
+            'high_water': self._max,
+            'posts': self._posts,
+            'dropped': self._dropped + self._raised,
+        }]
+
+
+class _Lane(object):
+    """Urgent lane of a LaneQueue"""
+
+    def __init__(self, maxsize):
+        self.queue = collections.deque()
+        self.maxsize = maxsize
+        self.max = 0             # watermark
+        self.posts = 0
+        self.dropped = 0
+
+
+class LaneQueue(QEQueue):
+    """QEQueue with urgent lanes ahead of the normal lane. Lane 0 is the
+    normal lane, a QEQueue in all respects. Lanes 1 and up are drained
+    first, highest lane first, each event still being dispatched to
+    completion before the next is taken.
+
+    Events go to the lane given by the lanes dict with sig: lane, or to the
+    lane given to post_lane. Each urgent lane has its own capacity. A full
+    urgent lane never blocks or coalesces, the event is dropped, or
+    QueueOverflowError raised if the overflow policy is OVERFLOW_RAISE."""
+
+    def __init__(self, maxsize, lane_sizes, lanes=None,
+                 overflow=OVERFLOW_RAISE, timeout=None, key=None,
+                 coalesce=None):
+        QEQueue.__init__(self, maxsize, overflow, timeout, key, coalesce)
+        self._lane_of = lanes or {}
+        # Index 0 unused, lane n is self._lanes[n]
+        self._lanes = [None] + [_Lane(size) for size in lane_sizes]
+        self._urgent = 0  # Events in urgent lanes
+        assert max([0] + list(self._lane_of.values())) < len(self._lanes)
+
+    def post_fifo(self, e):
+        lane = self._lane_of.get(e.sig)
+        if lane is not None:
+            return self.post_lane(e, lane)
+        with self.mutex:
+            queued = self._post(e)
+            self.not_empty.notify()
+        return queued
+
+    def post_fifo_many(self, events):
+        lane_of = self._lane_of
+        for e in events:
+            if e.sig in lane_of:
+                return len([e for e in events if self.post_fifo(e)])
+        return QEQueue.post_fifo_many(self, events)
+
+    def post_lane(self, e, lane):
+        """Post event to lane. Returns False if the event was dropped.
+        Raises ValueError if there is no such lane"""
+        if not 0 <= lane < len(self._lanes):
+            raise ValueError('No lane %r' % (lane,))
+        if lane == 0:
+            return QEQueue.post_fifo(self, e)
+        with self.mutex:
+            q = self._lanes[lane]
+            if len(q.queue) >= q.maxsize:
+                q.dropped += 1
+                if self._overflow == OVERFLOW_RAISE:
+                    raise QueueOverflowError()
+                return False
+            q.max = max(q.max, len(q.queue))
+            self._account()
+            q.queue.append(e)
+            q.posts += 1
+            self._urgent += 1
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+        return True
+
+    def _qsize(self):
+        return len(self.queue) + self._urgent
+
+    def _account(self):
+        now = time.time()
+        self._wait_s += (len(self.queue) + self._urgent) * \
+            (now - self._changed)
+        self._changed = now
+
+    def _get(self):
+        if self._urgent:
+            for q in reversed(self._lanes[1:]):
+                if q.queue:
+                    self._account()
+                    self._urgent -= 1
+                    return q.queue.popleft()
+        return QEQueue._get(self)
+
+    def get_lane_counts(self):
+        counts = QEQueue.get_lane_counts(self)
+        for q in self._lanes[1:]:
+            counts.append({
+                'depth': len(q.queue),
+                'capacity': q.maxsize,
+                'high_water': q.max,
+                'posts': q.posts,
+                'dropped': q.dropped,
+            })
+        return counts
+
 
 class Active(qp.Hsm):
-    """Hierarchical state machine object with own thread and event queue"""
+    """Hierarchical state machine object with own thread and event queue.
+    Objects started with a WorkerPool share the threads of the pool
+    instead. An exception raised by a state handler ends the thread of the
+    object, unless log_exceptions is set, then it is logged and the object
+    goes on with the next event. In a WorkerPool, where a worker is shared
+    by many objects, exceptions are always logged."""
 
     signals = []
+    overflow = OVERFLOW_RAISE   # Queue overflow policy, see QEQueue
+    overflow_timeout = None
+    overflow_key = None
+    coalesce = {}               # Coalescable signals, sig: key function
+    lane_sizes = []             # Capacity of urgent lanes 1.., see LaneQueue
+    lanes = {}                  # Signals of urgent lanes, sig: lane
+    log_exceptions = False      # Log handler exceptions and go on
+    _journal = None             # Journal of dispatched events, see qp.journal
+    _pool = None
+    _thread = None
+    _dispatches = 0
+    _dispatch_start = None      # time.time() of current dispatch, see
+    _dispatch_event = None      # qp.watchdog
+    _dispatch_thread = None     # Ident of thread dispatching
+    _slow_dispatches = 0        # Dispatches over the watchdog budget
 
     class QThread(threading.Thread):
         """Wrapped python thread"""
@@ -104,27 +598,89 @@ class Active(qp.Hsm):
     def __init__(self, initial):
         qp.Hsm.__init__(self, initial)
         self._running = threading.Event()
+        self._finished = threading.Event()
+        self._dispatch_lock = threading.Lock()  # Held by journal replay
+        self._qf = QF
 
-    def start(self, prio, size, ie):
-        """Start Active object at unique prio, and allocate space"""
-        self._queue = QEQueue(size)
+    def start(self, prio, size, ie, qf=None, pool=None):
+        """Start Active object at unique prio, and allocate space.
+        The object is added to framework qf, default is QF, and runs in its
+        own thread unless a WorkerPool is given. Raises ValueError for an
+        object with the OVERFLOW_BLOCK policy in a pool"""
+        if pool is not None and self.overflow == OVERFLOW_BLOCK:
+            raise ValueError('OVERFLOW_BLOCK may deadlock a WorkerPool')
+        if self.lane_sizes:
+            self._queue = LaneQueue(size, self.lane_sizes, self.lanes,
+                                    self.overflow, self.overflow_timeout,
+                                    self.overflow_key, self.coalesce)
+        else:
+            self._queue = QEQueue(size, self.overflow, self.overflow_timeout,
+                                  self.overflow_key, self.coalesce)
         self._prio = prio
-        QF.add(self)
+        self._qf = qf or QF
+        self._qf.add(self)
         for sig in self.signals:
             self.subscribe(sig)
         self.init(ie)
+        if pool is not None:
+            self._running.set()
+            self._scheduled = False
+            self._pool = pool
+            if self._queue.qsize():  # Posted to itself in initial transition
+                pool.schedule(self)
+            return
         self._thread = Active.QThread(self)
         self._thread.name = self.__class__.__name__
         self._thread.start()
 
-    def post_fifo(self, e):
-        """Post event to object's queue in FIFO manner.
-        Raises QueueOverflowError if queue is full"""
-        if self._queue.qsize() >= self._queue._maxsize:
-            args = (self._thread.name, self._prio)
-            message = 'Overflow in active object %s with prio %d' % args
-            raise QueueOverflowError(message)
-        self._queue.post_fifo(e)
+    def _name(self):
+        """Return name of thread, or class name if run in a pool"""
+        if self._thread is not None:
+            return self._thread.name
+        return self.__class__.__name__
+
+    def post_fifo(self, e, lane=None):
+        """Post event to object's queue in FIFO manner, to the given lane
+        if the object has urgent lanes (lane_sizes).
+        Raises QueueOverflowError if queue is full and the overflow policy
+        is OVERFLOW_RAISE, ValueError if given an urgent lane the object
+        does not have. Ignored in the thread replaying a journal"""
+        if lane and not self.lane_sizes:
+            raise ValueError('Active object %s has no urgent lanes' %
+                             self._name())
+        if self._qf.replaying:
+            return
+        try:
+            if not lane:
+                self._queue.post_fifo(e)
+            else:
+                self._queue.post_lane(e, lane)
+        except QueueOverflowError:
+            self._raise_overflow()
+        pool = self._pool  # Cleared by the pool when the object finishes
+        if pool is not None:
+            pool.schedule(self)
+
+    def post_fifo_many(self, events):
+        """Post sequence of events to object's queue in FIFO manner.
+        Returns number of events added to the queue. Raises
+        QueueOverflowError, without posting any of the events, if they do
+        not all fit in the queue and the overflow policy is OVERFLOW_RAISE"""
+        if self._qf.replaying:
+            return 0
+        try:
+            posted = self._queue.post_fifo_many(events)
+        except QueueOverflowError:
+            self._raise_overflow()
+        pool = self._pool  # Cleared by the pool when the object finishes
+        if pool is not None:
+            pool.schedule(self)
+        return posted
+
+    def _raise_overflow(self):
+        args = (self._name(), self._prio)
+        message = 'Overflow in active object %s with prio %d' % args
+        raise QueueOverflowError(message)
 
     def post_lifo(self, e):
         """Post event to object's queue in LIFO manner"""
@@ -133,59 +689,237 @@ class Active(qp.Hsm):
     def run(self):
         """Entry point for running Active object in own thread"""
         self._running.set()
-        while self._running.isSet():
+        self._dispatch_thread = threading.current_thread().ident
+        while self._running.is_set():
             e = self._queue.get()  # Get next event or hang on empty queue
             if e is None:  # Reached sentinel value
                 break
+            journal = self._journal
+            self._dispatch_event = e
+            self._dispatch_start = time.time()
+            try:
+                if journal is None:
+                    qp.Hsm.dispatch(self, e)
+                else:
+                    self._dispatch_journaled(journal, e)
+            except Exception:
+                if not self.log_exceptions:
+                    raise
+                logger.exception('Dispatch failed in %s' % self._name())
+            self._dispatch_start = None
+            self._dispatches += 1
+        self._finish()
+
+    def _dispatch_journaled(self, journal, e):
+        """Append e to journal and dispatch it, holding the dispatch lock
+        so that journal replay never dispatches at the same time. An event
+        that cannot be journaled is logged and dropped"""
+        with self._dispatch_lock:
+            try:
+                journal.append(self._prio, e)
+            except Exception:
+                logger.exception('Journaling failed in %s, event dropped' %
+                                 self._name())
+                return
             qp.Hsm.dispatch(self, e)
-        self.unsubscribe_all()
-        QF.remove(self)
 
-    def stop(self):
-        """Stop object from running and receiving events"""
-        self._running.clear()
+    def stop(self, drain=False):
+        """Stop object from running and receiving events. With drain, the
+        events already queued are dispatched first"""
+        if not drain:
+            self._running.clear()
         self._queue.put(None)  # Insert sentinel value
+        pool = self._pool
+        if pool is not None:
+            pool.schedule(self)
+
+    def _finish(self):
+        """Leave framework after last event"""
+        self.unsubscribe_all()
+        self.unwatch_all()
+        self._qf.remove(self)
+        self._finished.set()
+
+    def publish(self, e):
+        """Publish event e to the framework of this object"""
+        self._qf.publish(e)
 
     def subscribe(self, sig):
-        """Subscribe to specified signal"""
+        """Subscribe to specified signal. Subscribers are kept in lists
+        indexed by signal, so raises ValueError unless USER_SIG <= sig <
+        SIGNAL_LIMIT"""
         p = self._prio
-        assert sig >= qp.USER_SIG and 0 < p <= QF_MAX_ACTIVE and \
-            QF._active[p] == self
-        with QF._lock:
-            if sig in QF._subscribers:
-                if not p in QF._subscribers[sig]:
-                    QF._subscribers[sig].append(p)
-            else:
-                QF._subscribers[sig] = [p]
-            QF._subscribers[sig].sort()
+        qf = self._qf
+        if not qp.USER_SIG <= sig < SIGNAL_LIMIT:
+            raise ValueError('Cannot subscribe to signal %r' % (sig,))
+        assert qf._active.get(p) is self
+        bit = 1 << p
+        with qf._subscriber_lock:
+            if sig >= len(qf._subscriber_masks):
+                qf._grow_subscribers(sig)
+            mask = qf._subscriber_masks[sig]
+            if not mask & bit:
+                qf._subscriber_masks[sig] = mask | bit
+                # Swap in a new tuple, readers keep their old snapshot
+                subscribers = list(qf._subscribers[sig])
+                subscribers.insert(bisect.bisect_left(subscribers, p), p)
+                qf._subscribers[sig] = tuple(subscribers)
 
     def unsubscribe(self, sig):
         """Unsubscribe to specified signal"""
         p = self._prio
-        assert 0 < p <= QF_MAX_ACTIVE and QF._active[p] == self
-        with QF._lock:
-            QF._subscribers[sig].remove(p)
+        qf = self._qf
+        assert qf._active.get(p) is self
+        with qf._subscriber_lock:
+            subscribers = list(qf._subscribers[sig])
+            subscribers.remove(p)
+            qf._subscriber_masks[sig] &= ~(1 << p)
+            qf._subscribers[sig] = tuple(subscribers)
 
     def unsubscribe_all(self):
         """Unsubscribe to all signals"""
         p = self._prio
-        assert 0 < p <= QF_MAX_ACTIVE and QF._active[p] == self
-        with QF._lock:
-            for subscribers in QF._subscribers.itervalues():
-                if p in subscribers:
-                    subscribers.remove(p)
+        qf = self._qf
+        assert qf._active.get(p) is self
+        bit = 1 << p
+        with qf._subscriber_lock:
+            masks = qf._subscriber_masks
+            for sig in range(len(masks)):
+                if masks[sig] & bit:
+                    masks[sig] &= ~bit
+                    qf._subscribers[sig] = \
+                        tuple([q for q in qf._subscribers[sig] if q != p])
+
+    def watch(self, fd, factory, events=IO_READ):
+        """Watch file descriptor fd, or change the events watched.
+        When fd is ready for any of events, IO_READ and/or IO_WRITE, the
+        framework thread calls factory(fd, ready events) and posts the
+        event it returns to this object, nothing if None. Readiness is
+        reported until it is consumed, so the factory should do the
+        non-blocking read, write or accept, or the object should stop
+        watching. A factory raising an exception stops the watch"""
+        self._qf._watch(fd, self, factory, events)
+
+    def unwatch(self, fd):
+        """Stop watching file descriptor fd. Call before closing it"""
+        self._qf._unwatch(fd)
+
+    def unwatch_all(self):
+        """Stop watching all file descriptors"""
+        qf = self._qf
+        with qf._io_lock:
+            fds = [fd for fd, w in qf._watches.items() if w[0] is self]
+        for fd in fds:
+            qf._unwatch(fd)
+
+
+class WorkerPool(object):
+    """Fixed number of threads running Active objects that have events
+    queued. An object is run by at most one worker at a time so its events
+    are still processed one at a time, run to completion. Ready objects are
+    run in priority order, highest prio first, and give up the worker after
+    batch events so that objects at the same priority take turns.
+    Exceptions raised by state handlers are always logged and do not stop
+    the object, see Active.log_exceptions. Objects in a pool cannot use
+    OVERFLOW_BLOCK, a worker posting to a full queue would hold up the
+    workers that drain it."""
+
+    def __init__(self, workers=4, batch=16, name='WorkerPool'):
+        self._batch = batch
+        self._ready = []  # Heap with (-prio, seq, active)
+        self._seq = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._threads = []
+        for n in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='%s-%d' % (name, n))
+            thread.start()
+            self._threads.append(thread)
+
+    def schedule(self, a):
+        """Make active object ready to run unless it already is"""
+        with self._cond:
+            if not a._scheduled:
+                a._scheduled = True
+                self._push(-a._prio, a)
+
+    def stop(self):
+        """Stop workers once no objects are ready and wait for them"""
+        with self._cond:
+            for _thread in self._threads:
+                self._push(float('inf'), None)  # Sentinel after all objects
+        for thread in self._threads:
+            thread.join()
+
+    def _push(self, key, a):
+        self._seq += 1
+        heapq.heappush(self._ready, (key, self._seq, a))
+        self._cond.notify()
+
+    def _work(self):
+        """Worker thread loop"""
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                _key, _seq, a = heapq.heappop(self._ready)
+            if a is None:  # Reached sentinel value
+                break
+            if self._dispatch(a):
+                a._pool = None  # Never scheduled again
+                a._finish()
+                continue
+            with self._cond:
+                if a._queue.qsize():  # Back of the line at its prio
+                    self._push(-a._prio, a)
+                else:
+                    a._scheduled = False
+
+    def _dispatch(self, a):
+        """Dispatch at most batch events. Returns True if a has stopped"""
+        a._dispatch_thread = threading.current_thread().ident
+        for _n in range(self._batch):
+            if not a._running.is_set():
+                return True
+            try:
+                e = a._queue.get_nowait()
+            except Queue.Empty:
+                return False
+            if e is None:  # Reached sentinel value
+                return True
+            journal = a._journal
+            a._dispatch_event = e
+            a._dispatch_start = time.time()
+            try:
+                if journal is None:
+                    qp.Hsm.dispatch(a, e)
+                else:
+                    a._dispatch_journaled(journal, e)
+            except Exception:
+                logger.exception('Dispatch failed in %s' % a._name())
+            a._dispatch_start = None
+            a._dispatches += 1
+        return False
 
 
 class TimeEvt(qp.Event):
-    """Timer event"""
+    """Timer event. It is armed in the framework of the Active object it is
+    posted to, published timers use framework qf, default QF.
+    An armed time event holds its entry in the timer heap of the framework,
+    so it is disarmed and rearmed without searching for it. A time event
+    armed in seconds is in the deadline heap instead, never in both. Arming
+    a time event that is already armed either way is an error, use rearm
+    instead."""
 
-    def __init__(self, s):
+    def __init__(self, s, qf=None):
         assert s >= qp.USER_SIG
         self.sig = s
+        self._qf = qf or QF
         self._act = None
-        self._ctr = 0
+        self._entry = None  # [expiry tick, seq, self] in heap while armed
         self._interval = 0
-        self.ts = time.time()
+        self._deadline = None  # [expiry on the clock, seq, self] in heap
+        self.ts = self._qf.clock()
 
     def post_in(self, act, ticks):
         """Post event to specified Active object"""
@@ -207,161 +941,612 @@ class TimeEvt(qp.Event):
         self._interval = ticks
         self._arm(None, ticks)
 
+    def post_in_seconds(self, act, seconds):
+        """Post event to specified Active object after seconds, which need
+        not be a whole number of ticks"""
+        self._qf = act._qf
+        self._act = act
+        self._qf._arm_deadline(self, seconds)
+
+    def publish_in_seconds(self, seconds):
+        """Publish to framework after seconds"""
+        self._act = None
+        self._qf._arm_deadline(self, seconds)
+
+    def is_armed(self):
+        """Return True if the time event is armed"""
+        return self._entry is not None or self._deadline is not None
+
     def disarm(self):
-        """Disable timer event"""
-        with QF._lock:
-            was_armed = False
-            while self in QF._time_evt_list:
-                QF._time_evt_list.remove(self)    # Remove us from the list
+        """Disable timer event. Returns True if it was armed"""
+        qf = self._qf
+        with qf._timer_lock:
+            was_armed = self._deadline is not None
+            if was_armed:
+                qf._cancel_deadline(self)
+            if self._entry is not None:
+                qf._cancel(self)
                 was_armed = True
         return was_armed
 
     def rearm(self, ticks):
-        """Rearm timer event"""
+        """Arm timer event to expire in ticks, whether it is armed or not.
+        Returns True if it was armed"""
         assert ticks > 0 and self.sig >= qp.USER_SIG
-        with QF._lock:
-            self._ctr = ticks
-            if self in QF._time_evt_list:    # Are we armed
+        qf = self._qf
+        if qf.replaying:
+            return False
+        with qf._timer_lock:
+            is_armed = self._deadline is not None
+            if is_armed:
+                qf._cancel_deadline(self)
+            if self._entry is not None:
+                qf._cancel(self)
                 is_armed = True
-            else:
-                is_armed = False
-                QF._time_evt_list.append(self)
+            qf._schedule(self, ticks)
         return is_armed
 
     def _arm(self, act, ticks):
-        """Arm timer event"""
+        """Arm timer event, unless in the thread replaying a journal"""
         assert ticks > 0 and self.sig >= qp.USER_SIG
-        self._ctr = ticks
         self._act = act
-        with QF._lock:
-            QF._time_evt_list.append(self)    # Add us to the list
+        if act is not None:
+            self._qf = act._qf
+        if self._qf.replaying:
+            return
+        with self._qf._timer_lock:
+            assert self._entry is None and self._deadline is None, \
+                'Time event is already armed'
+            self._qf._schedule(self, ticks)
 
 
-class QF(object):
+class Framework(object):
     """Framework for running hierarchical FSMs as Active objects.
-    This implementation only allows a single QF instance in an application."""
-
-    _active = [None] * (QF_MAX_ACTIVE + 1)
-    _lock = threading.RLock()
-    _time_evt_list = []
-    _subscribers = {}  # Dict with signals: subscriber list
-    _tick_ctr = 0
-    _running = False
-
-    @classmethod
-    def start(cls):
-        """Start the framework"""
-        cls._running = True
-
-    @classmethod
-    def run(cls):
-        """Run framework"""
-        cls.start()
-        while cls._running:
-            with cls._lock:
-                cls.tick()
-            time.sleep(TICK_S)
-
-    @classmethod
-    def stop(cls):
-        """Stop framework"""
-        cls._running = False
-
-    @classmethod
-    def publish(cls, e):
-        """Publish event e to the framework"""
-        with cls._lock:  # perform multicasting with the scheduler locked
-            subscribers = cls._subscribers.get(e.sig, [])
-            for p in subscribers:
-                assert cls._active[p] != None
-                cls._active[p].post_fifo(e)
-
-    @classmethod
-    def tick(cls):
-        """Update system tick and evaluate counters and timer events"""
-        cls._tick_ctr += 1    # increment the tick counter
-        # iterate over copy of list since we change it
-        for t in cls._time_evt_list[:]:
-            t._ctr -= 1
-            if (t._ctr == 0):    # is the time event about to expire?
-                if (t._interval != 0):    # is it a periodic time evt?
-                    t._ctr = t._interval
-                else:  # one-shot timeevt, disarm by removing it from the list
-                    assert t in cls._time_evt_list
-                    cls._time_evt_list.remove(t)
-                t.ts = time.time()
-                if (t._act != None):
-                    t._act.post_fifo(t)
+    Each instance has its own active objects, subscriptions, timers and
+    locks, so independent workloads can be run side by side in one process.
+    The module level instance QF is the default framework of Active and
+    TimeEvt objects.
+
+    Each subsystem has its own lock:
+    _active_lock      guards the active object registry (_active)
+    _subscriber_lock  guards replacement of subscriber tuples (_subscribers,
+                      _subscriber_masks)
+    _timer_lock       guards the time events (_timers, _deadlines)
+    _io_lock          guards the watched file descriptors (_watches) and
+                      the pipe waking run (_wakeup)
+    Queue statistics and the tick counter are read without locking.
+
+    The kernel never holds two of these locks at the same time. Code that
+    needs more than one must take them in the order listed above. Event
+    queue locks are always innermost, no framework lock is taken while
+    holding one.
+
+    Nothing relies on the GIL, so the framework is safe on free-threaded
+    interpreters. Shared state is changed with its lock held, or only by
+    one thread: the run thread updates the tick statistics, the thread
+    running an active object its dispatch attributes. The registry is
+    iterated over snapshots taken with the lock (_actives) and queue
+    statistics are read with the queue lock held. Unlocked reads are of
+    single attributes, giving a consistent if possibly stale value."""
+
+    def __init__(self, name='QF'):
+        self.name = name
+        self._active = {}  # Dict with unique prio: active object
+        self._active_lock = threading.RLock()
+        self._subscriber_lock = threading.RLock()
+        self._timer_lock = threading.RLock()
+        self._timers = []  # Heap with [expiry tick, seq, time event or None]
+        self._timer_seq = 0
+        self._armed_timers = 0
+        self._cancelled_timers = 0  # Entries without time event in _timers
+        self._deadlines = []  # Heap with [deadline, seq, time event]
+        self._deadline_seq = 0
+        self._armed_deadlines = 0
+        self._cancelled_deadlines = 0  # Entries without time event
+        self._io_lock = threading.RLock()
+        self._wakeup = None  # Pipe interrupting the sleep of run
+        self._watches = {}  # fd: (active, factory, events)
+        self._poller = None  # Waits for ticks, deadlines and watches in run
+        # Lists indexed by signal with sorted tuples (COW) and bitmasks of
+        # the prios of the subscribers
+        self._subscribers = [()] * SIGNAL_SLOTS
+        self._subscriber_masks = [0] * SIGNAL_SLOTS
+        self._tick_ctr = 0
+        self._tick_overruns = 0  # ticks that took longer than TICK_S
+        self._missed_ticks = 0  # ticks run late to catch up
+        self._tick_due = None  # Scheduled time of current tick, set by run
+        self._timers_expired = 0
+        self._lateness_s = 0.0  # Total and max time events expired late
+        self._lateness_max_s = 0.0
+        self._running = False
+        self._accepting = True  # False once shutdown has begun
+        self._thread = None  # Thread started by run_in_thread
+        self._replay_thread = None  # Ident of thread replaying a journal
+
+    @property
+    def replaying(self):
+        """True in the thread replaying a journal, where publishing, posting
+        and arming time events are ignored. Other threads go on as usual"""
+        thread = self._replay_thread
+        return thread is not None and thread == get_ident()
+
+    def start(self):
+        """Start the framework, again after a shutdown"""
+        self._running = True
+        self._accepting = True
+
+    def run(self):
+        """Run framework. Ticks are scheduled at absolute deadlines on the
+        monotonic clock, so neither tick processing nor oversleeping makes
+        timers drift. Ticks that are due when the thread gets to run are
+        all run, late ticks are counted as missed. Time events armed in
+        seconds expire at their own deadlines between the ticks.
+        File descriptors watched by active objects are polled while waiting
+        for the next tick or deadline, see Active.watch."""
+        self.start()
+        self._run()
+
+    def _run(self):
+        """Run framework until stopped"""
+        wakeup = os.pipe()
+        for fd in wakeup:
+            _set_nonblocking(fd)
+        poller = _Poller()
+        poller.register(wakeup[0], IO_READ)
+        with self._io_lock:
+            for fd, (_a, _f, events) in self._watches.items():
+                poller.register(fd, events)
+            self._poller = poller
+            self._wakeup = wakeup
+        next_tick = monotonic() + TICK_S
+        try:
+            while self._running:
+                now = monotonic()
+                if now >= next_tick:
+                    if now - next_tick >= TICK_S:
+                        self._missed_ticks += 1
+                    self._tick_due = next_tick
+                    self.tick()
+                    next_tick += TICK_S
+                    if monotonic() - now > TICK_S:
+                        self._tick_overruns += 1
+                    continue  # Catch up before sleeping
+                self._expire_deadlines(now)
+                wake = next_tick
+                with self._timer_lock:  # shutdown may be clearing the heap
+                    if self._deadlines:
+                        wake = min(wake, self._deadlines[0][0])
+                timeout = wake - monotonic()
+                if timeout > 0.0:
+                    for fd, events in poller.poll(timeout):
+                        if fd == wakeup[0]:
+                            os.read(fd, 4096)
+                        else:
+                            self._ready(fd, events)
+        finally:
+            with self._io_lock:  # No _wake writes to a closed pipe
+                self._wakeup = None
+                self._poller = None
+                poller.close()
+                for fd in wakeup:
+                    os.close(fd)
+
+    def run_in_thread(self):
+        """Run framework in a new daemon thread. Returns the thread"""
+        self.start()  # Running before the thread gets to start
+        thread = threading.Thread(target=self._run, name=self.name)
+        thread.daemon = True
+        thread.start()
+        self._thread = thread
+        return thread
+
+    def stop(self):
+        """Stop framework, run returns without waiting for the next tick"""
+        self._running = False
+        self._wake()
+
+    def shutdown(self, drain=True, timeout=None):
+        """Stop ticking timers, ignore new publishes and stop all active
+        objects, highest prio first. With drain each object dispatches the
+        events already in its queue before it stops, otherwise it stops
+        after the event being dispatched. Lower prio objects keep running
+        while higher prio objects are stopped. Waits at most timeout seconds in
+        total, forever if None, for the objects to finish.
+        The thread started by run_in_thread is joined as well. Publishes
+        are ignored until the framework is started again.
+        Returns dict with prio: dict with name, number of events drained
+        (dispatched during shutdown) and dropped (left in queue)."""
+        self.stop()
+        self._accepting = False
+        with self._timer_lock:
+            for entry in self._timers:
+                if entry[2] is not None:
+                    entry[2]._entry = None
+            del self._timers[:]
+            self._armed_timers = self._cancelled_timers = 0
+            for entry in self._deadlines:
+                if entry[2] is not None:
+                    entry[2]._deadline = None
+            del self._deadlines[:]
+            self._armed_deadlines = self._cancelled_deadlines = 0
+        if timeout is not None:
+            deadline = time.time() + timeout
+        counts = {}
+        actives = self._actives()
+        actives.reverse()
+        dispatches = dict([(p, a._dispatches) for p, a in actives])
+        for p, a in actives:
+            a.stop(drain)
+            if timeout is None:
+                a._finished.wait()
+            else:
+                a._finished.wait(max(0.0, deadline - time.time()))
+            if not a._finished.is_set():
+                a._running.clear()  # Out of time, stop after current event
+            with a._queue.mutex:  # Sentinels are in the normal lane only
+                dropped = a._queue._qsize() - len(
+                    [e for e in a._queue.queue if e is None])
+            counts[p] = {
+                'name': a._name(),
+                'drained': a._dispatches - dispatches[p],
+                'dropped': dropped,
+            }
+        for _p, a in actives:
+            if a._thread is not None:
+                if timeout is None:
+                    a._thread.join()
                 else:
-                    cls.publish(t)
+                    a._thread.join(max(0.0, deadline - time.time()))
+        thread = self._thread
+        if thread is not None:
+            if timeout is None:
+                thread.join()
+            else:
+                thread.join(max(0.0, deadline - time.time()))
+            if not thread.is_alive():
+                self._thread = None
+        return counts
 
-    @classmethod
-    def get_time(cls):
+    def publish(self, e):
+        """Publish event e to the framework.
+        The subscriber tuple is an immutable snapshot which is replaced, never
+        modified, on subscription changes. Multicasting is therefore done
+        without holding the framework lock.
+        A QueueOverflowError from a subscriber does not stop the multicast,
+        the first one is raised after all subscribers have been posted to.
+        Events published after shutdown has begun or by the thread
+        replaying a journal are ignored. Raises ValueError for a negative
+        signal."""
+        if not self._accepting or self.replaying:
+            return
+        if e.sig < 0:
+            raise ValueError('Negative signal %r' % (e.sig,))
+        try:
+            subscribers = self._subscribers[e.sig]
+        except IndexError:  # Above all subscribed signals
+            return
+        error = None
+        for p in subscribers:
+            active = self._active.get(p)
+            if active is not None:  # May have been removed after snapshot
+                try:
+                    active.post_fifo(e)
+                except QueueOverflowError as exc:
+                    error = error or exc
+        if error is not None:
+            raise error
+
+    def publish_many(self, events):
+        """Publish sequence of events to the framework.
+        Subscribers are looked up once per signal and each subscriber gets
+        its share of the events, in their original order, in one bulk queue
+        operation. Returns dict with prio: number of events delivered.
+        Overflow errors, shutdown and replay are handled as in publish."""
+        if not self._accepting or self.replaying:
+            return {}
+        lookup = {}  # Subscriber snapshot per signal
+        all_subscribers = self._subscribers
+        slots = len(all_subscribers)
+        shares = {}  # prio: events to post
+        for e in events:
+            try:
+                subscribers = lookup[e.sig]
+            except KeyError:
+                if e.sig < 0:
+                    raise ValueError('Negative signal %r' % (e.sig,))
+                subscribers = lookup[e.sig] = \
+                    e.sig < slots and all_subscribers[e.sig] or ()
+            for p in subscribers:
+                try:
+                    shares[p].append(e)
+                except KeyError:
+                    shares[p] = [e]
+        delivered = {}
+        error = None
+        for p in sorted(shares):
+            active = self._active.get(p)
+            if active is not None:  # May have been removed after snapshot
+                try:
+                    delivered[p] = active.post_fifo_many(shares[p])
+                except QueueOverflowError as exc:
+                    error = error or exc
+        if error is not None:
+            raise error
+        return delivered
+
+    def tick(self):
+        """Update system tick and expire time events. Time events are kept in
+        a heap ordered on the tick they expire at, so only the expiring ones
+        are looked at. Expired time events are collected with the timer lock
+        held and posted after it has been released."""
+        expired = []
+        with self._timer_lock:
+            self._tick_ctr += 1    # increment the tick counter
+            timers = self._timers
+            while timers and timers[0][0] <= self._tick_ctr:
+                _expiry, _seq, t = heapq.heappop(timers)
+                if t is None:  # Disarmed
+                    self._cancelled_timers -= 1
+                    continue
+                t._entry = None
+                self._armed_timers -= 1
+                if t._interval != 0:    # is it a periodic time evt?
+                    self._schedule(t, t._interval)
+                expired.append(t)
+            now = self.clock()
+            if expired and self._tick_due is not None:
+                self._count_expired(len(expired), now - self._tick_due)
+        for t in expired:
+            t.ts = now
+            if (t._act != None):
+                t._act.post_fifo(t)
+            else:
+                self.publish(t)
+
+    def get_time(self):
         """Return tick counter"""
-        with cls._lock:
-            tick_ctr = cls._tick_ctr
-        return tick_ctr
-
-    @classmethod
-    def get_queue_margin(cls, prio):
-        assert prio <= QF_MAX_ACTIVE and cls._active[prio] != 0
-        with cls._lock:
-            margin = cls._active[prio]._queue._maxsize - \
-                     cls._active[prio]._queue._max
-        return margin
-
-    @classmethod
-    def print_queue_margins(cls):
+        return self._tick_ctr
+
+    def _schedule(self, t, ticks):
+        """Arm time event t to expire in ticks, timer lock must be held"""
+        self._timer_seq += 1
+        t._entry = [self._tick_ctr + ticks, self._timer_seq, t]
+        heapq.heappush(self._timers, t._entry)
+        self._armed_timers += 1
+
+    def _cancel(self, t):
+        """Disarm time event t, timer lock must be held. Its entry is left
+        in the heap, which is compacted when most entries are cancelled"""
+        t._entry[2] = None
+        t._entry = None
+        self._armed_timers -= 1
+        self._cancelled_timers += 1
+        if self._cancelled_timers > 64 and \
+                self._cancelled_timers > self._armed_timers:
+            self._timers = [e for e in self._timers if e[2] is not None]
+            heapq.heapify(self._timers)
+            self._cancelled_timers = 0
+
+    def clock(self):
+        """Return current time in seconds on the monotonic clock. Time events
+        armed in seconds expire and are time stamped on this clock"""
+        return monotonic()
+
+    def _arm_deadline(self, t, seconds):
+        """Arm time event t to expire after seconds"""
+        assert seconds >= 0.0 and t.sig >= qp.USER_SIG
+        if self.replaying:
+            return
+        with self._timer_lock:
+            assert t._entry is None and t._deadline is None, \
+                'Time event is already armed'
+            self._deadline_seq += 1
+            entry = [self.clock() + seconds, self._deadline_seq, t]
+            t._deadline = entry
+            heapq.heappush(self._deadlines, entry)
+            self._armed_deadlines += 1
+            earliest = self._deadlines[0] is entry
+        if earliest:  # Sleeping for too long
+            self._wake()
+
+    def _cancel_deadline(self, t):
+        """Disarm time event t armed in seconds, timer lock must be held.
+        Its entry is left in the heap, which is compacted when most entries
+        are cancelled"""
+        t._deadline[2] = None
+        t._deadline = None
+        self._armed_deadlines -= 1
+        self._cancelled_deadlines += 1
+        if self._cancelled_deadlines > 64 and \
+                self._cancelled_deadlines > self._armed_deadlines:
+            self._deadlines = [e for e in self._deadlines if e[2] is not None]
+            heapq.heapify(self._deadlines)
+            self._cancelled_deadlines = 0
+
+    def _wake(self):
+        """Interrupt the sleep of run"""
+        with self._io_lock:
+            if self._wakeup is not None:
+                try:
+                    os.write(self._wakeup[1], b'w')
+                except OSError as exc:
+                    if exc.errno != errno.EAGAIN:
+                        raise
+
+    def _expire_deadlines(self, now):
+        """Post or publish time events armed in seconds that have expired
+        at now. Returns number of expired time events"""
+        expired = []
+        with self._timer_lock:
+            deadlines = self._deadlines
+            while deadlines and deadlines[0][0] <= now:
+                deadline, _seq, t = heapq.heappop(deadlines)
+                if t is None:  # Disarmed
+                    self._cancelled_deadlines -= 1
+                    continue
+                t._deadline = None
+                self._armed_deadlines -= 1
+                expired.append(t)
+                self._count_expired(1, now - deadline)
+        for t in expired:
+            t.ts = now
+            if t._act is not None:
+                t._act.post_fifo(t)
+            else:
+                self.publish(t)
+        return len(expired)
+
+    def _grow_subscribers(self, sig):
+        """Make room for subscribers of sig, subscriber lock must be held"""
+        slots = max(sig + 1, 2 * len(self._subscriber_masks))
+        grow = slots - len(self._subscriber_masks)
+        self._subscriber_masks.extend([0] * grow)
+        # Replace the list, publish may be indexing the old one
+        self._subscribers = self._subscribers + [()] * grow
+
+    def _watch(self, fd, a, factory, events):
+        """Post events made by factory to a when fd is ready for events"""
+        assert events and not events & ~(IO_READ | IO_WRITE)
+        with self._io_lock:
+            self._watches[fd] = (a, factory, events)
+            if self._poller is not None:
+                self._poller.register(fd, events)
+        self._wake()  # select only sees the new set on the next poll
+
+    def _unwatch(self, fd):
+        with self._io_lock:
+            if self._watches.pop(fd, None) is not None and \
+                    self._poller is not None:
+                self._poller.unregister(fd)
+
+    def _ready(self, fd, events):
+        """Post event for file descriptor fd ready for events"""
+        watch = self._watches.get(fd)
+        if watch is None:  # Unwatched after poll
+            return
+        a, factory, watched = watch
+        events &= watched
+        if not events:
+            return
+        try:
+            e = factory(fd, events)
+        except Exception:
+            logger.exception('Unwatching fd %d of %s' % (fd, a._name()))
+            self._unwatch(fd)
+            return
+        if e is not None:
+            try:
+                a.post_fifo(e)
+            except QueueOverflowError:
+                logger.exception('Dropped event for fd %d' % fd)
+
+    def _count_expired(self, count, lateness):
+        """Update statistics with count time events expired lateness
+        seconds after their deadline, timer lock must be held"""
+        self._timers_expired += count
+        self._lateness_s += count * lateness
+        self._lateness_max_s = max(self._lateness_max_s, lateness)
+
+    def get_queue_margin(self, prio):
+        active = self._active.get(prio)
+        assert active is not None
+        return active._queue._maxsize - active._queue._max
+
+    def print_queue_margins(self):
         s = 'QF HWMS: '
-        for active in cls._active:
-            if active is not None:
-                s += ("%s[%s]=%s(%s) " % (active._thread.name,
-                                          active._prio,
-                                          active._queue.qsize(),
-                                          active._queue._max))
+        for _p, active in self._actives():
+            s += ("%s[%s]=%s(%s) " % (active._name(),
+                                      active._prio,
+                                      active._queue.qsize(),
+                                      active._queue._max))
         return s
 
-    @classmethod
-    def get_queue_margins(cls):
+    def get_queue_margins(self):
         """Return string of active objects sorted on max queue"""
         stats = []
-        with cls._lock:
-            for active in cls._active:
-                if active is not None:
-                    stats.append((active._thread.name,
-                                  active._prio,
-                                  active._queue._max))
+        for _p, active in self._actives():
+            stats.append((active._name(),
+                          active._prio,
+                          active._queue._max))
         queues = ['%s[%s]=%s' % s for s in sorted(stats,
                                                   key=lambda x: x[2],
                                                   reverse=True)]
         return ', '.join(queues)
 
-    @classmethod
-    def clear_queuemargins(cls):
-        with cls._lock:
-            for active in cls._active:
-                if active is not None:
-                    active._queue._max = 0
+    def get_overflow_counts(self):
+        """Return dict with prio: overflow counters of each active object"""
+        counts = {}
+        for p, active in self._actives():
+            with active._queue.mutex:
+                counts[p] = active._queue.get_overflow_counts()
+        return counts
+
+    def get_metrics(self):
+        """Return dict with framework counters and a list of dicts with
+        queue and dispatch counters of each active object, in prio order.
+        The counters of each queue are read with its lock held, so they
+        are consistent with each other, and the timer counters with the
+        timer lock held."""
+        actives = []
+        for p, a in self._actives():
+            q = a._queue
+            with q.mutex:
+                size = q._qsize()
+                lanes = q.get_lane_counts()
+                stats = {
+                    'name': a._name(),
+                    'prio': p,
+                    'depth': size,
+                    'high_water': q._max,
+                    'capacity': q._maxsize,
+                    'posts': sum([lane['posts'] for lane in lanes]),
+                    'dispatches': a._dispatches,
+                    'slow_dispatches': a._slow_dispatches,
+                    'wait_s': q._wait_s + size * (time.time() - q._changed),
+                }
+                stats.update(q.get_overflow_counts())
+                stats['lanes'] = lanes
+            actives.append(stats)
+        with self._timer_lock:
+            return {
+                'name': self.name,
+                'ticks': self._tick_ctr,
+                'tick_overruns': self._tick_overruns,
+                'missed_ticks': self._missed_ticks,
+                'armed_timers': self._armed_timers + self._armed_deadlines,
+                'timers_expired': self._timers_expired,
+                'timer_lateness_s': self._lateness_s,
+                'timer_lateness_max_s': self._lateness_max_s,
+                'actives': actives,
+            }
 
-    @classmethod
-    def add(cls, a):
-        """Add active object"""
+    def clear_queuemargins(self):
+        for _p, active in self._actives():
+            with active._queue.mutex:
+                active._queue._max = 0
+
+    def _actives(self):
+        """Return list of (prio, active object) in prio order"""
+        with self._active_lock:
+            return sorted(self._active.items())
+
+    def add(self, a):
+        """Add active object at its unique prio, any positive integer"""
         p = a._prio
-        assert 0 < p <= QF_MAX_ACTIVE and (cls._active[p] == None), \
-            "p=%d" % (p)
-        cls._active[p] = a
+        with self._active_lock:
+            assert 0 < p and p not in self._active, "p=%d" % (p)
+            self._active[p] = a
 
-    @classmethod
-    def remove(cls, a):
+    def remove(self, a):
         """Remove active object"""
-        with cls._lock:
-            p = a._prio
-            assert 0 < p <= QF_MAX_ACTIVE
-            cls._active[p] = None        # free-up the priority level
-            logger.info('Removing %s' % a._thread.name)
-            for active in cls._active:
-                if active:  # At least one active object
-                    return
+        with self._active_lock:
+            del self._active[a._prio]        # free-up the priority level
+            logger.info('Removing %s' % a._name())
+            if self._active:  # At least one active object
+                return
             # No more active objects - stopping framework
             logger.info('No more active objects - shutting down framework')
-            cls.stop()
+            self.stop()
+
+
+QF = Framework()  # Default framework
@@ -6,39 +6,46 @@
 """Unittest helper for testing Hsm and Active objects"""
 
 # Standard
+from __future__ import print_function
 import unittest
 
-# External
-import mock
-
 # Local
-import sys
 import qp
-import qif
+
+
+class CallRecorder(object):
+    """Callable recording the arguments of each call in call_args_list,
+    as (args, kwargs), like mock.Mock"""
+
+    def __init__(self):
+        self.call_args_list = []
+
+    def __call__(self, *args, **kwargs):
+        self.call_args_list.append((args, kwargs))
 
 
 class QpTester(object):
     """Base class for testing code using QP"""
 
     def setUp(self):
-        # Mock qp.QF.publish
+        # Record calls of qp.QF.publish
         self.saved_publish = qp.QF.publish
-        qp.QF.publish = mock.Mock()
-        # Mock qp.Active.postFIFO
-        self.saved_qp_active_postFIFO = qp.Active.postFIFO
-        qp.Active.postFIFO = mock.Mock()
-        # Mock qp.Active.stop
+        qp.QF.publish = CallRecorder()
+        # Record calls of qp.Active.post_fifo
+        self.saved_qp_active_post_fifo = qp.Active.post_fifo
+        qp.Active.post_fifo = CallRecorder()
+        # Record calls of qp.Active.stop
         self.saved_qp_active_stop = qp.Active.stop
-        qp.Active.stop = mock.Mock()
+        qp.Active.stop = CallRecorder()
 
     def tearDown(self):
-        # Restore mocked objects
+        # Restore recorded objects
         qp.Active.stop = self.saved_qp_active_stop
-        qp.Active.postFIFO = self.saved_qp_active_postFIFO
+        qp.Active.post_fifo = self.saved_qp_active_post_fifo
         qp.QF.publish = self.saved_publish
 
     def assertPublished(self, sig, par):
-        matcher = Matcher(self.event_compare, qif.Event(sig, par))
+        matcher = Matcher(self.event_compare, _event(sig, par))
         found = False
         for call in qp.QF.publish.call_args_list:
             if call[0][0] == matcher:
@@ -47,15 +54,8 @@ class QpTester(object):
         if not found:  # Print events
             for call in qp.QF.publish.call_args_list:
                 e = call[0][0]
-                try:
-                    print "%s(%s)" % (qif.name(e.sig),
-                            qif.name(e.sig, e.par))
-                except:
-                    print "%s" % qif.name(e.sig)
-            try:
-                print "Expected: %s(%s)" % (qif.name(sig), qif.name(sig, par))
-            except:
-                print "Expected: %s" % qif.name(sig)
+                print(describe(e.sig, getattr(e, 'par', None)))
+            print("Expected: %s" % describe(sig, par))
         assert found, 'Event not published'
 
     def assertPublishedJson(self, method, params):
@@ -63,6 +63,7 @@ class QpTester(object):
             'method': method,
             'params': params,
         }
+        import qif  # Only the JSON helpers need the qif package
         self.assertPublished(qif.JSON_SIGNAL, par)
 
     def assertNotPublished(self, sig, par=None):
@@ -73,7 +74,7 @@ class QpTester(object):
         assert False, 'Signal unexpectedly published'
 
     def assertPublishedSignal(self, sig):
-        matcher = Matcher(self.signal_compare, qif.Event(sig, None))
+        matcher = Matcher(self.signal_compare, _event(sig, None))
         found = False
         for call in qp.QF.publish.call_args_list:
             if call[0][0] == matcher:
@@ -83,7 +84,7 @@ class QpTester(object):
 
     def getPublished(self, sig):
         pars = []
-        matcher = Matcher(self.signal_compare, qif.Event(sig, None))
+        matcher = Matcher(self.signal_compare, _event(sig, None))
         for call in qp.QF.publish.call_args_list:
             if call[0][0] == matcher:
                 pars.append(call[0][0])
@@ -101,7 +102,7 @@ class QpTester(object):
         return x.sig == y.sig and x.par == y.par
 
     def assertDictContainsSubset(self, expected, result):
-        for k, v in expected.iteritems():
+        for k, v in expected.items():
             self.assertEqual(result[k], v)
 
 
@@ -120,7 +121,7 @@ class HsmTester(QpTester):
             e = sig
             sig = e.sig
         else:
-            e = qif.Event(sig, par)
+            e = _event(sig, par)
         if src:
             e.src = src
         if sig >= qp.USER_SIG:
@@ -128,6 +129,7 @@ class HsmTester(QpTester):
         self.dut.dispatch(e)
 
     def dispatch_json(self, method, params={}):
+        import qif  # Only the JSON helpers need the qif package
         self.dispatch(qif.JSON_SIGNAL, {'method': method, 'params': params})
 
     def set_state(self, state):
@@ -135,6 +137,20 @@ class HsmTester(QpTester):
         self.dispatch(qp.qep._QEP_EMPTY_SIG, None)
 
 
+def _event(sig, par):
+    """Return event with signal sig and parameter par, like qif.Event"""
+    e = qp.Event(sig)
+    e.par = par
+    return e
+
+
+def describe(sig, par=None):
+    """Return name of signal, followed by the parameter if any"""
+    if par is None:
+        return qp.signal_name(sig)
+    return "%s(%r)" % (qp.signal_name(sig), par)
+
+
 class Matcher(object):
     """Helper class for matching call arguments"""
     def __init__(self, compare, obj):
@@ -159,7 +175,7 @@ class QpUnitTest(unittest.TestCase, QpTester):
 
 class HsmUnitTest(unittest.TestCase, HsmTester):
     """Help class for writing unit tests for Hsm or Active objects.
-    The qp.QF.publish function is mocked and its usage can be asserted.
+    Calls of the qp.QF.publish function are recorded and can be asserted.
     """
 
     def setUp(self):
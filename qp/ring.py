@@ -0,0 +1,260 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Shared memory ring buffer transport for events between local processes
+
+An EventRing is a single producer, single consumer ring buffer of fixed
+size records in a memory mapped file, preferably on a tmpfs such as
+/dev/shm. Events are encoded into and decoded from the records in place
+with a qp.codec.Codec, so nothing is pickled or copied in between. Every
+signal posted must be registered in the codec of both ends.
+
+The producer and consumer each own one of two counters in the header, head
+and tail, kept on separate cache lines. The consumer wakes up through a
+named pipe, which the producer only writes to when the consumer has said
+that it is about to sleep. The consumer also wakes up every wait_s seconds,
+bounding the latency should a wakeup be missed.
+"""
+
+# Standard
+from __future__ import with_statement
+import errno
+import logging
+import mmap
+import os
+import select
+import struct
+import threading
+import time
+
+# Local
+import qp
+
+
+logger = logging.getLogger('qp.ring')
+
+# Counters are read with native formats, which are copied in one piece, and
+# written with slice assignment. pack_into clears the bytes before packing,
+# so the other process could see a zero counter
+HEAD = struct.Struct('Q')       # Written by producer, offset 0
+TAIL = struct.Struct('Q')       # Written by consumer, offset 64
+SLEEPING = struct.Struct('I')   # Written by consumer, offset 128
+CONFIG = struct.Struct('<II')   # Slots and record size, offset 136
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+SLEEPING_OFFSET = 128
+CONFIG_OFFSET = 136
+HEADER_SIZE = 192
+
+
+class RingFullError(Exception):
+    pass
+
+
+class EventRing(object):
+    """One end of a ring buffer in the file at path. The creating end, given
+    create=True, decides the number of slots and the record size, the
+    other end reads them from the file"""
+
+    wait_s = 0.01   # Longest sleep without a wakeup
+
+    def __init__(self, path, codec, slots=4096, record_size=64,
+                 create=False):
+        self.path = path
+        self._fifo_path = path + '.wakeup'
+        if create:
+            f = open(path, 'w+b')
+            f.truncate(HEADER_SIZE + slots * record_size)
+            f.seek(CONFIG_OFFSET)
+            f.write(CONFIG.pack(slots, record_size))
+            if os.path.exists(self._fifo_path):
+                os.remove(self._fifo_path)
+            os.mkfifo(self._fifo_path)
+        else:
+            f = open(path, 'r+b')
+            f.seek(CONFIG_OFFSET)
+            slots, record_size = CONFIG.unpack(f.read(CONFIG.size))
+        size = HEADER_SIZE + slots * record_size
+        try:
+            self._mem = mmap.mmap(f.fileno(), size)
+        finally:
+            f.close()
+        self._slots = slots
+        self._record_size = record_size
+        assert codec.max_size() <= record_size, 'Records too large for ring'
+        self._codec = codec
+        self._fifo = None
+
+    def close(self):
+        self._mem.close()
+        if self._fifo is not None:
+            os.close(self._fifo)
+            self._fifo = None
+
+    def unlink(self):
+        """Remove the files of the ring"""
+        os.remove(self.path)
+        os.remove(self._fifo_path)
+
+    def _store(self, layout, offset, value):
+        """Write counter in one piece"""
+        self._mem[offset:offset + layout.size] = layout.pack(value)
+
+    # Producer
+
+    def post(self, e, timeout=None):
+        """Write event to ring. Waits at most timeout seconds, forever if
+        None, for a free slot. Raises RingFullError on timeout"""
+        mem = self._mem
+        head, = HEAD.unpack_from(mem, HEAD_OFFSET)
+        if head - TAIL.unpack_from(mem, TAIL_OFFSET)[0] >= self._slots:
+            self._wait_for_slot(head, timeout)
+        offset = HEADER_SIZE + (head % self._slots) * self._record_size
+        self._codec.encode_into(mem, offset, e)
+        self._store(HEAD, HEAD_OFFSET, head + 1)  # Publish the record
+        if SLEEPING.unpack_from(mem, SLEEPING_OFFSET)[0]:
+            self._wake()
+
+    def _wait_for_slot(self, head, timeout):
+        if timeout is not None:
+            endtime = time.time() + timeout
+        delay = 0.00005
+        while head - TAIL.unpack_from(self._mem, TAIL_OFFSET)[0] >= \
+                self._slots:
+            if timeout is not None and time.time() >= endtime:
+                raise RingFullError()
+            time.sleep(delay)
+            delay = min(2 * delay, self.wait_s)
+
+    def _wake(self):
+        if self._fifo is None:
+            try:
+                self._fifo = os.open(self._fifo_path,
+                                     os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as exc:
+                if exc.errno == errno.ENXIO:  # No consumer yet
+                    return
+                raise
+        try:
+            os.write(self._fifo, b'\0')
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:  # Full pipe wakes up anyway
+                raise
+
+    # Consumer
+
+    def read(self, max_events=256, timeout=None):
+        """Return list of at most max_events events, waiting at most
+        timeout seconds, forever if None, for the first one"""
+        mem = self._mem
+        tail, = TAIL.unpack_from(mem, TAIL_OFFSET)
+        head, = HEAD.unpack_from(mem, HEAD_OFFSET)
+        if head == tail:
+            head = self._sleep(tail, timeout)
+        end = min(head, tail + max_events)
+        decode = self._codec.decode
+        events = [decode(mem, HEADER_SIZE + (n % self._slots) *
+                         self._record_size) for n in range(tail, end)]
+        self._store(TAIL, TAIL_OFFSET, end)  # Free the slots
+        return events
+
+    def _sleep(self, tail, timeout):
+        """Wait for producer, returns head"""
+        if self._fifo is None:
+            self._fifo = os.open(self._fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        if timeout is not None:
+            endtime = time.time() + timeout
+        mem = self._mem
+        while True:
+            self._store(SLEEPING, SLEEPING_OFFSET, 1)
+            head, = HEAD.unpack_from(mem, HEAD_OFFSET)
+            if head != tail:
+                break
+            wait_s = self.wait_s
+            if timeout is not None:
+                wait_s = min(wait_s, endtime - time.time())
+                if wait_s <= 0.0:
+                    break
+            if select.select([self._fifo], [], [], wait_s)[0]:
+                try:
+                    os.read(self._fifo, 4096)
+                except OSError as exc:
+                    if exc.errno != errno.EAGAIN:
+                        raise
+        self._store(SLEEPING, SLEEPING_OFFSET, 0)
+        return head
+
+
+class RingReader(threading.Thread):
+    """Thread moving events from ring into target, an Active object
+    (post_fifo_many) or a Framework (publish_many). A batch that overflows
+    a queue of the target is logged and counted in overflows, the records
+    have already been taken from the ring."""
+
+    def __init__(self, ring, target, batch=256):
+        threading.Thread.__init__(self, name='RingReader')
+        self.daemon = True
+        self._ring = ring
+        self._target = target
+        self._batch = batch
+        self._running = True
+        self.overflows = 0
+
+    def run(self):
+        if hasattr(self._target, 'publish_many'):
+            deliver = self._target.publish_many
+        else:
+            deliver = self._target.post_fifo_many
+        while self._running:
+            events = self._ring.read(self._batch, timeout=0.1)
+            if events:
+                try:
+                    deliver(events)
+                except qp.QueueOverflowError as exc:
+                    self.overflows += 1
+                    logger.warning('Ring events lost: %s' % exc)
+
+    def stop(self):
+        self._running = False
+        self.join()
@@ -0,0 +1,189 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Deterministic simulation of active objects in virtual time
+
+A Simulator is a Framework that runs all of its active objects in the
+calling thread. Objects are started with the simulator as both framework
+and pool:
+
+    sim = qp.sim.Simulator(seed=1)
+    table.start(1, 10, None, sim, sim)
+    sim.run(24 * 3600 * 1000 // qp.TICK)  # A day of virtual time
+
+After every event the ready object with the highest prio dispatches its
+next event. Once all queues are empty the virtual clock jumps straight to
+the next time event expiry, so waiting costs nothing. Time events armed in
+seconds expire at the first tick at or after their deadline. State handlers
+wanting randomness should use the random attribute of the simulator,
+seeded at construction, which makes runs reproducible.
+
+Exceptions raised by state handlers are not caught, they end the run.
+"""
+
+# Standard
+import heapq
+import math
+import random
+try:
+    import Queue
+except ImportError:  # Python 3
+    import queue as Queue
+
+# Local
+import qp
+
+
+class Simulator(qp.Framework):
+    """Framework and pool running active objects in virtual time"""
+
+    def __init__(self, name='Sim', seed=None):
+        qp.Framework.__init__(self, name)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self._ready = []  # Heap with (-prio, active)
+        self._dispatched = 0
+
+    def schedule(self, a):
+        """Make active object ready to run unless it already is"""
+        if not a._scheduled:
+            a._scheduled = True
+            heapq.heappush(self._ready, (-a._prio, a))
+
+    def clock(self):
+        """Return virtual time in seconds since start of simulation"""
+        return self._tick_ctr * qp.TICK_S
+
+    def step(self):
+        """Dispatch one event to the ready object with the highest prio.
+        Returns False if no object was ready"""
+        if not self._ready:
+            return False
+        _key, a = self._ready[0]
+        e = None
+        if a._running.is_set():
+            try:
+                e = a._queue.get_nowait()
+            except Queue.Empty:  # Scheduled for an event that was dropped
+                heapq.heappop(self._ready)
+                a._scheduled = False
+                return True
+        if e is None:  # Stopped or reached sentinel value
+            heapq.heappop(self._ready)
+            a._pool = None  # Never scheduled again
+            a._finish()
+            return True
+        if a._journal is not None:
+            a._journal.append(a._prio, e)
+        qp.Hsm.dispatch(a, e)
+        a._dispatches += 1
+        self._dispatched += 1
+        if not a._queue.qsize():
+            heapq.heappop(self._ready)
+            a._scheduled = False
+        return True
+
+    def run_until_idle(self):
+        """Dispatch events until all queues are empty. Returns number of
+        events dispatched"""
+        dispatched = self._dispatched
+        while self.step():
+            pass
+        return self._dispatched - dispatched
+
+    def run(self, ticks=None):
+        """Run for ticks of virtual time, or until nothing is left to do if
+        None. Returns number of events dispatched"""
+        self.start()
+        return self._run(ticks)
+
+    def _run(self, ticks=None):
+        """Run until stopped, see run"""
+        dispatched = self._dispatched
+        end = None
+        if ticks is not None:
+            end = self._tick_ctr + ticks
+        while self._running:
+            self.run_until_idle()
+            if self._expire_deadlines(self.clock()):
+                continue
+            wait = self._next_expiry()
+            if wait is None and end is None:
+                break
+            if end is not None and \
+                    (wait is None or self._tick_ctr + wait > end):
+                self.advance(end - self._tick_ctr)
+                break
+            self.advance(wait - 1)
+            self.tick()
+            self._expire_deadlines(self.clock())
+        self.run_until_idle()
+        return self._dispatched - dispatched
+
+    def advance(self, ticks):
+        """Move the virtual clock ticks forward without expiring any time
+        event"""
+        wait = self._next_expiry()
+        assert wait is None or wait > ticks, 'Time event would expire'
+        self._tick_ctr += ticks
+
+    def _next_expiry(self):
+        """Return ticks until the next time event expires, None if none"""
+        waits = []
+        timers = self._timers
+        while timers and timers[0][2] is None:  # Drop disarmed entries
+            heapq.heappop(timers)
+            self._cancelled_timers -= 1
+        if timers:
+            waits.append(timers[0][0] - self._tick_ctr)
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][2] is None:
+            heapq.heappop(deadlines)
+            self._cancelled_deadlines -= 1
+        if deadlines:
+            waits.append(max(1, int(math.ceil(
+                (deadlines[0][0] - self.clock()) / qp.TICK_S - 1e-9))))
+        if not waits:
+            return None
+        return min(waits)
@@ -0,0 +1,146 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Watchdog for run-to-completion steps exceeding a time budget
+
+Active objects note the start time and the event of each dispatch in plain
+attributes, without locking. A Watchdog thread samples them every period_s
+seconds and reports each dispatch that has been running for more than
+budget_s seconds, once, with the name of the object, its current state
+handler, the signal and its registered name and the stack of the
+dispatching thread.
+
+Incidents are logged as warnings on the qp.watchdog logger, counted in the
+slow_dispatches metric of the object and kept in the incidents attribute,
+newest last. A callback given as on_incident is called with each incident
+dict from the watchdog thread.
+
+Dispatch start times are taken with time.time(), which is cheaper than the
+monotonic clock on Python 2. A step of the wall clock may therefore cause
+a false or missed incident.
+"""
+
+# Standard
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+# Local
+import qp
+
+
+logger = logging.getLogger('qp.watchdog')
+
+
+class Watchdog(object):
+    """Watches the active objects of framework qf, default qp.QF"""
+
+    def __init__(self, qf=None, budget_s=0.1, period_s=None, keep=100,
+                 on_incident=None):
+        self._qf = qf or qp.QF
+        self.budget_s = budget_s
+        self.period_s = period_s or budget_s / 2.0
+        self.incidents = collections.deque(maxlen=keep)
+        self._on_incident = on_incident
+        self._reported = {}  # prio: start of last reported dispatch
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a daemon thread"""
+        self._thread = threading.Thread(target=self._sample, name='Watchdog')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.is_set():
+            self.check()
+            self._stopped.wait(self.period_s)
+
+    def check(self, now=None):
+        """Check all objects once. Returns list of new incidents"""
+        if now is None:
+            now = time.time()
+        found = []
+        for p, a in self._qf._actives():
+            start = a._dispatch_start
+            e = a._dispatch_event
+            if start is None or now - start <= self.budget_s or \
+                    self._reported.get(p) == start:
+                continue
+            if a._dispatch_start != start:  # Finished while sampling
+                continue
+            self._reported[p] = start
+            a._slow_dispatches += 1
+            incident = {
+                'name': a._name(),
+                'prio': p,
+                'state': getattr(a._state, '__name__', repr(a._state)),
+                'sig': e.sig,
+                'signal': qp.signal_name(e.sig),
+                'elapsed_s': now - start,
+                'stack': self._stack(a._dispatch_thread),
+            }
+            found.append(incident)
+            self.incidents.append(incident)
+            logger.warning('%(name)s[%(prio)d] in %(state)s has been '
+                           'dispatching %(signal)s for %(elapsed_s).3f s'
+                           '\n%(stack)s' % incident)
+            if self._on_incident is not None:
+                self._on_incident(incident)
+        return found
+
+    def _stack(self, ident):
+        frame = sys._current_frames().get(ident)
+        if frame is None:
+            return ''
+        return ''.join(traceback.format_stack(frame))
@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+"""Test benchmark result handling"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import unittest
+
+# Local
+import qp.bench
+
+
+class TestPercentiles(unittest.TestCase):
+
+    def test_that_percentiles_are_picked_from_sorted_durations(self):
+        # Given durations of 1..100 us in any order
+        durations = [n * 1e-6 for n in range(100, 0, -1)]
+        # When taking percentiles
+        result = qp.bench.percentiles('post', durations)
+        # Then they are named after the prefix, in us
+        self.assertEqual(sorted(result), ['post_max_us', 'post_p50_us',
+                                          'post_p90_us', 'post_p99_us'])
+        self.assertAlmostEqual(result['post_p50_us'], 50.0)
+        self.assertAlmostEqual(result['post_p99_us'], 99.0)
+        self.assertAlmostEqual(result['post_max_us'], 100.0)
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_that_slower_timings_are_regressions(self):
+        # Given a baseline and a result with one rate and one duration worse
+        baseline = {'name': 'b', 'events': 10, 'events_per_s': 100.0,
+                    'post_us': 2.0, 'get_us': 2.0}
+        result = {'name': 'b', 'events': 20, 'events_per_s': 50.0,
+                  'post_us': 4.0, 'get_us': 1.0}
+        # When compared
+        change = qp.bench.compare(result, baseline)
+        # Then changes are positive when faster, counts are ignored
+        self.assertEqual(change['changes'], {'events_per_s': -0.5,
+                                             'post_us': -0.5,
+                                             'get_us': 1.0})
+        self.assertEqual(change['regressions'], ['events_per_s', 'post_us'])
+
+    def test_that_changes_within_threshold_are_not_regressions(self):
+        # Given a slightly slower result
+        baseline = {'name': 'b', 'post_us': 2.0}
+        result = {'name': 'b', 'post_us': 2.1}
+        # When compared with a 10 percent threshold
+        change = qp.bench.compare(result, baseline, 0.1)
+        # Then it is not a regression
+        self.assertEqual(change['regressions'], [])
+
+    def test_that_missing_timings_are_skipped(self):
+        # Given a result with a timing not in the baseline
+        change = qp.bench.compare({'name': 'b', 'new_us': 1.0},
+                                  {'name': 'b'})
+        # Then it is not compared
+        self.assertEqual(change['changes'], {})
+
+    def test_that_outliers_and_noise_are_not_regressions(self):
+        # Given a result with worse maximum, p99 and sub-us durations
+        baseline = {'name': 'b', 'post_max_us': 10.0, 'post_p99_us': 5.0,
+                    'tick_p50_us': 0.5}
+        result = {'name': 'b', 'post_max_us': 100.0, 'post_p99_us': 50.0,
+                  'tick_p50_us': 1.0}
+        # When compared
+        change = qp.bench.compare(result, baseline)
+        # Then outliers are not compared and noise is no regression
+        self.assertEqual(change['changes'], {'tick_p50_us': -0.5})
+        self.assertEqual(change['regressions'], [])
+
+
+class TestBest(unittest.TestCase):
+
+    def test_that_best_of_each_timing_is_kept(self):
+        runs = [{'name': 'b', 'events': 1, 'events_per_s': 10.0,
+                 'post_us': 2.0},
+                {'name': 'b', 'events': 2, 'events_per_s': 20.0,
+                 'post_us': 3.0}]
+        self.assertEqual(qp.bench.best(runs), {
+            'name': 'b', 'events': 1, 'events_per_s': 20.0, 'post_us': 2.0})
@@ -0,0 +1,221 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test bridging events between frameworks"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+# Local
+import qp
+import qp.bridge
+import qp.codec
+
+DATA_SIG = qp.USER_SIG
+OTHER_SIG = qp.USER_SIG + 1
+
+
+class Collector(qp.Active):
+    """Active object collecting events until expected count is reached"""
+
+    signals = [DATA_SIG]
+
+    def __init__(self, expected):
+        qp.Active.__init__(self, Collector.initial)
+        self.expected = expected
+        self.events = []
+        self.done = threading.Event()
+
+    def initial(self, e):
+        self.INIT(Collector.collecting)
+
+    def collecting(self, e):
+        if e.sig == DATA_SIG:
+            self.events.append(e)
+            if len(self.events) == self.expected:
+                self.done.set()
+            return 0
+        return qp.Hsm.top
+
+
+class TestBridge(unittest.TestCase):
+
+    def setUp(self):
+        self.local = qp.Framework('local')
+        self.remote = qp.Framework('remote')
+
+    def start_sender(self, address, **kwargs):
+        sender = qp.bridge.BridgeSender(address, [DATA_SIG], **kwargs)
+        sender.start(1, 100, None, self.local)
+        self.addCleanup(sender._thread.join)
+        self.addCleanup(sender.stop)
+        return sender
+
+    def forward(self, address, encode=None,
+                decode=qp.bridge.pickle_decode):
+        server = qp.bridge.BridgeServer(address, self.remote, decode, 4)
+        self.addCleanup(server.close)
+        collector = Collector(10)
+        collector.start(1, 100, None, self.remote)
+        self.addCleanup(collector.stop)
+        self.start_sender(server.address, encode=encode)
+        for n in range(10):
+            e = qp.Event(DATA_SIG)
+            e.n = n
+            self.local.publish(e)
+            self.local.publish(qp.Event(OTHER_SIG))
+        collector.done.wait(10.0)
+        self.assertEqual([e.n for e in collector.events], list(range(10)))
+
+    def test_that_events_are_forwarded_over_tcp(self):
+        self.forward(('127.0.0.1', 0))
+
+    def test_that_events_are_forwarded_over_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'bridge')
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        self.forward(path)
+
+    def test_that_events_are_forwarded_with_codec(self):
+        codec = qp.codec.Codec()
+        codec.register(DATA_SIG, qp.Event, [('n', 'i')])
+        self.forward(('127.0.0.1', 0), codec.encode, codec.decode)
+
+    def test_that_server_requires_decode(self):
+        self.assertRaises(ValueError, qp.bridge.BridgeServer,
+                          ('127.0.0.1', 0), self.remote)
+
+    def test_that_sender_waits_for_credits(self):
+        # Given a peer granting two credits
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        self.start_sender(listener.getsockname())
+        peer, _address = listener.accept()
+        self.addCleanup(peer.close)
+        peer.settimeout(10.0)
+        qp.bridge.write_frame(peer, qp.bridge.CREDIT,
+                              qp.bridge.LENGTH.pack(2))
+        # When publishing five events
+        for _n in range(5):
+            self.local.publish(qp.Event(DATA_SIG))
+        # Then only two are sent until more credits are granted
+        count = 0
+        while count < 2:
+            kind, payload = qp.bridge.read_frame(peer)
+            count += len(qp.bridge.unpack_records(payload))
+        self.assertEqual(count, 2)
+        peer.settimeout(0.05)
+        self.assertRaises(socket.timeout, peer.recv, 1)
+        peer.settimeout(10.0)
+        qp.bridge.write_frame(peer, qp.bridge.CREDIT,
+                              qp.bridge.LENGTH.pack(10))
+        while count < 5:
+            kind, payload = qp.bridge.read_frame(peer)
+            count += len(qp.bridge.unpack_records(payload))
+        self.assertEqual(count, 5)
+
+    def run_local(self):
+        thread = self.local.run_in_thread()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.local.stop)
+
+    def test_that_sender_reconnects_without_more_events(self):
+        # Given a running sender with events pending and no peer
+        self.run_local()
+        path = os.path.join(tempfile.mkdtemp(), 'bridge')
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        sender = qp.bridge.BridgeSender(path, [DATA_SIG])
+        sender.retry_s = 0.01
+        sender.start(1, 100, None, self.local)
+        self.addCleanup(sender._thread.join)
+        self.addCleanup(sender.stop)
+        for _n in range(3):
+            self.local.publish(qp.Event(DATA_SIG))
+        # When the peer comes up
+        server = qp.bridge.BridgeServer(path, self.remote,
+                                        qp.bridge.pickle_decode)
+        self.addCleanup(server.close)
+        collector = Collector(3)
+        collector.start(1, 100, None, self.remote)
+        self.addCleanup(collector.stop)
+        # Then the pending events are sent
+        collector.done.wait(10.0)
+        self.assertEqual(len(collector.events), 3)
+
+    def test_that_credits_are_kept_when_their_event_overflows(self):
+        # Given a running sender that cannot take credit events
+        self.run_local()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+        sender = self.start_sender(listener.getsockname())
+        sender.retry_s = 0.01
+
+        def post_fifo(e, lane=None):
+            if e.sig == qp.bridge.CREDIT_SIG:
+                raise qp.QueueOverflowError()
+            qp.Active.post_fifo(sender, e, lane)
+        sender.post_fifo = post_fifo
+        peer, _address = listener.accept()
+        self.addCleanup(peer.close)
+        peer.settimeout(10.0)
+        for _n in range(3):
+            self.local.publish(qp.Event(DATA_SIG))
+        # When credits are granted
+        qp.bridge.write_frame(peer, qp.bridge.CREDIT,
+                              qp.bridge.LENGTH.pack(10))
+        # Then the events are sent anyway
+        count = 0
+        while count < 3:
+            kind, payload = qp.bridge.read_frame(peer)
+            count += len(qp.bridge.unpack_records(payload))
+        self.assertEqual(sender.credit_overflows, 1)
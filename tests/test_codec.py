@@ -0,0 +1,114 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test binary event codec"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import unittest
+
+# Local
+import qp
+import qp.codec
+
+READING_SIG = qp.USER_SIG
+LABEL_SIG = qp.USER_SIG + 1
+TICK_SIG = qp.USER_SIG + 2
+
+
+class Reading(qp.Event):
+
+    fields = [('sensor', 'H'), ('value', 'd')]
+
+    def __init__(self, sensor, value):
+        qp.Event.__init__(self, READING_SIG)
+        self.sensor = sensor
+        self.value = value
+
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = qp.codec.Codec()
+        self.codec.register(READING_SIG, Reading)
+        self.codec.register(LABEL_SIG, qp.Event, [('label', '8s')])
+        self.codec.register(TICK_SIG, qp.Event)
+
+    def test_that_fields_are_encoded_compactly(self):
+        data = self.codec.encode(Reading(7, 2.5))
+        self.assertEqual(len(data), 4 + 2 + 8)
+        self.assertEqual(self.codec.size(READING_SIG), 14)
+        self.assertEqual(self.codec.max_size(), 14)
+        e = self.codec.decode(data)
+        self.assertTrue(isinstance(e, Reading))
+        self.assertEqual((e.sig, e.sensor, e.value), (READING_SIG, 7, 2.5))
+
+    def test_that_fields_can_be_given_at_registration(self):
+        e = qp.Event(LABEL_SIG)
+        e.label = b'pump'
+        decoded = self.codec.decode(self.codec.encode(e))
+        self.assertEqual(decoded.label, b'pump\0\0\0\0')
+        self.assertEqual(self.codec.decode(
+            self.codec.encode(qp.Event(TICK_SIG))).sig, TICK_SIG)
+
+    def test_that_records_are_decoded_in_bulk_from_buffer(self):
+        buf = bytearray(64)
+        offset = self.codec.encode_into(buf, 0, Reading(1, 0.5))
+        offset += self.codec.encode_into(buf, offset, qp.Event(TICK_SIG))
+        offset += self.codec.encode_into(buf, offset, Reading(2, 1.5))
+        events = self.codec.decode_many(memoryview(buf), 0, offset)
+        self.assertEqual([e.sig for e in events],
+                         [READING_SIG, TICK_SIG, READING_SIG])
+        self.assertEqual([events[0].sensor, events[2].value], [1, 1.5])
+
+    def test_that_unknown_signal_raises(self):
+        self.assertRaises(qp.codec.UnknownSignalError, self.codec.encode,
+                          qp.Event(qp.USER_SIG + 10))
+        self.assertRaises(qp.codec.UnknownSignalError, self.codec.decode,
+                          qp.codec.SIG.pack(qp.USER_SIG + 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test event journal and replay"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+# External
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+# Local
+import qp
+import qp.codec
+import qp.journal
+
+ADD_SIG = qp.USER_SIG
+TOTAL_SIG = qp.USER_SIG + 1
+TIMEOUT_SIG = qp.USER_SIG + 2
+
+
+class AddEvt(qp.Event):
+
+    fields = [('amount', 'i')]
+
+    def __init__(self, amount):
+        qp.Event.__init__(self, ADD_SIG)
+        self.amount = amount
+
+
+class Counter(qp.Active):
+    """Sums amounts, publishes the total and arms a timer for each event"""
+
+    signals = [ADD_SIG]
+
+    def __init__(self, expected):
+        qp.Active.__init__(self, Counter.initial)
+        self.expected = expected
+        self.total = 0
+        self.count = 0
+        self.amounts = []
+        self.on_add = None  # Called on each event
+        self.done = threading.Event()
+
+    def initial(self, e):
+        self.timer = qp.TimeEvt(TIMEOUT_SIG)
+        self.INIT(Counter.counting)
+
+    def counting(self, e):
+        if e.sig == ADD_SIG:
+            self.total += e.amount
+            self.count += 1
+            self.amounts.append(e.amount)
+            if self.on_add is not None:
+                self.on_add()
+            self.publish(qp.Event(TOTAL_SIG))
+            self.timer.disarm()
+            self.timer.post_in(self, 10)
+            if self.count == self.expected:
+                self.done.set()
+            return 0
+        return qp.Hsm.top
+
+
+class Listener(qp.Active):
+
+    signals = [TOTAL_SIG]
+
+    def __init__(self):
+        qp.Active.__init__(self, Listener.initial)
+        self.totals = 0
+
+    def initial(self, e):
+        self.INIT(Listener.listening)
+
+    def listening(self, e):
+        if e.sig == TOTAL_SIG:
+            self.totals += 1
+            return 0
+        return qp.Hsm.top
+
+
+CODEC = qp.codec.Codec()
+CODEC.register(ADD_SIG, AddEvt)
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_counter(self, amounts, **kwargs):
+        """Journal amounts added to a counter"""
+        qf = qp.Framework()
+        journal = qp.journal.Journal(self.directory, CODEC, **kwargs)
+        counter = Counter(len(amounts))
+        counter.start(1, 100, None, qf)
+        journal.attach(counter)
+        for amount in amounts:
+            qf.publish(AddEvt(amount))
+        counter.done.wait(10.0)
+        counter.stop()
+        counter._thread.join()
+        journal.close()
+        return counter
+
+    def start_replay(self):
+        qf = qp.Framework()
+        counter = Counter(None)
+        counter.start(1, 100, None, qf)
+        self.addCleanup(counter.stop)
+        listener = Listener()
+        listener.start(2, 100, None, qf)
+        self.addCleanup(listener.stop)
+        journal = qp.journal.Journal(self.directory, CODEC)
+        self.addCleanup(journal.close)
+        journal.attach(counter)
+        return qf, counter, listener, journal
+
+    def test_that_replay_rebuilds_state(self):
+        # Given a counter that journaled its events before it went away
+        self.run_counter(range(100))
+        # When a new counter is started and the journal is replayed
+        qf, counter, listener, journal = self.start_replay()
+        dispatched = journal.replay(qf)
+        # Then the state is rebuilt without publishing or arming timers
+        self.assertEqual(dispatched, 100)
+        self.assertEqual(counter.count, 100)
+        self.assertEqual(counter.total, sum(range(100)))
+        self.assertEqual(qf.get_metrics()['armed_timers'], 0)
+        qf.publish(qp.Event(TOTAL_SIG))
+        listener.stop(drain=True)
+        listener._thread.join()
+        self.assertEqual(listener.totals, 1)
+
+    def test_that_segments_are_rolled_and_replayed_in_order(self):
+        # Given records spread over segments of at most about 16 bytes
+        self.run_counter([1, 2, 3, 4, 5], segment_size=16)
+        self.run_counter([6], segment_size=16)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+        # When replaying
+        qf, counter, listener, journal = self.start_replay()
+        journal.replay(qf)
+        # Then all events are dispatched
+        self.assertEqual((counter.count, counter.total), (6, 21))
+        self.assertEqual(journal.replay(qf), 6)
+
+    def test_that_events_posted_during_replay_are_dispatched_after(self):
+        # Given a journal of ten events
+        self.run_counter(range(10))
+        qf, counter, listener, journal = self.start_replay()
+        counter.expected = 11
+
+        def post_live():
+            counter.on_add = None
+            poster = threading.Thread(target=counter.post_fifo,
+                                      args=(AddEvt(100),))
+            poster.start()
+            poster.join()
+        # When another thread posts to the counter during replay
+        counter.on_add = post_live
+        self.assertEqual(journal.replay(qf), 10)
+        # Then the event is dispatched once replay is done
+        counter.done.wait(10.0)
+        self.assertEqual(counter.amounts, list(range(10)) + [100])
+
+    def test_that_events_that_cannot_be_journaled_are_dropped(self):
+        # Given an attached counter
+        qf, counter, listener, journal = self.start_replay()
+        counter.expected = 1
+        # When posting an event with a signal missing in the codec
+        with mock.patch.object(qp.qf.logger, 'exception') as exception:
+            counter.post_fifo(qp.Event(TIMEOUT_SIG))
+            counter.post_fifo(AddEvt(5))
+            counter.done.wait(10.0)
+        # Then it is logged and dropped, the next event is dispatched
+        self.assertEqual(exception.call_count, 1)
+        self.assertEqual(counter.amounts, [5])
+
+    def test_that_sync_after_clear_does_nothing(self):
+        # Given a journal with unsynced records
+        journal = qp.journal.Journal(self.directory, CODEC, sync_s=None)
+        self.addCleanup(journal.close)
+        journal.append(1, AddEvt(1))
+        # When cleared and synced
+        journal.clear()
+        journal.sync()
+        # Then there is nothing left
+        self.assertEqual(journal.segments(), [])
+
+    def test_that_record_cut_short_ends_replay(self):
+        self.run_counter([1, 2, 3], sync_s=None)
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        f = open(path, 'r+b')
+        f.truncate(os.path.getsize(path) - 1)
+        f.close()
+        qf, counter, listener, journal = self.start_replay()
+        self.assertEqual(journal.replay(qf), 2)
+        self.assertEqual(counter.total, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
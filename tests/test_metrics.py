@@ -0,0 +1,143 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test metrics export"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import os
+import tempfile
+import unittest
+try:
+    from urllib2 import urlopen
+except ImportError:  # Python 3
+    from urllib.request import urlopen
+
+# External
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+# Local
+import qp
+import qp.metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.qf = qp.Framework('test')
+        a = qp.Active(None)
+        a._queue = qp.QEQueue(10)  # Mock necessary items
+        a._thread = mock.Mock()
+        a._thread.name = 'Sensor'
+        a._prio = 3
+        a._qf = self.qf
+        self.qf.add(a)
+        self.active = a
+
+    def test_that_counters_follow_posts_and_dispatches(self):
+        # Given two posted events of which one is taken from the queue
+        self.active.post_fifo(qp.Event(qp.USER_SIG))
+        self.active.post_fifo(qp.Event(qp.USER_SIG))
+        self.active._queue.get()
+        self.active._dispatches += 1
+        # When reading metrics
+        stats, = self.qf.get_metrics()['actives']
+        # Then they show depth, posts, dispatches and a growing wait time
+        self.assertEqual((stats['depth'], stats['posts'], stats['dispatches']),
+                         (1, 2, 1))
+        self.assertTrue(stats['wait_s'] >= 0.0)
+        self.assertEqual(stats['name'], 'Sensor')
+
+    def test_that_text_format_has_labelled_samples(self):
+        self.active.post_fifo(qp.Event(qp.USER_SIG))
+        text = qp.metrics.prometheus_text(self.qf)
+        self.assertTrue('# TYPE qp_posts_total counter\n' in text)
+        self.assertTrue('qp_posts_total{active="Sensor",framework="test",'
+                        'prio="3"} 1\n' in text)
+        self.assertTrue('qp_overflows_total{active="Sensor",framework="test",'
+                        'kind="dropped",prio="3"} 0\n' in text)
+        self.assertTrue('qp_timers_armed{framework="test"} 0\n' in text)
+
+    def test_that_lanes_have_labelled_samples(self):
+        # Given an active object with one urgent lane holding an event
+        self.active._queue = qp.LaneQueue(10, [2])
+        self.active._queue.post_lane(qp.Event(qp.USER_SIG), 1)
+        # When exporting metrics
+        text = qp.metrics.prometheus_text(self.qf)
+        # Then each lane has its own samples
+        self.assertTrue('qp_lane_depth{active="Sensor",framework="test",'
+                        'lane="0",prio="3"} 0\n' in text)
+        self.assertTrue('qp_lane_depth{active="Sensor",framework="test",'
+                        'lane="1",prio="3"} 1\n' in text)
+        self.assertTrue('qp_lane_capacity{active="Sensor",framework="test",'
+                        'lane="1",prio="3"} 2\n' in text)
+
+    def test_that_label_values_are_escaped(self):
+        self.active._thread.name = 'A "b"\\c\nd'
+        text = qp.metrics.prometheus_text(self.qf)
+        self.assertTrue('active="A \\"b\\"\\\\c\\nd"' in text)
+
+    def test_that_metrics_are_written_to_file(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            qp.metrics.write_prometheus(path, self.qf)
+            self.assertEqual(open(path).read(),
+                             qp.metrics.prometheus_text(self.qf))
+        finally:
+            os.remove(path)
+
+    def test_that_metrics_are_served_over_http(self):
+        server = qp.metrics.serve_prometheus(0, framework=self.qf)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            text = urlopen(url).read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue('qp_queue_depth{' in text)
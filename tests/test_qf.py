@@ -45,12 +45,19 @@
 """Test framework aspects"""
 
 # Standard
+from __future__ import with_statement
 import sys
 sys.path.insert(0, '..')
+import os
+import threading
+import time
 import unittest
 
 # External
-import mock
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
 
 # Local
 import qp
@@ -68,6 +75,92 @@ class TestClass(qp.Active):
         return qp.Hsm.top
 
 
+class Recorder(qp.Active):
+    """Active object recording dispatched signals"""
+
+    def __init__(self, log, gate=None):
+        qp.Active.__init__(self, Recorder.initial)
+        self.log = log
+        self.gate = gate
+        self.busy = False
+        self.overlapped = False
+
+    def initial(self, e):
+        self.INIT(Recorder.main)
+
+    def main(self, e):
+        if e.sig >= qp.USER_SIG:
+            self.overlapped = self.overlapped or self.busy
+            self.busy = True
+            if self.gate is not None:
+                self.gate.wait()
+            time.sleep(0.0001)  # Let other workers run
+            self.log.append((self._prio, e.sig))
+            self.busy = False
+            return 0
+        return qp.Hsm.top
+
+
+class SelfStarter(Recorder):
+    """Recorder posting to itself in its initial transition"""
+
+    def __init__(self, log):
+        Recorder.__init__(self, log)
+        qp.Hsm.__init__(self, SelfStarter.initial)
+
+    def initial(self, e):
+        self.post_fifo(qp.Event(qp.USER_SIG))
+        self.INIT(Recorder.main)
+
+
+class Failer(Recorder):
+    """Recorder raising ValueError on FAIL_SIG"""
+
+    FAIL_SIG = qp.USER_SIG + 9
+
+    def __init__(self, log):
+        Recorder.__init__(self, log)
+        qp.Hsm.__init__(self, Failer.initial)
+
+    def initial(self, e):
+        self.INIT(Failer.failing)
+
+    def failing(self, e):
+        if e.sig == Failer.FAIL_SIG:
+            raise ValueError('Failing on purpose')
+        return Recorder.main(self, e)
+
+
+class LoggingFailer(Failer):
+    """Failer logging handler exceptions"""
+
+    log_exceptions = True
+
+
+class FrameworkTestCase(unittest.TestCase):
+    """Test case with its own framework and a log of dispatched signals"""
+
+    def setUp(self):
+        self.qf = qp.Framework()
+        self.log = []
+
+    def start_recorder(self):
+        """Start a Recorder at prio 1, stopped by shutdown at cleanup"""
+        self.recorder = Recorder(self.log)
+        self.recorder.start(1, 10, None, self.qf)
+        self.addCleanup(self.qf.shutdown, False, 10.0)
+
+    def run_in_thread(self):
+        thread = self.qf.run_in_thread()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.qf.stop)
+
+    def wait_for_log(self, length, timeout=10.0):
+        timeout += time.time()
+        while len(self.log) < length and time.time() < timeout:
+            time.sleep(0.001)
+
+
 class TestActive(unittest.TestCase):
 
     def test_that_overflow_raises_exception(self):
@@ -76,7 +169,845 @@ class TestActive(unittest.TestCase):
         a._queue = qp.QEQueue(1)  # Mock necessary items
         a._thread = mock.Mock()
         a._prio = 1
+        a._qf = qp.Framework()
         # When posting to that queue twice
         # Then
         a.post_fifo(1)  # This is ok, but now the queue is full
         self.assertRaises(qp.QueueOverflowError, a.post_fifo, 1)  # This raises
+
+    def test_that_bulk_overflow_posts_nothing(self):
+        # Given an active object with room for two events
+        a = TestClass()
+        a._queue = qp.QEQueue(2)  # Mock necessary items
+        a._thread = mock.Mock()
+        a._prio = 1
+        a._qf = qp.Framework()
+        # When posting three events at once
+        # Then it raises and the queue is left untouched
+        self.assertRaises(qp.QueueOverflowError, a.post_fifo_many, [1, 2, 3])
+        self.assertEqual(a._queue.qsize(), 0)
+
+
+class TestOverflow(unittest.TestCase):
+
+    def full_queue(self, overflow, **kwargs):
+        q = qp.QEQueue(2, overflow, **kwargs)
+        q.post_fifo(qp.Event(qp.USER_SIG))
+        q.post_fifo(qp.Event(qp.USER_SIG + 1))
+        return q
+
+    def sigs(self, q):
+        return [e.sig for e in q.queue]
+
+    def test_that_drop_oldest_keeps_newest_events(self):
+        q = self.full_queue(qp.OVERFLOW_DROP_OLDEST)
+        self.assertTrue(q.post_fifo(qp.Event(qp.USER_SIG + 2)))
+        self.assertEqual(self.sigs(q), [qp.USER_SIG + 1, qp.USER_SIG + 2])
+        self.assertEqual(q.get_overflow_counts()['dropped'], 1)
+
+    def test_that_drop_newest_keeps_queued_events(self):
+        q = self.full_queue(qp.OVERFLOW_DROP_NEWEST)
+        self.assertFalse(q.post_fifo(qp.Event(qp.USER_SIG + 2)))
+        self.assertEqual(self.sigs(q), [qp.USER_SIG, qp.USER_SIG + 1])
+        self.assertEqual(q.get_overflow_counts()['dropped'], 1)
+
+    def test_that_coalesce_replaces_event_with_same_key(self):
+        q = self.full_queue(qp.OVERFLOW_COALESCE, key=lambda e: e.sig)
+        e = qp.Event(qp.USER_SIG)
+        self.assertTrue(q.post_fifo(e))
+        self.assertTrue(q.queue[0] is e)
+        self.assertEqual(q.get_overflow_counts()['coalesced'], 1)
+
+    def test_that_block_drops_event_on_timeout(self):
+        q = self.full_queue(qp.OVERFLOW_BLOCK, timeout=0.01)
+        self.assertFalse(q.post_fifo(qp.Event(qp.USER_SIG + 2)))
+        counts = q.get_overflow_counts()
+        self.assertEqual((counts['blocked'], counts['dropped']), (1, 1))
+
+    def test_that_block_waits_for_consumer(self):
+        q = self.full_queue(qp.OVERFLOW_BLOCK, timeout=10.0)
+        consumer = threading.Timer(0.01, q.get)
+        consumer.start()
+        self.assertTrue(q.post_fifo(qp.Event(qp.USER_SIG + 2)))
+        consumer.join()
+        self.assertEqual(self.sigs(q), [qp.USER_SIG + 1, qp.USER_SIG + 2])
+
+
+class Reading(qp.Event):
+
+    def __init__(self, sensor, value):
+        qp.Event.__init__(self, qp.USER_SIG)
+        self.sensor = sensor
+        self.value = value
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def setUp(self):
+        coalesce = {qp.USER_SIG: lambda e: e.sensor}
+        self.q = qp.QEQueue(10, coalesce=coalesce)
+
+    def test_that_event_replaces_queued_event_in_place(self):
+        # Given readings from two sensors and another event in between
+        self.q.post_fifo(Reading(1, 'a'))
+        self.q.post_fifo(qp.Event(qp.USER_SIG + 1))
+        self.q.post_fifo(Reading(2, 'b'))
+        # When a new reading from the first sensor arrives
+        self.q.post_fifo(Reading(1, 'c'))
+        # Then it takes the position of the old reading
+        self.assertEqual(self.q.qsize(), 3)
+        self.assertEqual(self.q.get().value, 'c')
+        self.assertEqual(self.q.get().sig, qp.USER_SIG + 1)
+        self.assertEqual(self.q.get().value, 'b')
+        self.assertEqual(self.q.get_overflow_counts()['coalesced'], 1)
+
+    def test_that_dispatched_event_is_not_replaced(self):
+        # Given a reading that has been taken from the queue
+        self.q.post_fifo(Reading(1, 'a'))
+        self.q.get()
+        # When a new reading from the same sensor arrives
+        self.q.post_fifo(Reading(1, 'b'))
+        # Then it is queued as a new event
+        self.assertEqual(self.q.qsize(), 1)
+        self.assertEqual(self.q.get().value, 'b')
+
+    def test_that_bulk_post_coalesces(self):
+        self.q.post_fifo_many([Reading(1, 'a'), Reading(1, 'b')])
+        self.assertEqual(self.q.qsize(), 1)
+        self.assertEqual(self.q.get().value, 'b')
+
+
+class TestPublish(unittest.TestCase):
+
+    def setUp(self):
+        self.qf = qp.Framework()
+        self.holders = []
+
+    def tearDown(self):
+        for release, holder in self.holders:
+            release.set()
+            holder.join()
+
+    def add_active(self, prio, qf=None):
+        a = TestClass()
+        a._queue = qp.QEQueue(10)  # Mock necessary items
+        a._thread = mock.Mock()
+        a._prio = prio
+        a._qf = qf or self.qf
+        a._qf.add(a)
+        return a
+
+    def test_that_subscribers_are_swapped_as_sorted_tuples(self):
+        # Given two subscribers to a signal
+        a2 = self.add_active(2)
+        a1 = self.add_active(1)
+        a2.subscribe(qp.USER_SIG)
+        snapshot = self.qf._subscribers[qp.USER_SIG]
+        # When another active subscribes
+        a1.subscribe(qp.USER_SIG)
+        # Then a new sorted tuple replaces the old one
+        self.assertEqual(self.qf._subscribers[qp.USER_SIG], (1, 2))
+        self.assertEqual(snapshot, (2,))
+
+    def test_that_thousands_of_actives_can_subscribe(self):
+        # Given more active objects than QP allows, added in any order
+        prios = list(range(1, 2001))
+        prios.reverse()
+        actives = [self.add_active(p) for p in prios]
+        # When they subscribe to the same signal
+        for a in actives:
+            a.subscribe(qp.USER_SIG)
+        # Then subscribers are ordered on priority
+        self.assertEqual(self.qf._subscribers[qp.USER_SIG],
+                         tuple(range(1, 2001)))
+
+    def test_that_subscriber_lists_grow_for_high_signals(self):
+        # Given a subscriber to a signal beyond the preallocated entries
+        a1 = self.add_active(1)
+        a2 = self.add_active(2)
+        sig = qp.SIGNAL_SLOTS + 10
+        a1.subscribe(sig)
+        a2.subscribe(sig)
+        a2.subscribe(qp.USER_SIG)
+        # When publishing it and a signal nobody has subscribed to
+        self.qf.publish(qp.Event(sig))
+        self.qf.publish(qp.Event(10 * qp.SIGNAL_SLOTS))
+        # Then only the subscribers get the event, and unsubscribe_all
+        # clears the bits of the prio
+        self.assertEqual((a1._queue.qsize(), a2._queue.qsize()), (1, 1))
+        self.assertEqual(self.qf._subscriber_masks[sig], 6)
+        a2.unsubscribe_all()
+        self.assertEqual(self.qf._subscribers[sig], (1,))
+        self.assertEqual(self.qf._subscriber_masks[sig], 2)
+        self.assertEqual(self.qf._subscriber_masks[qp.USER_SIG], 0)
+
+    def test_that_signals_out_of_range_are_rejected(self):
+        # Given a subscriber to the last signal slot
+        a1 = self.add_active(1)
+        a1.subscribe(len(self.qf._subscribers) - 1)
+        # When subscribing or publishing out of range, then ValueError is
+        # raised and nothing is delivered or allocated
+        for sig in [-1, qp.SIGNAL_LIMIT]:
+            self.assertRaises(ValueError, a1.subscribe, sig)
+        self.assertRaises(ValueError, self.qf.publish, qp.Event(-1))
+        self.assertRaises(ValueError, self.qf.publish_many, [qp.Event(-1)])
+        self.assertEqual(a1._queue.qsize(), 0)
+        self.assertEqual(len(self.qf._subscribers), qp.SIGNAL_SLOTS)
+
+    def hold_locks(self, *locks):
+        """Hold locks in another thread until tearDown"""
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            for lock in locks:
+                lock.acquire()
+            locked.set()
+            release.wait()
+            for lock in reversed(locks):
+                lock.release()
+        holder = threading.Thread(target=hold)
+        holder.start()
+        locked.wait()
+        self.holders.append((release, holder))
+
+    def test_that_publish_does_not_take_framework_locks(self):
+        # Given a subscriber and all framework locks held by another thread
+        a = self.add_active(1)
+        a.subscribe(qp.USER_SIG)
+        self.hold_locks(self.qf._active_lock, self.qf._subscriber_lock,
+                        self.qf._timer_lock)
+        # When publishing
+        self.qf.publish(qp.Event(qp.USER_SIG))
+        # Then the event is delivered without waiting for the locks
+        self.assertEqual(a._queue.qsize(), 1)
+
+    def test_that_timers_do_not_block_subscriptions(self):
+        # Given an active and the timer lock held by another thread
+        a = self.add_active(1)
+        self.hold_locks(self.qf._timer_lock)
+        # When subscribing
+        a.subscribe(qp.USER_SIG)
+        # Then subscription and queue statistics are not blocked
+        self.assertEqual(self.qf._subscribers[qp.USER_SIG], (1,))
+        self.assertTrue(self.qf.get_queue_margins())
+
+    def test_that_publish_many_keeps_order_per_subscriber(self):
+        # Given one active subscribed to two signals, another to one of them
+        a1 = self.add_active(1)
+        a2 = self.add_active(2)
+        a1.subscribe(qp.USER_SIG)
+        a1.subscribe(qp.USER_SIG + 1)
+        a2.subscribe(qp.USER_SIG + 1)
+        events = [qp.Event(qp.USER_SIG), qp.Event(qp.USER_SIG + 1),
+                  qp.Event(qp.USER_SIG), qp.Event(qp.USER_SIG + 2)]
+        # When publishing a batch of events
+        delivered = self.qf.publish_many(events)
+        # Then each subscriber gets its share in publish order
+        self.assertEqual(delivered, {1: 3, 2: 1})
+        self.assertEqual(list(a1._queue.queue), events[:3])
+        self.assertEqual(list(a2._queue.queue), events[1:2])
+        self.assertEqual(a1._queue._max, 2)
+
+    def test_that_overflow_does_not_abort_multicast(self):
+        # Given two subscribers where the first one has a full queue
+        a1 = self.add_active(1)
+        a2 = self.add_active(2)
+        a1._queue = qp.QEQueue(0)
+        a1.subscribe(qp.USER_SIG)
+        a2.subscribe(qp.USER_SIG)
+        # When publishing
+        # Then the overflow is raised after posting to the other subscriber
+        self.assertRaises(qp.QueueOverflowError, self.qf.publish,
+                          qp.Event(qp.USER_SIG))
+        self.assertEqual(a2._queue.qsize(), 1)
+        self.assertEqual(self.qf.get_overflow_counts()[1]['raised'], 1)
+
+    def test_that_frameworks_are_independent(self):
+        # Given an active subscribed in each of two frameworks
+        a1 = self.add_active(1)
+        a1.subscribe(qp.USER_SIG)
+        other = qp.Framework()
+        a2 = self.add_active(1, other)
+        a2.subscribe(qp.USER_SIG)
+        # When publishing in one of them
+        self.qf.publish(qp.Event(qp.USER_SIG))
+        # Then only its own subscriber gets the event
+        self.assertEqual(a1._queue.qsize(), 1)
+        self.assertEqual(a2._queue.qsize(), 0)
+        self.assertFalse(qp.QF._active)
+
+    def test_that_timer_runs_in_framework_of_target(self):
+        # Given a timer posted to an active in a separate framework
+        a = self.add_active(1)
+        t = qp.TimeEvt(qp.USER_SIG)
+        t.post_in(a, 1)
+        # When the default framework ticks, nothing happens
+        qp.QF.tick()
+        self.assertEqual(a._queue.qsize(), 0)
+        # But when its own framework ticks, the timer expires
+        self.qf.tick()
+        self.assertEqual(a._queue.qsize(), 1)
+
+
+class TestSignalRegistry(unittest.TestCase):
+
+    def test_that_signals_get_dense_numbers_and_names(self):
+        signals = qp.SignalRegistry()
+        self.assertEqual(signals.register('FIXED', qp.USER_SIG + 1),
+                         qp.USER_SIG + 1)
+        self.assertEqual(signals.register('FIRST'), qp.USER_SIG)
+        self.assertEqual(signals.register('SECOND'), qp.USER_SIG + 2)
+        self.assertEqual(signals.register('FIRST'), qp.USER_SIG)
+        self.assertEqual(signals.signal('SECOND'), qp.USER_SIG + 2)
+        self.assertEqual(signals.name(qp.USER_SIG + 1), 'FIXED')
+        self.assertEqual(signals.name(qp.ENTRY_SIG), 'ENTRY')
+        self.assertEqual(signals.name(1000), '1000')
+        self.assertRaises(AssertionError, signals.register, 'OTHER',
+                          qp.USER_SIG)
+
+
+class TestWorkerPool(FrameworkTestCase):
+
+    def test_that_object_runs_on_one_worker_at_a_time(self):
+        # Given more active objects than workers
+        pool = qp.WorkerPool(workers=4, batch=2)
+        actives = [Recorder(self.log) for _n in range(10)]
+        for n, a in enumerate(actives):
+            a.start(n + 1, 20, None, self.qf, pool)
+        # When each gets a number of events
+        for sig in range(qp.USER_SIG, qp.USER_SIG + 10):
+            for a in actives:
+                a.post_fifo(qp.Event(sig))
+        self.wait_for_log(100)
+        for a in actives:
+            a.stop()
+        pool.stop()
+        # Then all are dispatched in order without overlapping
+        for a in actives:
+            sigs = [sig for p, sig in self.log if p == a._prio]
+            self.assertEqual(sigs, list(range(qp.USER_SIG, qp.USER_SIG + 10)))
+            self.assertFalse(a.overlapped)
+        self.assertFalse(self.qf._active)
+
+    def test_that_higher_prio_runs_first(self):
+        # Given a single worker busy with one object
+        pool = qp.WorkerPool(workers=1)
+        gate = threading.Event()
+        busy = Recorder(self.log, gate)
+        low = Recorder(self.log)
+        high = Recorder(self.log)
+        busy.start(3, 10, None, self.qf, pool)
+        low.start(1, 10, None, self.qf, pool)
+        high.start(2, 10, None, self.qf, pool)
+        busy.post_fifo(qp.Event(qp.USER_SIG))
+        # When a low prio object gets ready before a high prio object
+        low.post_fifo(qp.Event(qp.USER_SIG))
+        high.post_fifo(qp.Event(qp.USER_SIG))
+        gate.set()
+        self.wait_for_log(3)
+        for a in [busy, low, high]:
+            a.stop()
+        pool.stop()
+        # Then the high prio object is run first
+        self.assertEqual([p for p, sig in self.log], [3, 2, 1])
+
+    def test_that_event_posted_in_initial_transition_is_dispatched(self):
+        # Given an object posting to itself in its initial transition
+        pool = qp.WorkerPool(workers=1)
+        a = SelfStarter(self.log)
+        # When started in a pool
+        a.start(1, 10, None, self.qf, pool)
+        self.wait_for_log(1)
+        a.stop()
+        pool.stop()
+        # Then the event is dispatched
+        self.assertEqual(self.log, [(1, qp.USER_SIG)])
+
+    def test_that_block_policy_is_rejected(self):
+        a = Recorder(self.log)
+        a.overflow = qp.OVERFLOW_BLOCK
+        pool = qp.WorkerPool(workers=1)
+        self.addCleanup(pool.stop)
+        self.assertRaises(ValueError, a.start, 1, 10, None, self.qf, pool)
+
+    def test_that_failing_handler_is_logged_when_asked_and_in_pool(self):
+        pool = qp.WorkerPool(workers=1)
+        self.addCleanup(pool.stop)
+        for prio, cls, with_pool in [(1, LoggingFailer, None),
+                                     (2, Failer, pool)]:
+            # Given an object logging exceptions in its own thread and an
+            # object in a pool
+            del self.log[:]
+            a = cls(self.log)
+            a.start(prio, 10, None, self.qf, with_pool)
+            # When a handler raises an exception
+            with mock.patch.object(qp.qf.logger, 'exception') as exception:
+                a.post_fifo(qp.Event(Failer.FAIL_SIG))
+                a.post_fifo(qp.Event(qp.USER_SIG))
+                self.wait_for_log(1)
+            a.stop()
+            # Then it is logged and the next event is dispatched
+            self.assertEqual(exception.call_count, 1)
+            self.assertEqual(self.log, [(prio, qp.USER_SIG)])
+
+    def test_that_failing_handler_ends_thread_by_default(self):
+        # Given an object in its own thread
+        a = Failer(self.log)
+        a.start(1, 10, None, self.qf)
+        # When a handler raises an exception
+        with mock.patch('sys.stderr'):  # Traceback printed by threading
+            a.post_fifo(qp.Event(Failer.FAIL_SIG))
+            a._thread.join(10.0)
+        # Then the thread has ended, the object did not finish
+        self.assertFalse(a._thread.is_alive())
+        self.assertFalse(a._finished.is_set())
+
+
+class LaneRecorder(Recorder):
+
+    lane_sizes = [2, 1]
+    lanes = {qp.USER_SIG + 1: 1, qp.USER_SIG + 2: 2}
+
+
+class DroppingRecorder(Recorder):
+
+    overflow = qp.OVERFLOW_DROP_OLDEST
+
+
+class TestLanes(unittest.TestCase):
+
+    def setUp(self):
+        self.qf = qp.Framework()
+        self.log = []
+        self.gate = threading.Event()
+        self.a = LaneRecorder(self.log, self.gate)
+        self.a.start(1, 10, None, self.qf)
+        self.addCleanup(self.qf.shutdown, True, 10.0)
+        self.addCleanup(self.gate.set)
+
+    def test_that_urgent_lanes_are_dispatched_first(self):
+        # Given an object busy with the first of four normal events
+        self.wait_until_busy()
+        for _n in range(3):
+            self.a.post_fifo(qp.Event(qp.USER_SIG))
+        # When posting to the urgent lanes by signal and by argument
+        self.a.post_fifo(qp.Event(qp.USER_SIG + 1))
+        self.a.post_fifo(qp.Event(qp.USER_SIG + 2))
+        self.a.post_fifo(qp.Event(qp.USER_SIG + 3), lane=1)
+        self.gate.set()
+        self.qf.shutdown(drain=True, timeout=10.0)
+        # Then the highest lane goes first, normal events go last
+        self.assertEqual([sig - qp.USER_SIG for p, sig in self.log],
+                         [0, 2, 1, 3, 0, 0, 0])
+
+    def wait_until_busy(self):
+        self.a.post_fifo(qp.Event(qp.USER_SIG))
+        while not self.a.busy:
+            time.sleep(0.001)
+
+    def test_that_lanes_have_own_capacity(self):
+        self.wait_until_busy()
+        self.a.post_fifo(qp.Event(qp.USER_SIG + 2))
+        self.assertRaises(qp.QueueOverflowError, self.a.post_fifo,
+                          qp.Event(qp.USER_SIG + 2))
+        for _n in range(10):
+            self.a.post_fifo(qp.Event(qp.USER_SIG))
+        lanes = self.qf.get_metrics()['actives'][0]['lanes']
+        self.assertEqual([lane['capacity'] for lane in lanes], [10, 2, 1])
+        self.assertEqual([lane['dropped'] for lane in lanes], [0, 0, 1])
+        self.assertEqual([lane['posts'] for lane in lanes], [11, 0, 1])
+        self.assertEqual(self.qf.get_metrics()['actives'][0]['posts'], 12)
+
+    def test_that_drop_oldest_keeps_urgent_events(self):
+        # Given a full normal lane dropping the oldest and an urgent event
+        q = qp.LaneQueue(2, [4], {qp.USER_SIG + 9: 1},
+                         qp.OVERFLOW_DROP_OLDEST)
+        q.post_fifo(qp.Event(qp.USER_SIG + 9))
+        # When posting more normal events than fit
+        for n in range(3):
+            q.post_fifo(qp.Event(qp.USER_SIG + n))
+        # Then the oldest normal event is dropped, the urgent one is kept
+        sigs = [q.get_nowait().sig - qp.USER_SIG for _n in range(3)]
+        self.assertEqual(sigs, [9, 1, 2])
+        self.assertTrue(q.empty())
+
+    def test_that_lane_is_rejected_without_urgent_lanes(self):
+        # Given an object without urgent lanes
+        a = Recorder(self.log)
+        a.start(2, 10, None, self.qf)
+        # When posting to an urgent lane, then ValueError is raised
+        self.assertRaises(ValueError, a.post_fifo, qp.Event(qp.USER_SIG),
+                          lane=1)
+        # And the normal lane may still be given
+        a.post_fifo(qp.Event(qp.USER_SIG), lane=0)
+
+    def test_that_lanes_out_of_range_are_rejected(self):
+        # Given an object with two urgent lanes, when posting to lanes
+        # it does not have, then ValueError is raised
+        for lane in [3, -1]:
+            self.assertRaises(ValueError, self.a.post_fifo,
+                              qp.Event(qp.USER_SIG), lane=lane)
+        self.assertEqual(self.a._queue.qsize(), 0)
+
+
+class TestShutdown(unittest.TestCase):
+
+    def setUp(self):
+        self.qf = qp.Framework()
+        self.log = []
+        self.gate = threading.Event()
+        self.actives = [Recorder(self.log, self.gate) for _n in range(2)]
+        for n, a in enumerate(self.actives):
+            a.start(n + 1, 10, None, self.qf)
+            a.subscribe(qp.USER_SIG)
+        # Queue up three events for each, one of them being dispatched
+        for _n in range(3):
+            self.qf.publish(qp.Event(qp.USER_SIG))
+
+    def release_gate(self):
+        time.sleep(0.01)
+        self.gate.set()
+
+    def test_that_shutdown_drains_queues(self):
+        threading.Thread(target=self.release_gate).start()
+        counts = self.qf.shutdown(drain=True, timeout=10.0)
+        for p in [1, 2]:
+            self.assertEqual((counts[p]['drained'], counts[p]['dropped']),
+                             (3, 0))
+        self.assertEqual(len(self.log), 6)
+        self.assertFalse(self.qf._active)
+        for a in self.actives:
+            self.assertFalse(a._thread.is_alive())
+
+    def test_that_shutdown_without_drain_drops_queued_events(self):
+        threading.Thread(target=self.release_gate).start()
+        counts = self.qf.shutdown(drain=False, timeout=10.0)
+        self.assertEqual(counts[2], {'name': 'Recorder', 'drained': 1,
+                                     'dropped': 2})
+
+    def start_busy(self, cls):
+        """Start object of cls at prio 3 with a queue of two events, busy
+        dispatching a first event until the gate is set"""
+        a = cls(self.log, self.gate)
+        a.start(3, 2, None, self.qf)
+        a.post_fifo(qp.Event(qp.USER_SIG))
+        while not a.busy:
+            time.sleep(0.001)
+        return a
+
+    def test_that_drop_oldest_keeps_the_stop_sentinel(self):
+        # Given an object dropping the oldest event, stopped with drain
+        # and a full queue
+        a = self.start_busy(DroppingRecorder)
+        for _n in range(2):
+            a.post_fifo(qp.Event(qp.USER_SIG))
+        a.stop(drain=True)
+        # When posting more events than fit
+        for _n in range(3):
+            a.post_fifo(qp.Event(qp.USER_SIG))
+        self.gate.set()
+        # Then the object still reaches the sentinel and finishes
+        self.assertTrue(a._finished.wait(10.0))
+        self.qf.shutdown(timeout=10.0)
+
+    def test_that_shutdown_counts_events_dropped_from_all_lanes(self):
+        # Given an object with three urgent and one normal event queued
+        a = self.start_busy(LaneRecorder)
+        for sig in [qp.USER_SIG + 1, qp.USER_SIG + 1, qp.USER_SIG + 2,
+                    qp.USER_SIG]:
+            a.post_fifo(qp.Event(sig))
+        # When shutting down without drain
+        threading.Thread(target=self.release_gate).start()
+        counts = self.qf.shutdown(drain=False, timeout=10.0)
+        # Then all four are counted as dropped
+        self.assertEqual(counts[3]['dropped'], 4)
+
+    def test_that_publish_is_ignored_after_shutdown(self):
+        self.gate.set()
+        self.qf.shutdown()
+        self.qf.publish(qp.Event(qp.USER_SIG))
+        self.assertEqual(len(self.log), 6)
+
+    def test_that_shutdown_stops_run_thread_and_allows_restart(self):
+        # Given a framework running in a thread
+        self.gate.set()
+        thread = self.qf.run_in_thread()
+        # When shutting down
+        self.qf.shutdown(timeout=10.0)
+        # Then the run thread has ended
+        self.assertFalse(thread.is_alive())
+        # When starting it again with a new active object
+        log = []
+        gate = threading.Event()
+        gate.set()
+        a = Recorder(log, gate)
+        a.start(3, 10, None, self.qf)
+        a.subscribe(qp.USER_SIG + 1)
+        thread = self.qf.run_in_thread()
+        # Then publishes are delivered again
+        self.qf.publish(qp.Event(qp.USER_SIG + 1))
+        self.qf.shutdown(timeout=10.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(log), 1)
+
+
+class TestThreadSafety(unittest.TestCase):
+
+    def run_threads(self, *targets):
+        """Run targets in threads until the first one returns. Returns list
+        of exceptions raised"""
+        done = threading.Event()
+        errors = []
+
+        def loop(target):
+            try:
+                while not done.is_set():
+                    target()
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=loop, args=(t,))
+                   for t in targets[1:]]
+        for thread in threads:
+            thread.start()
+        try:
+            targets[0]()
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+        return errors
+
+    def test_that_objects_come_and_go_while_posted_to_and_scraped(self):
+        # Given a pool and a framework
+        qf = qp.Framework()
+        pool = qp.WorkerPool(workers=2)
+        self.addCleanup(pool.stop)
+        recorders = []
+
+        def come_and_go():
+            for _n in range(200):
+                a = Recorder([])
+                a.start(1, 100, None, qf, pool)
+                recorders.append(a)
+                a.stop()
+                a._finished.wait(10.0)
+
+        def post():
+            for a in list(recorders[-2:]):
+                try:
+                    a.post_fifo(qp.Event(qp.USER_SIG))
+                except qp.QueueOverflowError:
+                    pass  # Finished, nobody takes the events
+        # When objects are added and finish while others post to them and
+        # read metrics
+        errors = self.run_threads(come_and_go, post, qf.get_metrics,
+                                  qf.get_queue_margins)
+        # Then nothing fails
+        self.assertEqual(errors, [])
+
+    def test_that_run_is_woken_while_it_starts_and_stops(self):
+        # Given a framework
+        qf = qp.Framework()
+
+        def start_and_stop():
+            for _n in range(50):
+                thread = qf.run_in_thread()
+                qf.stop()
+                thread.join()
+        # When run is woken while it is started and stopped
+        errors = self.run_threads(start_and_stop, qf._wake)
+        # Then nothing fails
+        self.assertEqual(errors, [])
+
+
+class TestTimers(FrameworkTestCase):
+
+    def setUp(self):
+        FrameworkTestCase.setUp(self)
+        self.start_recorder()
+
+    def test_that_monotonic_clock_does_not_go_back(self):
+        times = [qp.monotonic() for _n in range(1000)]
+        self.assertEqual(times, sorted(times))
+
+    def test_that_time_event_expires_between_ticks(self):
+        # Given a running framework
+        self.run_in_thread()
+        # When arming time events in fractions of a tick
+        t1 = qp.TimeEvt(qp.USER_SIG, self.qf)
+        t2 = qp.TimeEvt(qp.USER_SIG + 1, self.qf)
+        t3 = qp.TimeEvt(qp.USER_SIG + 2, self.qf)
+        start = qp.monotonic()
+        t1.post_in_seconds(self.recorder, 0.004)
+        t2.post_in_seconds(self.recorder, 0.0015)
+        t3.post_in_seconds(self.recorder, 0.003)
+        self.assertTrue(t3.disarm())
+        self.wait_for_log(2)
+        # Then they expire in deadline order, after their deadlines
+        self.assertEqual([sig for p, sig in self.log],
+                         [qp.USER_SIG + 1, qp.USER_SIG])
+        self.assertTrue(t2.ts - start >= 0.0015)
+        self.assertTrue(t1.ts - start >= 0.004)
+        metrics = self.qf.get_metrics()
+        self.assertEqual(metrics['timers_expired'], 2)
+        self.assertTrue(metrics['timer_lateness_max_s'] >= 0.0)
+
+    def test_that_late_ticks_are_caught_up(self):
+        # Given a running framework that is held up for 20 ticks
+        with self.qf._timer_lock:
+            self.run_in_thread()
+            start = qp.monotonic()
+            time.sleep(20 * qp.TICK_S)
+        # Then the missed ticks are run when it gets going again
+        time.sleep(qp.TICK_S)
+        elapsed = int((qp.monotonic() - start) / qp.TICK_S)
+        self.assertTrue(self.qf.get_time() >= elapsed - 2)
+        self.assertTrue(self.qf.get_metrics()['missed_ticks'] >= 15)
+
+    def tick(self, ticks):
+        for _n in range(ticks):
+            self.qf.tick()
+
+    def test_that_double_arming_is_detected(self):
+        t = qp.TimeEvt(qp.USER_SIG, self.qf)
+        t.post_in(self.recorder, 5)
+        self.assertRaises(AssertionError, t.post_in, self.recorder, 5)
+        self.assertRaises(AssertionError, t.post_every, self.recorder, 5)
+        self.assertEqual(self.qf.get_metrics()['armed_timers'], 1)
+
+    def test_that_arming_in_ticks_and_seconds_is_detected(self):
+        # Given one time event armed in ticks and one in seconds
+        t1 = qp.TimeEvt(qp.USER_SIG, self.qf)
+        t2 = qp.TimeEvt(qp.USER_SIG + 1, self.qf)
+        t1.post_in(self.recorder, 5)
+        t2.post_in_seconds(self.recorder, 5.0)
+        # When arming them the other way, then it is detected
+        self.assertRaises(AssertionError, t1.post_in_seconds, self.recorder,
+                          5.0)
+        self.assertRaises(AssertionError, t2.post_in, self.recorder, 5)
+        self.assertEqual(self.qf.get_metrics()['armed_timers'], 2)
+
+    def test_that_disarmed_deadlines_are_compacted(self):
+        # Given a time event armed in seconds and disarmed many times
+        t = qp.TimeEvt(qp.USER_SIG, self.qf)
+        for _n in range(1000):
+            t.post_in_seconds(self.recorder, 300.0)
+            t.disarm()
+        t.post_in_seconds(self.recorder, 300.0)
+        # Then the cancelled entries do not pile up in the heap
+        self.assertTrue(len(self.qf._deadlines) <= 2 * 65)
+        self.assertEqual(self.qf.get_metrics()['armed_timers'], 1)
+
+    def test_that_rearm_in_ticks_disarms_deadline(self):
+        # Given a running framework and a time event armed in seconds
+        self.run_in_thread()
+        t = qp.TimeEvt(qp.USER_SIG, self.qf)
+        t.post_in_seconds(self.recorder, 0.05)
+        # When rearmed in ticks
+        self.assertTrue(t.rearm(1))
+        time.sleep(0.1)
+        # Then it expires once
+        self.assertEqual(self.log, [(1, qp.USER_SIG)])
+        self.assertFalse(t.is_armed())
+
+    def test_that_rearm_and_disarm_track_armed_state(self):
+        t1 = qp.TimeEvt(qp.USER_SIG, self.qf)
+        t2 = qp.TimeEvt(qp.USER_SIG + 1, self.qf)
+        t1.post_in(self.recorder, 2)
+        t2.post_every(self.recorder, 3)
+        self.assertTrue(t1.rearm(4))
+        self.assertTrue(t2.is_armed())
+        self.tick(3)
+        self.wait_for_log(1)
+        self.assertEqual(self.log, [(1, qp.USER_SIG + 1)])
+        self.tick(1)
+        self.wait_for_log(2)
+        self.assertFalse(t1.is_armed())
+        self.assertFalse(t1.disarm())
+        self.assertTrue(t2.disarm())
+        self.assertFalse(t2.is_armed())
+        self.tick(10)
+        self.assertEqual(len(self.log), 2)
+        self.assertEqual(self.qf.get_metrics()['armed_timers'], 0)
+
+    def test_that_cancelled_entries_are_compacted(self):
+        timers = [qp.TimeEvt(qp.USER_SIG, self.qf) for _n in range(10)]
+        for t in timers:
+            t.post_in(self.recorder, 1000)
+        for _n in range(100):
+            for t in timers:
+                t.rearm(1000)
+        self.assertTrue(len(self.qf._timers) <= 2 * 10 + 64)
+        self.assertEqual(self.qf.get_metrics()['armed_timers'], 10)
+
+
+class TestWatch(FrameworkTestCase):
+
+    def setUp(self):
+        FrameworkTestCase.setUp(self)
+        self.start_recorder()
+        self.r, self.w = os.pipe()
+        self.addCleanup(os.close, self.r)
+        self.addCleanup(os.close, self.w)
+
+    def read(self, fd, events):
+        os.read(fd, 4096)
+        return qp.Event(qp.USER_SIG + events)
+
+    def test_that_readable_fd_posts_events(self):
+        # Given a running framework
+        self.run_in_thread()
+        # When the watched fd gets readable, before and after unwatch
+        self.recorder.watch(self.r, self.read)
+        os.write(self.w, b'x')
+        self.wait_for_log(1)
+        self.recorder.unwatch(self.r)
+        os.write(self.w, b'x')
+        time.sleep(0.05)
+        # Then the event from the factory is posted once
+        self.assertEqual(self.log, [(1, qp.USER_SIG + qp.IO_READ)])
+
+    def test_that_writable_fd_posts_events(self):
+        self.run_in_thread()
+        written = []
+
+        def write(fd, events):
+            written.append(os.write(fd, b'x'))
+            self.recorder.watch(fd, write, qp.IO_READ)  # Only once
+            return qp.Event(qp.USER_SIG + events)
+        self.recorder.watch(self.w, write, qp.IO_WRITE)
+        self.wait_for_log(1)
+        self.assertEqual(written, [1])
+        self.assertEqual(self.log, [(1, qp.USER_SIG + qp.IO_WRITE)])
+
+    def test_that_failing_factory_is_unwatched(self):
+        self.run_in_thread()
+
+        def fail(fd, events):
+            raise ValueError()
+        self.recorder.watch(self.r, fail)
+        os.write(self.w, b'x')
+        timeout = time.time() + 10.0
+        while self.qf._watches and time.time() < timeout:
+            time.sleep(0.001)
+        self.assertEqual(self.qf._watches, {})
+
+    def test_that_stopped_object_is_unwatched(self):
+        self.recorder.watch(self.r, self.read)
+        self.recorder.stop()
+        self.recorder._finished.wait(10.0)
+        self.assertEqual(self.qf._watches, {})
+
+    def test_that_poller_reports_readiness_with_and_without_epoll(self):
+        for use_epoll in (True, False):
+            poller = qp.qf._Poller(use_epoll)
+            poller.register(self.r, qp.IO_READ)
+            poller.register(self.w, qp.IO_READ | qp.IO_WRITE)
+            self.assertEqual(poller.poll(0), [(self.w, qp.IO_WRITE)])
+            os.write(self.w, b'x')
+            poller.unregister(self.w)
+            self.assertEqual(poller.poll(0), [(self.r, qp.IO_READ)])
+            os.read(self.r, 1)
+            poller.close()
@@ -0,0 +1,90 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test the unittest helpers of qptest"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import unittest
+
+# External
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+# Local
+import qp
+
+PING_SIG = qp.USER_SIG
+
+
+class TestImport(unittest.TestCase):
+
+    def test_that_qptest_is_imported_without_qif(self):
+        # Given that qif cannot be imported
+        with mock.patch.dict(sys.modules, {'qif': None}):
+            sys.modules.pop('qp.qptest', None)
+            # When importing qptest, then it succeeds
+            module = __import__('qp.qptest', fromlist=['QpTester'])
+        self.assertTrue(hasattr(module, 'QpUnitTest'))
+
+
+class TestQpTester(unittest.TestCase):
+
+    def setUp(self):
+        import qp.qptest
+        self.tester = qp.qptest.QpTester()
+        self.tester.setUp()
+        self.addCleanup(self.tester.tearDown)
+
+    def test_that_published_events_are_matched(self):
+        e = qp.Event(PING_SIG)
+        e.par = 5
+        qp.QF.publish(e)
+        self.tester.assertPublished(PING_SIG, 5)
+        with mock.patch('sys.stdout'):  # Published events are printed
+            self.tester.assertNotPublished(PING_SIG, 6)
+        self.assertEqual(self.tester.getPublished(PING_SIG), [e])
@@ -0,0 +1,194 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test shared memory ring buffer transport"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Local
+import qp
+import qp.codec
+import qp.ring
+
+READING_SIG = qp.USER_SIG
+TICK_SIG = qp.USER_SIG + 1
+
+
+class Reading(qp.Event):
+
+    fields = [('sensor', 'i'), ('value', 'd')]
+
+    def __init__(self, sensor, value):
+        qp.Event.__init__(self, READING_SIG)
+        self.sensor = sensor
+        self.value = value
+
+
+CODEC = qp.codec.Codec()
+CODEC.register(READING_SIG, Reading)
+CODEC.register(TICK_SIG, qp.Event)
+
+
+class Collector(qp.Active):
+
+    signals = [READING_SIG]
+
+    def __init__(self, expected):
+        qp.Active.__init__(self, Collector.initial)
+        self.expected = expected
+        self.events = []
+        self.done = threading.Event()
+
+    def initial(self, e):
+        self.INIT(Collector.collecting)
+
+    def collecting(self, e):
+        if e.sig == READING_SIG:
+            self.events.append(e)
+            if len(self.events) == self.expected:
+                self.done.set()
+            return 0
+        return qp.Hsm.top
+
+
+class OverflowingTarget(object):
+    """Target of RingReader overflowing on the first batch"""
+
+    def __init__(self):
+        self.events = []
+        self.done = threading.Event()
+
+    def post_fifo_many(self, events):
+        if not self.done.is_set():
+            self.done.set()
+            raise qp.QueueOverflowError()
+        self.events.extend(events)
+
+
+def produce(path, count):
+    ring = qp.ring.EventRing(path, CODEC)
+    for n in range(count):
+        ring.post(Reading(n, n / 2.0))
+    ring.close()
+
+
+class TestEventRing(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'ring')
+
+    def make_ring(self, **kwargs):
+        ring = qp.ring.EventRing(self.path, CODEC, create=True, **kwargs)
+        self.addCleanup(ring.close)
+        return ring
+
+    def test_that_events_are_decoded_with_fields(self):
+        ring = self.make_ring()
+        ring.post(Reading(3, 1.5))
+        ring.post(qp.Event(TICK_SIG))
+        e1, e2 = ring.read(timeout=0)
+        self.assertTrue(isinstance(e1, Reading))
+        self.assertEqual((e1.sig, e1.sensor, e1.value), (READING_SIG, 3, 1.5))
+        self.assertEqual(e2.sig, TICK_SIG)
+        self.assertEqual(ring.read(timeout=0), [])
+
+    def test_that_full_ring_times_out_and_wraps_around(self):
+        ring = self.make_ring(slots=4)
+        for n in range(4):
+            ring.post(Reading(n, 0.0))
+        self.assertRaises(qp.ring.RingFullError, ring.post,
+                          Reading(4, 0.0), 0.01)
+        self.assertEqual([e.sensor for e in ring.read(2)], [0, 1])
+        ring.post(Reading(4, 0.0))
+        ring.post(Reading(5, 0.0))
+        self.assertEqual([e.sensor for e in ring.read()], [2, 3, 4, 5])
+
+    def test_that_events_from_other_process_are_published(self):
+        # Given a ring read into a framework with a subscriber
+        ring = self.make_ring(slots=64)
+        qf = qp.Framework()
+        collector = Collector(1000)
+        collector.start(1, 2000, None, qf)
+        self.addCleanup(collector.stop)
+        reader = qp.ring.RingReader(ring, qf)
+        reader.start()
+        self.addCleanup(reader.stop)
+        # When another process writes to the ring
+        producer = multiprocessing.Process(target=produce,
+                                           args=(self.path, 1000))
+        producer.start()
+        producer.join()
+        # Then all events are published in order
+        collector.done.wait(10.0)
+        self.assertEqual([e.sensor for e in collector.events],
+                         list(range(1000)))
+
+    def test_that_reader_survives_overflow(self):
+        # Given a reader whose target overflows on the first batch
+        ring = self.make_ring()
+        target = OverflowingTarget()
+        reader = qp.ring.RingReader(ring, target)
+        reader.start()
+        self.addCleanup(reader.stop)
+        ring.post(Reading(1, 0.0))
+        target.done.wait(10.0)
+        # When more events are written
+        ring.post(Reading(2, 0.0))
+        # Then they are delivered and the overflow is counted
+        timeout = time.time() + 10.0
+        while not target.events and time.time() < timeout:
+            time.sleep(0.001)
+        self.assertEqual([e.sensor for e in target.events], [2])
+        self.assertEqual(reader.overflows, 1)
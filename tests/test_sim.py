@@ -0,0 +1,138 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test deterministic simulation in virtual time"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import unittest
+
+# Local
+import qp
+import qp.sim
+
+TIMEOUT_SIG = qp.USER_SIG
+WORK_SIG = qp.USER_SIG + 1
+
+
+class Sleeper(qp.Active):
+    """Sleeps a random number of ticks between timeouts, logging the time of
+    each timeout"""
+
+    signals = [WORK_SIG]
+
+    def __init__(self, sim, log):
+        qp.Active.__init__(self, Sleeper.initial)
+        self.sim = sim
+        self.log = log
+        self.timer = qp.TimeEvt(TIMEOUT_SIG)
+
+    def initial(self, e):
+        self.INIT(Sleeper.sleeping)
+
+    def sleeping(self, e):
+        if e.sig == qp.ENTRY_SIG:
+            self.timer.post_in(self, self.sim.random.randint(1, 6000))
+            return 0
+        elif e.sig == TIMEOUT_SIG:
+            self.log.append((self._prio, self.sim.get_time()))
+            self.TRAN(Sleeper.sleeping)
+            return 0
+        elif e.sig == WORK_SIG:
+            self.log.append((self._prio, e.n))
+            return 0
+        return qp.Hsm.top
+
+
+class TestSimulator(unittest.TestCase):
+
+    def simulate(self, seed, ticks):
+        sim = qp.sim.Simulator(seed=seed)
+        log = []
+        for prio in (1, 2):
+            Sleeper(sim, log).start(prio, 10, None, sim, sim)
+        sim.run(ticks)
+        return sim, log
+
+    def test_that_virtual_time_jumps_to_next_timeout(self):
+        day = 24 * 3600 * 1000 // qp.TICK
+        sim, log = self.simulate(1, day)
+        self.assertEqual(sim.get_time(), day)
+        self.assertEqual(sim.clock(), day * qp.TICK_S)
+        self.assertTrue(len(log) > 2 * day / 6000)
+        self.assertEqual(log, sorted(log, key=lambda entry: entry[1]))
+
+    def test_that_runs_with_same_seed_are_identical(self):
+        self.assertEqual(self.simulate(7, 100000)[1],
+                         self.simulate(7, 100000)[1])
+        self.assertNotEqual(self.simulate(7, 100000)[1],
+                            self.simulate(8, 100000)[1])
+
+    def test_that_time_events_in_seconds_expire_on_ticks(self):
+        sim, log = self.simulate(1, 0)
+        t = qp.TimeEvt(WORK_SIG, sim)
+        t.n = 'hour'
+        t.post_in_seconds(sim._active[1], 3600.0)
+        hour = 3600 * 1000 // qp.TICK
+        sim.run(hour + 1)
+        self.assertTrue((1, 'hour') in log)
+        self.assertEqual(t.ts, hour * qp.TICK_S)
+
+    def test_that_highest_prio_dispatches_first(self):
+        sim, log = self.simulate(1, 0)
+        for n in range(3):
+            e = qp.Event(WORK_SIG)
+            e.n = n
+            sim.publish(e)
+        sim.run_until_idle()
+        self.assertEqual(log, [(2, 0), (2, 1), (2, 2), (1, 0), (1, 1), (1, 2)])
+
+    def test_that_stopped_objects_leave(self):
+        sim, log = self.simulate(1, 0)
+        for a in sim._active.values():
+            a.stop()
+        sim.run()
+        self.assertEqual(sim._active, {})
+        self.assertFalse(sim._running)
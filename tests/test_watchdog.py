@@ -0,0 +1,123 @@
+# -----------------------------------------------------------------------------
+# QP/Python Library
+#
+# Port of Miro Samek's Quantum Framework to Python. The implementation takes
+# the liberty to depart from Miro Samek's code where the specifics of desktop
+# systems (compared to embedded systems) seem to warrant a different approach.
+#
+# Reference:
+# Practical Statecharts in C/C++; Quantum Programming for Embedded Systems
+# Author: Miro Samek, Ph.D.
+# http://www.state-machine.com/
+#
+# -----------------------------------------------------------------------------
+#
+# Copyright (C) 2008-2014, Autolabel AB
+# All rights reserved
+# Author(s): Henrik Bohre (henrik.bohre@autolabel.se)
+#
+#
+#   Redistribution and use in source and binary forms, with or without
+#   modification, are permitted provided that the following conditions
+#   are met:
+#
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     - Neither the name of Autolabel AB, nor the names of its contributors
+#       may be used to endorse or promote products derived from this
+#       software without specific prior written permission.
+#
+#   THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#   "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#   LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#   FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL
+#   THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#   INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+#   (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+#   SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+#   HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+#   STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#   ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+#   OF THE POSSIBILITY OF SUCH DAMAGE.
+# -----------------------------------------------------------------------------
+
+"""Test run-to-completion watchdog"""
+
+# Standard
+import sys
+sys.path.insert(0, '..')
+import threading
+import unittest
+
+# Local
+import qp
+import qp.watchdog
+
+SLOW_SIG = qp.register_signal('SLOW')
+
+
+class Sleeper(qp.Active):
+
+    def __init__(self):
+        qp.Active.__init__(self, Sleeper.initial)
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def initial(self, e):
+        self.INIT(Sleeper.sleeping)
+
+    def sleeping(self, e):
+        if e.sig == SLOW_SIG:
+            self.entered.set()
+            self.release.wait(5.0)
+            return 0
+        return qp.Hsm.top
+
+
+class TestWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.qf = qp.Framework()
+        self.sleeper = Sleeper()
+        self.sleeper.start(1, 10, None, self.qf)
+        self.addCleanup(self.sleeper.stop)
+        self.addCleanup(self.sleeper.release.set)
+        self.watchdog = qp.watchdog.Watchdog(self.qf, budget_s=0.05)
+
+    def test_that_slow_dispatch_is_reported_once(self):
+        # Given an object stuck in a dispatch
+        self.sleeper.post_fifo(qp.Event(SLOW_SIG))
+        self.sleeper.entered.wait(5.0)
+        start = self.sleeper._dispatch_start
+        # When sampled within and twice over the budget
+        self.assertEqual(self.watchdog.check(start + 0.01), [])
+        incident, = self.watchdog.check(start + 0.1)
+        self.assertEqual(self.watchdog.check(start + 0.2), [])
+        # Then it is reported once with state, signal and stack
+        self.assertEqual(incident['name'], self.sleeper._name())
+        self.assertEqual(incident['state'], 'sleeping')
+        self.assertEqual(incident['sig'], SLOW_SIG)
+        self.assertEqual(incident['signal'], 'SLOW')
+        self.assertTrue('self.release.wait' in incident['stack'])
+        self.assertEqual(list(self.watchdog.incidents), [incident])
+        metrics, = self.qf.get_metrics()['actives']
+        self.assertEqual(metrics['slow_dispatches'], 1)
+
+    def test_that_sampler_thread_reports_slow_dispatch(self):
+        incidents = []
+        watchdog = qp.watchdog.Watchdog(self.qf, budget_s=0.05,
+                                        on_incident=incidents.append)
+        watchdog.start()
+        self.addCleanup(watchdog.stop)
+        self.sleeper.post_fifo(qp.Event(SLOW_SIG))
+        self.sleeper.entered.wait(5.0)
+        for _n in range(100):
+            if incidents:
+                break
+            threading.Event().wait(0.02)
+        self.assertEqual([i['sig'] for i in incidents], [SLOW_SIG])
+
+    def test_that_idle_objects_are_not_reported(self):
+        self.assertEqual(self.watchdog.check(), [])
+